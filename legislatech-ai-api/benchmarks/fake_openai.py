@@ -0,0 +1,104 @@
+# benchmarks/fake_openai.py
+"""
+Servidor local que imita a API da OpenAI para benchmarks sem gastar tokens:
+/v1/chat/completions (com e sem streaming) e /v1/embeddings, com latências configuráveis.
+
+    python -m benchmarks.fake_openai --port 18000 --latency 0.3 --token-interval 0.02 --tokens 300
+
+Aponte a API para ele com OPENAI_BASE_URL=http://127.0.0.1:18000/v1.
+Os embeddings são determinísticos (derivados do hash do texto) e normalizados, então o
+mesmo texto sempre cai no mesmo ponto do espaço vetorial.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import numpy as np
+from aiohttp import web
+
+PALAVRAS = (
+    "A lei estabelece normas de proteção e defesa do consumidor, de ordem pública e interesse social, "
+    "e dispõe sobre direitos, deveres, prazos, sanções administrativas e competências dos órgãos."
+).split()
+
+
+def _tokens(texto: str) -> int:
+    # Aproximação suficiente para o consumo reportado em `usage`
+    return max(1, len(texto) // 4)
+
+
+def _embedding(texto: str, dim: int) -> list[float]:
+    semente = int.from_bytes(hashlib.sha256(texto.encode()).digest()[:8], "little")
+    vetor = np.random.default_rng(semente).standard_normal(dim).astype(np.float32)
+    return (vetor / np.linalg.norm(vetor)).tolist()
+
+
+def _resposta_curta(prompt: str) -> str:
+    # Imita os helpers da API: rerank (números), intenção (JSON) e reescritas (linhas)
+    if "números dos trechos" in prompt:
+        return "1, 2, 3, 4, 5"
+    if "JSON" in prompt:
+        return json.dumps({"use_sql": False})
+    return "\n".join(f"Variação {i + 1}: {' '.join(random.sample(PALAVRAS, 8))}" for i in range(3))
+
+
+def criar_app(latencia: float, intervalo_token: float, n_tokens: int, dim: int) -> web.Application:
+    async def chat(request: web.Request):
+        body = await request.json()
+        prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []))
+        await asyncio.sleep(latencia)
+
+        if not body.get("stream"):
+            conteudo = _resposta_curta(prompt)
+            return web.json_response({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": conteudo}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": _tokens(prompt), "completion_tokens": _tokens(conteudo), "total_tokens": _tokens(prompt) + _tokens(conteudo)},
+            })
+
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await resp.prepare(request)
+        for i in range(n_tokens):
+            if intervalo_token:
+                await asyncio.sleep(intervalo_token)
+            chunk = {"object": "chat.completion.chunk", "choices": [{"index": 0, "delta": {"content": PALAVRAS[i % len(PALAVRAS)] + " "}}]}
+            await resp.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+        if body.get("stream_options", {}).get("include_usage"):
+            usage = {"prompt_tokens": _tokens(prompt), "completion_tokens": n_tokens, "total_tokens": _tokens(prompt) + n_tokens}
+            await resp.write(f"data: {json.dumps({'object': 'chat.completion.chunk', 'choices': [], 'usage': usage})}\n\n".encode())
+        await resp.write(b"data: [DONE]\n\n")
+        await resp.write_eof()
+        return resp
+
+    async def embeddings(request: web.Request):
+        body = await request.json()
+        entradas = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        await asyncio.sleep(latencia / 3)
+        dimensoes = body.get("dimensions") or dim
+        data = [{"object": "embedding", "index": i, "embedding": _embedding(str(texto), dimensoes)} for i, texto in enumerate(entradas)]
+        total = sum(_tokens(str(t)) for t in entradas)
+        return web.json_response({"object": "list", "data": data, "model": body.get("model"), "usage": {"prompt_tokens": total, "total_tokens": total}})
+
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app.router.add_post("/v1/chat/completions", chat)
+    app.router.add_post("/v1/embeddings", embeddings)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI falsa para benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--latency", type=float, default=0.3, help="Latência até o primeiro byte (s)")
+    parser.add_argument("--token-interval", type=float, default=0.02, help="Intervalo entre tokens do streaming (s)")
+    parser.add_argument("--tokens", type=int, default=300, help="Tokens por resposta em streaming")
+    parser.add_argument("--dim", type=int, default=3072, help="Dimensão dos embeddings (text-embedding-3-large = 3072)")
+    args = parser.parse_args()
+    web.run_app(criar_app(args.latency, args.token_interval, args.tokens, args.dim), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# benchmarks/load.py
+"""
+Gera tráfego concorrente em POST /v1, /v2 e /v3 /responses e reporta, por rota,
+p50/p95/p99 do tempo até o primeiro token (primeiro `response.output_text.delta`),
+da latência total e as requisições por segundo.
+
+    python -m benchmarks.load --url http://127.0.0.1:8000 --routes v1,v2,v3 \
+        --concurrency 20 --requests 200 --user admin --password secret
+
+Cada pergunta recebe um sufixo único para não cair nos caches de resposta; para medir
+o pipeline inteiro rode a API com ANSWER_CACHE_SIZE=0 e SEMANTIC_CACHE_THRESHOLD=1.01.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import Counter
+import aiohttp
+import numpy as np
+
+PERGUNTAS = [
+    "Quais são as práticas abusivas vedadas ao fornecedor?",
+    "Qual o prazo para o licenciamento ambiental de um empreendimento?",
+    "Quais direitos o titular tem sobre o tratamento de dados pessoais?",
+    "Em que casos a administração pública pode dispensar licitação?",
+    "Qual a multa para infração gravíssima cometida pelo condutor?",
+    "Quem tem direito a benefício previdenciário do INSS?",
+    "Como é constituído o crédito tributário pela Receita Federal?",
+    "Quais leis sobre vigilância sanitária foram sancionadas em 2020?",
+    "O que diz a medida provisória sobre medidas cautelares da autoridade policial?",
+    "Quais são as diretrizes curriculares para instituições de ensino?",
+]
+
+
+async def uma_requisicao(sessao: aiohttp.ClientSession, url: str, rota: str, pergunta: str) -> dict:
+    body = {"input": [{"role": "user", "content": [{"type": "input_text", "text": pergunta}]}]}
+    inicio = time.perf_counter()
+    ttft = None
+    try:
+        async with sessao.post(f"{url}/{rota}/responses", json=body) as resp:
+            if resp.status != 200:
+                await resp.read()
+                return {"rota": rota, "ok": False, "status": resp.status}
+            async for linha in resp.content:
+                if ttft is None and linha.startswith(b"data:") and b'"response.output_text.delta"' in linha:
+                    ttft = time.perf_counter() - inicio
+    except aiohttp.ClientError as e:
+        return {"rota": rota, "ok": False, "status": type(e).__name__}
+    return {"rota": rota, "ok": True, "ttft": ttft, "total": time.perf_counter() - inicio}
+
+
+def _percentis(valores: list[float]) -> str:
+    if not valores:
+        return "-"
+    p50, p95, p99 = np.percentile(np.array(valores) * 1000, [50, 95, 99])
+    return f"{p50:8.0f} {p95:8.0f} {p99:8.0f}"
+
+
+def relatorio(resultados: list[dict], duracao: float) -> dict:
+    print(f"\n{'rota':<5} {'ok':>5} {'erros':>6} {'rps':>7} | {'ttft p50':>8} {'p95':>8} {'p99':>8} | {'total p50':>9} {'p95':>8} {'p99':>8}  (ms)")
+    resumo = {}
+    for rota in sorted({r["rota"] for r in resultados}):
+        da_rota = [r for r in resultados if r["rota"] == rota]
+        ok = [r for r in da_rota if r["ok"]]
+        ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+        totais = [r["total"] for r in ok]
+        erros = [r["status"] for r in da_rota if not r["ok"]]
+        rps = len(ok) / duracao if duracao else 0.0
+        print(f"{rota:<5} {len(ok):>5} {len(erros):>6} {rps:>7.2f} | {_percentis(ttfts)} | {' ' + _percentis(totais)}")
+        resumo[rota] = {
+            "ok": len(ok),
+            "erros": dict(Counter(str(e) for e in erros)),
+            "rps": rps,
+            "ttft_ms": dict(zip(("p50", "p95", "p99"), np.percentile(np.array(ttfts) * 1000, [50, 95, 99]).tolist())) if ttfts else None,
+            "total_ms": dict(zip(("p50", "p95", "p99"), np.percentile(np.array(totais) * 1000, [50, 95, 99]).tolist())) if totais else None,
+        }
+    print(f"\n⏱️ {len(resultados)} requisições em {duracao:.1f}s ({len(resultados) / duracao:.2f} req/s no total)")
+    return resumo
+
+
+async def executar(args) -> dict:
+    rotas = [r.strip() for r in args.routes.split(",") if r.strip()]
+    fila: asyncio.Queue = asyncio.Queue()
+    for i in range(args.requests):
+        pergunta = f"{random.choice(PERGUNTAS)} ({uuid.uuid4().hex[:8]})"
+        fila.put_nowait((rotas[i % len(rotas)], pergunta))
+
+    resultados: list[dict] = []
+    auth = aiohttp.BasicAuth(args.user, args.password) if args.user else None
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    conector = aiohttp.TCPConnector(limit=args.concurrency)
+
+    async with aiohttp.ClientSession(auth=auth, timeout=timeout, connector=conector) as sessao:
+        async def trabalhador():
+            while not fila.empty():
+                rota, pergunta = fila.get_nowait()
+                resultados.append(await uma_requisicao(sessao, args.url.rstrip("/"), rota, pergunta))
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(trabalhador() for _ in range(args.concurrency)))
+        duracao = time.perf_counter() - inicio
+
+    return relatorio(resultados, duracao)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga concorrente nas rotas /responses")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--routes", default="v1,v2,v3", help="Rotas separadas por vírgula")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100, help="Total de requisições (distribuídas entre as rotas)")
+    parser.add_argument("--user", default=None, help="Usuário do Basic Auth")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", default=None, help="Grava o resumo em JSON neste arquivo")
+    args = parser.parse_args()
+    resumo = asyncio.run(executar(args))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(resumo, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
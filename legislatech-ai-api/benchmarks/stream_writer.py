@@ -0,0 +1,90 @@
+# benchmarks/stream_writer.py
+"""
+Compara o laço de streaming antigo (um evento por delta, sleep de 10 ms e concatenação
+de string) com o DeltaStreamWriter, em vários streams simultâneos.
+
+Mede tokens/s agregados, eventos SSE enviados e a utilização do event loop
+(tempo de CPU da thread do loop / tempo de parede).
+
+    python -m benchmarks.stream_writer --streams 50 --tokens 500 --token-interval 0.002
+"""
+import argparse
+import asyncio
+import time
+from utils.sse import make_sse_event
+from utils.stream_writer import DeltaStreamWriter
+
+
+async def upstream_falso(n_tokens: int, intervalo: float):
+    """Simula o stream da OpenAI: um token a cada `intervalo` segundos (0 = sem espera)."""
+    for i in range(n_tokens):
+        if intervalo:
+            await asyncio.sleep(intervalo)
+        yield f" token{i}"
+
+
+async def laco_antigo(n_tokens: int, intervalo: float) -> tuple[int, int]:
+    full_text_content = ""
+    eventos = 0
+    async for content in upstream_falso(n_tokens, intervalo):
+        make_sse_event("response.output_text.delta", {
+            "type": "response.output_text.delta",
+            "item_id": "msg_bench",
+            "output_index": 1,
+            "content_index": 0,
+            "delta": content
+        })
+        eventos += 1
+        full_text_content += content
+        await asyncio.sleep(0.01)
+    return eventos, len(full_text_content)
+
+
+async def laco_writer(n_tokens: int, intervalo: float, flush_interval: float, flush_bytes: int) -> tuple[int, int]:
+    writer = DeltaStreamWriter("msg_bench", flush_interval=flush_interval, flush_bytes=flush_bytes)
+    eventos = 0
+    async for _ in writer.stream(upstream_falso(n_tokens, intervalo)):
+        eventos += 1
+    return eventos, len(writer.texto)
+
+
+async def medir(nome: str, fabrica, streams: int, n_tokens: int) -> dict:
+    inicio_parede, inicio_cpu = time.perf_counter(), time.thread_time()
+    resultados = await asyncio.gather(*(fabrica() for _ in range(streams)))
+    parede, cpu = time.perf_counter() - inicio_parede, time.thread_time() - inicio_cpu
+    eventos = sum(r[0] for r in resultados)
+    return {
+        "cenario": nome,
+        "tokens_s": streams * n_tokens / parede,
+        "tokens_s_por_stream": n_tokens / parede,
+        "eventos": eventos,
+        "duracao_s": parede,
+        "utilizacao_loop": cpu / parede,
+    }
+
+
+async def main_async(args):
+    cenarios = [
+        ("antes (sleep 10 ms, 1 evento/delta)", lambda: laco_antigo(args.tokens, args.token_interval)),
+        ("writer sem agrupamento", lambda: laco_writer(args.tokens, args.token_interval, 0, args.flush_bytes)),
+        (f"writer {args.flush_interval * 1000:.0f} ms / {args.flush_bytes} B", lambda: laco_writer(args.tokens, args.token_interval, args.flush_interval, args.flush_bytes)),
+    ]
+    print(f"{args.streams} streams x {args.tokens} tokens, upstream a cada {args.token_interval * 1000:.1f} ms")
+    print(f"{'cenário':<38} {'tokens/s':>10} {'tok/s/stream':>13} {'eventos':>9} {'duração':>9} {'loop':>6}")
+    for nome, fabrica in cenarios:
+        r = await medir(nome, fabrica, args.streams, args.tokens)
+        print(f"{r['cenario']:<38} {r['tokens_s']:>10.0f} {r['tokens_s_por_stream']:>13.0f} {r['eventos']:>9} {r['duracao_s']:>8.2f}s {r['utilizacao_loop']:>6.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do streaming SSE")
+    parser.add_argument("--streams", type=int, default=50)
+    parser.add_argument("--tokens", type=int, default=500)
+    parser.add_argument("--token-interval", type=float, default=0.002, help="Intervalo entre tokens do upstream (s)")
+    parser.add_argument("--flush-interval", type=float, default=0.05)
+    parser.add_argument("--flush-bytes", type=int, default=256)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,7 @@
 # app/config.py
 import os
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
-from sqlalchemy.ext.asyncio import create_async_engine
-from langchain_postgres import PGVector
-from langchain_openai import OpenAIEmbeddings
-from tiktoken import get_encoding
+from utils.lazy import LazySingleton
 
 # Carrega variáveis de ambiente do arquivo .env
 load_dotenv()
@@ -15,35 +11,189 @@ OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 CONNECTION_STRING = os.getenv("POSTGRES_CONNECTION_STRING")
 BASIC_AUTH_USERNAME = os.getenv("BASIC_AUTH_USERNAME")
 BASIC_AUTH_PASSWORD = os.getenv("BASIC_AUTH_PASSWORD")
+COLLECTION_NAME = os.getenv("PGVECTOR_COLLECTION", "michel_teste")
+
+# --- Cliente HTTP da OpenAI ---
+# A URL base pode apontar para um servidor local que imita a OpenAI (testes e benchmarks)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+OPENAI_POOL_LIMIT = int(os.getenv("OPENAI_POOL_LIMIT", "100"))
+OPENAI_POOL_LIMIT_PER_HOST = int(os.getenv("OPENAI_POOL_LIMIT_PER_HOST", "50"))
+OPENAI_KEEPALIVE_TIMEOUT = float(os.getenv("OPENAI_KEEPALIVE_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_REQUEST_TIMEOUT = float(os.getenv("OPENAI_REQUEST_TIMEOUT", "30"))
+OPENAI_STREAM_READ_TIMEOUT = float(os.getenv("OPENAI_STREAM_READ_TIMEOUT", "60"))
+# Orçamento da conta (0 = usar os limites informados nos cabeçalhos x-ratelimit-*),
+# espera máxima na fila antes de recusar com 503, tokens estimados de resposta sem
+# max_tokens e novas tentativas após um 429
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "0"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "0"))
+OPENAI_QUEUE_MAX_WAIT = float(os.getenv("OPENAI_QUEUE_MAX_WAIT", "10"))
+OPENAI_COMPLETION_ESTIMATE = int(os.getenv("OPENAI_COMPLETION_ESTIMATE", "800"))
+OPENAI_MAX_RETRIES_429 = int(os.getenv("OPENAI_MAX_RETRIES_429", "2"))
+# Custo de uma resposta completa, usado na admissão de cada rota (503 antes de abrir o stream):
+# chamadas à OpenAI e tokens do pipeline inteiro (filtros, refine, expansão, sub-queries,
+# rerank e a geração com até ~8000 tokens de contexto)
+OPENAI_ADMISSION_CALLS = {
+    "v1": int(os.getenv("OPENAI_ADMISSION_CALLS_V1", "4")),
+    "v2": int(os.getenv("OPENAI_ADMISSION_CALLS_V2", "8")),
+    "v3": int(os.getenv("OPENAI_ADMISSION_CALLS_V3", "1")),
+}
+OPENAI_ADMISSION_TOKENS = {
+    "v1": int(os.getenv("OPENAI_ADMISSION_TOKENS_V1", "11000")),
+    "v2": int(os.getenv("OPENAI_ADMISSION_TOKENS_V2", "14000")),
+    "v3": int(os.getenv("OPENAI_ADMISSION_TOKENS_V3", "6000")),
+}
+
+# Cache de completions: off | readwrite (helpers curtos) | record | replay (sem rede);
+# record/replay valem também para os embeddings de consultas (ver utils/query_embeddings.py)
+LLM_CACHE_MODE = os.getenv("LLM_CACHE_MODE", "readwrite")
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "4096"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH") or None
 
 # --- Instâncias Globais ---
+# Construídas no primeiro uso ou no aquecimento do lifespan (ver utils/warmup.py), para que
+# importar a configuração não abra conexões, não carregue o langchain nem o tokenizer
+
+def _criar_engine():
+    from sqlalchemy import create_engine
+    # Engine do SQLAlchemy com pool de conexões (síncrono)
+    return create_engine(
+        CONNECTION_STRING,
+        pool_size=5,
+        max_overflow=10,
+        pool_pre_ping=True
+    )
+
+
+# Comandos preparados guardados por conexão do pool assíncrono (0 desativa; necessário
+# atrás de um PgBouncer em modo transação)
+ASYNC_PREPARED_STATEMENT_CACHE_SIZE = int(os.getenv("ASYNC_PREPARED_STATEMENT_CACHE_SIZE", "500"))
+
+
+def _criar_async_engine():
+    from sqlalchemy.ext.asyncio import create_async_engine
+    # Engine assíncrono do SQLAlchemy
+    return create_async_engine(
+        CONNECTION_STRING.replace("postgresql://", "postgresql+asyncpg://"),
+        pool_size=5,
+        max_overflow=10,
+        pool_pre_ping=True,
+        connect_args={"prepared_statement_cache_size": ASYNC_PREPARED_STATEMENT_CACHE_SIZE},
+    )
+
+
+def _criar_embeddings():
+    from langchain_openai import OpenAIEmbeddings
+    # Modelo de embeddings da OpenAI
+    return OpenAIEmbeddings(model="text-embedding-3-large", base_url=OPENAI_BASE_URL)
+
+
+engine = LazySingleton("engine", _criar_engine)
+async_engine = LazySingleton("async_engine", _criar_async_engine)
+embeddings = LazySingleton("embeddings", _criar_embeddings)
+
+# Cache de embeddings de consultas (caminho vazio desativa a camada em disco)
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "2048"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH") or None
+
+# Cache de respostas completas (entradas e validade em segundos)
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# Cache semântico: similaridade de cosseno mínima para reaproveitar uma resposta
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "2048"))
+
+# --- Recuperação (fan-out das buscas expandidas e recursivas) ---
+# Máximo de buscas/chamadas simultâneas no processo e prazo por requisição (segundos)
+RETRIEVAL_MAX_CONCURRENCY = int(os.getenv("RETRIEVAL_MAX_CONCURRENCY", "16"))
+RETRIEVAL_BUDGET_SECONDS = float(os.getenv("RETRIEVAL_BUDGET_SECONDS", "6"))
+# Orçamento de latência até o primeiro token nas rotas v1 e v2 (ms; 0 = sem orçamento). O cabeçalho
+# X-Latency-Budget-Ms da requisição tem precedência; etapas opcionais cujo p95 não cabe são puladas
+LATENCY_BUDGET_MS = {
+    "v1": float(os.getenv("LATENCY_BUDGET_MS_V1", "0")),
+    "v2": float(os.getenv("LATENCY_BUDGET_MS_V2", "0")),
+}
+# Busca recursiva em largura: ramos expandidos por nível, profundidade, teto de buscas
+# por requisição e sub-queries geradas por ramo
+RECURSIVE_BEAM_WIDTH = int(os.getenv("RECURSIVE_BEAM_WIDTH", "3"))
+RECURSIVE_MAX_DEPTH = int(os.getenv("RECURSIVE_MAX_DEPTH", "2"))
+RECURSIVE_MAX_SEARCHES = int(os.getenv("RECURSIVE_MAX_SEARCHES", "12"))
+RECURSIVE_SUB_QUERIES = int(os.getenv("RECURSIVE_SUB_QUERIES", "2"))
+# Índice BM25 de todo o corpus (gerado offline com `python -m utils.bm25_index build`);
+# sem índice, as rotas voltam ao BM25 sobre os candidatos da busca vetorial
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH") or None
+# Retriever de cada rota: "bm25" (busca vetorial + índice BM25 em processo) ou
+# "pg_hybrid" (vetor + full-text fundidos numa única consulta SQL; ver utils/pg_retriever.py;
+# exige o índice ANN da coleção, senão a rota volta ao "bm25")
+RETRIEVER_V1 = os.getenv("RETRIEVER_V1", "bm25")
+RETRIEVER_V2 = os.getenv("RETRIEVER_V2", "bm25")
+# Busca vetorial: "langchain" (vector_store, sem índice) ou "pg_ann" (SQL próprio sobre
+# embedding::halfvec, que usa o índice ANN da coleção; exige pgvector >= 0.7). Ative pg_ann
+# só depois de `python -m utils.ann_index build`: sem o índice, cada busca percorre e converte
+# a coleção inteira
+VECTOR_SEARCH_BACKEND = os.getenv("VECTOR_SEARCH_BACKEND", "langchain")
+# Dimensão dos embeddings (text-embedding-3-large), usada no índice e nas buscas
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "3072"))
+# Parâmetros do índice ANN por rota (0 = padrão do pgvector): candidatos visitados no HNSW
+# (hnsw.ef_search) e listas percorridas no IVFFlat (ivfflat.probes); mais é mais recall e latência
+ANN_EF_SEARCH = {
+    "v1": int(os.getenv("ANN_EF_SEARCH_V1", "0")),
+    "v2": int(os.getenv("ANN_EF_SEARCH_V2", "0")),
+    "v3": int(os.getenv("ANN_EF_SEARCH_V3", "0")),
+}
+ANN_PROBES = {
+    "v1": int(os.getenv("ANN_PROBES_V1", "0")),
+    "v2": int(os.getenv("ANN_PROBES_V2", "0")),
+    "v3": int(os.getenv("ANN_PROBES_V3", "0")),
+}
+# Enriquecimento com chunks vizinhos (ver utils/enrichment.py): chunks no LRU em processo,
+# validade (s; 0 = sem validade) e maior janela de vizinhos após cada trecho
+ENRICHMENT_CACHE_SIZE = int(os.getenv("ENRICHMENT_CACHE_SIZE", "4096"))
+ENRICHMENT_CACHE_TTL = float(os.getenv("ENRICHMENT_CACHE_TTL", "600"))
+ENRICHMENT_MAX_WINDOW = int(os.getenv("ENRICHMENT_MAX_WINDOW", "4"))
+
+# --- Rerank ---
+# Backend: "local" (cross-encoder ONNX em CPU via FlashRank, com o LLM como fallback) ou "llm"
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "local")
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "ms-marco-MultiBERT-L-12")
+RERANKER_CACHE_DIR = os.getenv("RERANKER_CACHE_DIR", "/tmp/flashrank")
+# Trechos mantidos após o rerank, pares pontuados por lote e threads dedicadas
+RERANKER_TOP_N = int(os.getenv("RERANKER_TOP_N", "8"))
+RERANKER_BATCH_SIZE = int(os.getenv("RERANKER_BATCH_SIZE", "16"))
+RERANKER_THREADS = int(os.getenv("RERANKER_THREADS", "2"))
+
+# --- Streaming SSE ---
+# Deltas do LLM são agrupados num evento a cada intervalo (segundos) ou ao atingir o
+# tamanho em bytes; STREAM_FLUSH_INTERVAL=0 envia cada delta num evento próprio
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.05"))
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", "256"))
+# Buffer de eventos por resposta para reconexões com Last-Event-ID: validade (s),
+# eventos por resposta, respostas guardadas e espera por reconexão antes de cancelar (s).
+# A espera é curta de propósito: com uma espera longa a maioria das respostas termina (e gasta
+# os tokens) depois da desconexão; reconexões mais tardias refazem a pergunta
+STREAM_BUFFER_TTL = float(os.getenv("STREAM_BUFFER_TTL", "120"))
+STREAM_BUFFER_MAX_EVENTS = int(os.getenv("STREAM_BUFFER_MAX_EVENTS", "2048"))
+STREAM_BUFFER_MAX_RESPONSES = int(os.getenv("STREAM_BUFFER_MAX_RESPONSES", "1024"))
+STREAM_RESUME_GRACE = float(os.getenv("STREAM_RESUME_GRACE", "2"))
+
+def _criar_vector_store():
+    from langchain_postgres import PGVector
+    # Vector Store (PGVector) como singleton assíncrono
+    return PGVector(
+        embeddings=embeddings.obter(),
+        collection_name=COLLECTION_NAME,
+        connection=async_engine.obter(),
+        use_jsonb=True
+    )
+
+
+def _criar_tiktoken_encoder():
+    # O arquivo BPE é lido de TIKTOKEN_CACHE_DIR (pré-baixado na imagem, ver Dockerfile);
+    # sem ele, o tiktoken baixa o arquivo na primeira chamada
+    from tiktoken import get_encoding
+    return get_encoding("o200k_base")
 
-# Engine do SQLAlchemy com pool de conexões (síncrono)
-engine = create_engine(
-    CONNECTION_STRING,
-    pool_size=5,
-    max_overflow=10,
-    pool_pre_ping=True
-)
-
-# Engine assíncrono do SQLAlchemy
-async_engine = create_async_engine(
-    CONNECTION_STRING.replace("postgresql://", "postgresql+asyncpg://"),
-    pool_size=5,
-    max_overflow=10,
-    pool_pre_ping=True
-)
-
-# Modelo de embeddings da OpenAI
-embeddings = OpenAIEmbeddings(model="text-embedding-3-large")
-
-# Vector Store (PGVector) como singleton assíncrono
-vector_store = PGVector(
-    embeddings=embeddings,
-    collection_name="michel_teste",
-    connection=async_engine,
-    use_jsonb=True
-)
 
+vector_store = LazySingleton("vector_store", _criar_vector_store)
 # Encoder para contagem de tokens
-tiktoken_encoder = get_encoding("o200k_base")
+tiktoken_encoder = LazySingleton("tiktoken_encoder", _criar_tiktoken_encoder)
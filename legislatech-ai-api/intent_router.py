@@ -1,12 +1,23 @@
-import aiohttp
 import json
+from typing import AsyncIterator
 from sqlalchemy import text
+from config import OPENAI_API_KEY, COLLECTION_NAME, async_engine, engine
+from utils.metadata_filters import CAMPOS_SELECAO, normalizar_filtros, predicados_sql
+from utils.metrics import medir
+from utils.openai_client import OpenAIClient, openai_client
+from utils.openai_scheduler import OpenAISaturado, PRIORIDADE_OPCIONAL
 
 class IntentRouter:
     # A função __init__ e decide_intent continuam as mesmas.
-    def __init__(self, openai_api_key, engine):
+    def __init__(self, openai_api_key, engine, client: OpenAIClient | None = None, async_engine=None):
         self.api_key = openai_api_key
         self.engine = engine
+        # Engine assíncrono (asyncpg) do arun_sql, usado pelas rotas sem bloquear o event loop
+        self.async_engine = async_engine
+        # Usa o cliente compartilhado da aplicação, salvo se outro for informado
+        self.client = client or openai_client
+        # Se a coluna full-text (utils/pg_retriever.py setup) existe; verificado no primeiro run_sql
+        self._document_tsv: bool | None = None
 
     async def decide_intent(self, user_query: str) -> dict:
         # (Nenhuma alteração aqui, o código continua o mesmo da versão anterior)
@@ -69,70 +80,151 @@ Pergunta do usuário:
             "temperature": 0.0
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
-                json=payload
-            ) as resp:
-                resp.raise_for_status()
-                resp_json = await resp.json()
-                content = resp_json["choices"][0]["message"]["content"]
-                return json.loads(content)
+        resp_json = await self.client.chat_completion(payload, cache=True)
+        content = resp_json["choices"][0]["message"]["content"]
+        return json.loads(content)
 
 
-    # ATUALIZAÇÃO PRINCIPAL AQUI
-    def run_sql(self, sql_decision: dict) -> dict:
+    async def extrair_filtros(self, user_query: str) -> dict:
         """
-        Executa a query SQL e formata o resultado como um texto amigável.
+        Só os filtros de metadados da pergunta (ex.: "MPs de 2023 sobre energia" ->
+        {"ano": 2023, "tipo": "mpv"}), para restringir a busca semântica. Campos fora da
+        lista de utils/metadata_filters.py são descartados; em caso de erro, sem filtros
+        (OpenAISaturado é repassado, para a rota registrar a etapa como pulada).
+        """
+        prompt = f"""Extraia da pergunta abaixo apenas os filtros explícitos sobre os metadados de leis brasileiras:
+- `ano` (integer): ano de publicação.
+- `tipo` (text): ex.: 'mpv' para medidas provisórias, 'lei ordinaria', 'lei complementar', 'decreto'.
+- `num_lei` (number): o número da lei.
+- `main_sancionador` (text): nome completo de quem sancionou.
+Não deduza filtros que a pergunta não menciona. Responda apenas com um JSON no formato {{"filters": {{...}}}} (vazio se não houver filtros).
+
+Pergunta: \"\"\"{user_query}\"\"\"
+"""
+        payload = {
+            "model": "gpt-4o-mini",
+            "messages": [{"role": "user", "content": prompt}],
+            "response_format": {"type": "json_object"},
+            "temperature": 0.0,
+            "max_tokens": 100,
+        }
+        try:
+            with medir("filtros"):
+                resp_json = await self.client.chat_completion(payload, cache=True, prioridade=PRIORIDADE_OPCIONAL)
+            filtros = json.loads(resp_json["choices"][0]["message"]["content"]).get("filters") or {}
+        except OpenAISaturado:
+            raise
+        except Exception as e:
+            print(f"⚠️ Erro ao extrair filtros da pergunta: {e}")
+            return {}
+        return normalizar_filtros(filtros) if isinstance(filtros, dict) else {}
+
+    SQL_DOCUMENT_TSV = text(
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns "
+        "WHERE table_name = 'langchain_pg_embedding' AND column_name = 'document_tsv')"
+    )
+
+    def _tem_document_tsv(self) -> bool:
+        if self._document_tsv is None:
+            with self.engine.connect() as conn:
+                self._document_tsv = conn.execute(self.SQL_DOCUMENT_TSV).scalar()
+        return self._document_tsv
+
+    async def _atem_document_tsv(self) -> bool:
+        if self._document_tsv is None:
+            async with self.async_engine.connect() as conn:
+                self._document_tsv = (await conn.execute(self.SQL_DOCUMENT_TSV)).scalar()
+        return self._document_tsv
+
+    def _montar_sql(self, sql_decision: dict, document_tsv: bool) -> tuple[str, dict]:
+        """
+        SQL e parâmetros da decisão estruturada. Todo predicado gerado tem índice (ver
+        `python -m utils.metadata_filters setup`): coleção + filtros tipados, título por
+        trigramas e conteúdo pelo full-text.
         """
         filters = sql_decision.get("filters", {})
         text_terms = sql_decision.get("text_search_terms", [])
-        select_fields = sql_decision.get("select_fields", ["titulo", "link"])
+        # Só campos conhecidos entram no SELECT (os nomes vão direto no SQL)
+        select_fields = [f for f in sql_decision.get("select_fields", ["titulo", "link"]) if f in CAMPOS_SELECAO]
         aggregation = sql_decision.get("aggregation", "list")
 
-        where_clauses = []
-        params = {}
-        
-        for k, v in filters.items():
-            param_key = f"filter_{k}"
-            where_clauses.append(f"cmetadata->>'{k}' = :{param_key}")
-            params[param_key] = str(v)
+        # Filtros tipados (apoiados nos índices de expressão); campos fora da lista são ignorados
+        predicados, params = predicados_sql(filters)
+        where_clauses = ["e.collection_id = (SELECT uuid FROM langchain_pg_collection WHERE name = :colecao)"]
+        params["colecao"] = COLLECTION_NAME
+        if predicados:
+            where_clauses.append(predicados.removeprefix(" AND "))
 
         for i, term in enumerate(text_terms):
             param_key = f"term_{i}"
-            where_clauses.append(f"(cmetadata->>'titulo' ILIKE :{param_key} OR document ILIKE :{param_key})")
-            params[param_key] = f"%{term}%"
+            if document_tsv:
+                # Título: ILIKE pelo índice de trigramas; conteúdo: full-text pelo índice GIN
+                where_clauses.append(f"(e.cmetadata->>'titulo' ILIKE :{param_key}_like OR e.document_tsv @@ plainto_tsquery('portuguese', :{param_key}))")
+                params[param_key] = term
+            else:
+                where_clauses.append(f"(e.cmetadata->>'titulo' ILIKE :{param_key}_like OR e.document ILIKE :{param_key}_like)")
+            params[f"{param_key}_like"] = f"%{term}%"
 
-        where_sql = " AND ".join(where_clauses) if where_clauses else "TRUE"
+        where_sql = " AND ".join(where_clauses)
 
         if aggregation == "count":
-            sql = f"SELECT COUNT(DISTINCT SPLIT_PART(cmetadata->>'id', '_', 1)) AS total FROM langchain_pg_embedding WHERE {where_sql};"
+            sql = f"SELECT COUNT(DISTINCT SPLIT_PART(e.cmetadata->>'id', '_', 1)) AS total FROM langchain_pg_embedding e WHERE {where_sql};"
         else:
             # Garante que 'titulo' e 'link' estejam sempre presentes para a formatação
             if 'titulo' not in select_fields: select_fields.append('titulo')
             if 'link' not in select_fields: select_fields.append('link')
             
-            select_expr = ", ".join([f"cmetadata->>'{f}' AS {f}" for f in select_fields])
-            sql = f"SELECT DISTINCT {select_expr} FROM langchain_pg_embedding WHERE {where_sql} LIMIT 20;"
+            select_expr = ", ".join([f"e.cmetadata->>'{f}' AS {f}" for f in select_fields])
+            sql = f"SELECT DISTINCT {select_expr} FROM langchain_pg_embedding e WHERE {where_sql} LIMIT 20;"
+        return sql, params
+
+    @staticmethod
+    def _formatar(sql_decision: dict, rows: list[dict]) -> dict:
+        """Formatação da saída para texto."""
+        if sql_decision.get("aggregation", "list") == "count":
+            count = rows[0]["total"]
+            return {"resultado": f"Encontrei **{count}** documentos que correspondem aos seus critérios de busca."}
+        if not rows:
+            return {"resultado": "Não encontrei nenhum documento que corresponda à sua pesquisa."}
+
+        # Constrói a resposta em Markdown
+        resposta_formatada = "Encontrei os seguintes documentos para você:\n\n"
+        for row in rows:
+            titulo = row.get('titulo') or 'Título não disponível'
+            link = row.get('link', '#')
+            resposta_formatada += f"- **{titulo.strip()}**\n  - [Acessar texto completo]({link})\n"
+
+        return {"resultado": resposta_formatada}
 
+    # ATUALIZAÇÃO PRINCIPAL AQUI
+    def run_sql(self, sql_decision: dict) -> dict:
+        """
+        Executa a query SQL e formata o resultado como um texto amigável.
+        Síncrono (scripts e threads); nas rotas, use `arun_sql`.
+        """
+        sql, params = self._montar_sql(sql_decision, self._tem_document_tsv())
         with self.engine.connect() as conn:
-            result = conn.execute(text(sql), params).fetchall()
-            
-            # Formatação da saída para texto
-            if aggregation == "count":
-                count = result[0][0]
-                return {"resultado": f"Encontrei **{count}** documentos que correspondem aos seus critérios de busca."}
-            else:
-                rows = [dict(row._mapping) for row in result]
-                if not rows:
-                    return {"resultado": "Não encontrei nenhum documento que corresponda à sua pesquisa."}
-                
-                # Constrói a resposta em Markdown
-                resposta_formatada = "Encontrei os seguintes documentos para você:\n\n"
-                for row in rows:
-                    titulo = row.get('titulo', 'Título não disponível')
-                    link = row.get('link', '#')
-                    resposta_formatada += f"- **{titulo.strip()}**\n  - [Acessar texto completo]({link})\n"
-                
-                return {"resultado": resposta_formatada}
\ No newline at end of file
+            rows = [dict(row._mapping) for row in conn.execute(text(sql), params)]
+        return self._formatar(sql_decision, rows)
+
+    async def astream_sql(self, sql_decision: dict) -> AsyncIterator[dict]:
+        """
+        Linhas da consulta estruturada lidas aos poucos por um cursor no servidor (asyncpg),
+        sem bloquear o event loop. Os comandos preparados ficam no cache de cada conexão
+        do pool (ASYNC_PREPARED_STATEMENT_CACHE_SIZE).
+        """
+        sql, params = self._montar_sql(sql_decision, await self._atem_document_tsv())
+        async with self.async_engine.connect() as conn:
+            result = await conn.stream(text(sql), params)
+            async for row in result.mappings():
+                yield dict(row)
+
+    async def arun_sql(self, sql_decision: dict) -> dict:
+        """Versão assíncrona do run_sql; devolve também as linhas (`linhas`)."""
+        with medir("sql"):
+            rows = [row async for row in self.astream_sql(sql_decision)]
+        return {**self._formatar(sql_decision, rows), "linhas": rows}
+
+
+# Instância compartilhada (filtros das rotas semânticas e a rota /consulta)
+intent_router = IntentRouter(OPENAI_API_KEY, engine, async_engine=async_engine)
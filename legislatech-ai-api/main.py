@@ -1,14 +1,48 @@
 # app/main.py
-from fastapi import FastAPI
+import time
+# Início da importação, para medir o tempo até a API ficar pronta (ver utils/warmup.py)
+INICIO_IMPORT = time.perf_counter()
+
+import asyncio
+import math
+from contextlib import asynccontextmanager, suppress
+from fastapi import Depends, FastAPI, Request
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 # Importa os roteadores dos módulos de rotas
-from routes import v1, v2, v3, grafo
+from routes import v1, v2, v3, grafo, cache, consulta
+from utils.auth import verify_basic_auth
+from utils.openai_client import openai_client
+from utils.openai_scheduler import OpenAISaturado
+from utils.warmup import warmup
+from config import async_engine, engine
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Cliente HTTP da OpenAI compartilhado por todas as rotas
+    await openai_client.start()
+    # Tokenizer, pools do banco, vector store e índices aquecem em segundo plano; /ready informa o fim
+    aquecimento = asyncio.create_task(warmup.executar(INICIO_IMPORT))
+    yield
+    aquecimento.cancel()
+    # Espera o cancelamento terminar (sem o aviso "Task was destroyed but it is pending")
+    with suppress(asyncio.CancelledError):
+        await aquecimento
+    await openai_client.close()
+    if async_engine.construido:
+        await async_engine.dispose()
+    if engine.construido:
+        engine.dispose()
+
 
 app = FastAPI(
     title="RAG & Search API",
     description="API com endpoints para busca RAG, busca híbrida e crawling de grafos.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Adiciona o middleware para CORS
@@ -25,6 +59,27 @@ app.include_router(v1.router, prefix="/v1", tags=["V1 - Rerank Search"])
 app.include_router(v2.router, prefix="/v2", tags=["V2 - Intent Router"])
 app.include_router(v3.router, prefix="/v3", tags=["V3 - Generic Search"])
 app.include_router(grafo.router, prefix="/grafo", tags=["Grafo Crawler"])
+app.include_router(cache.router, prefix="/cache", tags=["Cache"])
+app.include_router(consulta.router, prefix="/consulta", tags=["Consulta estruturada"])
+
+# Orçamento da OpenAI esgotado além do prazo da fila (ver utils/openai_scheduler.py)
+@app.exception_handler(OpenAISaturado)
+async def openai_saturado_handler(request: Request, exc: OpenAISaturado):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+# Métricas Prometheus, com a mesma autenticação básica das demais rotas
+@app.get("/metrics", dependencies=[Depends(verify_basic_auth)], include_in_schema=False)
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/ready", tags=["Root"])
+def ready():
+    """200 quando o aquecimento terminou; 503 enquanto ainda há etapas obrigatórias pendentes."""
+    return JSONResponse(status_code=200 if warmup.pronto else 503, content=warmup.resumo())
 
 @app.get("/", tags=["Root"])
 def root():
@@ -0,0 +1,25 @@
+# routes/cache.py
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel
+from utils.answer_cache import semantic_cache
+from utils.auth import verify_basic_auth
+
+router = APIRouter()
+
+
+class FalsoHit(BaseModel):
+    response_id: str
+
+
+@router.get("/stats", dependencies=[Depends(verify_basic_auth)])
+def estatisticas_cache():
+    """Contadores do cache semântico (taxa de hit e de falso hit) para calibrar o limiar."""
+    return {"semantic": semantic_cache.stats()}
+
+
+@router.post("/false-hit", dependencies=[Depends(verify_basic_auth)])
+def registrar_falso_hit(falso_hit: FalsoHit):
+    """Marca como incorreta uma resposta servida pelo cache semântico."""
+    if not semantic_cache.registrar_falso_hit(falso_hit.response_id):
+        raise HTTPException(status_code=404, detail="Resposta não encontrada entre as servidas pelo cache semântico.")
+    return {"status": "ok", "semantic": semantic_cache.stats()}
@@ -0,0 +1,60 @@
+# routes/consulta.py
+import json
+from typing import Literal
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, ValidationError
+from sqlalchemy.exc import SQLAlchemyError
+from intent_router import intent_router
+from utils.auth import verify_basic_auth
+from utils.metrics import iniciar_timings, medir
+from utils.openai_scheduler import openai_scheduler, PRIORIDADE_PIPELINE
+
+router = APIRouter()
+
+
+class DecisaoSQL(BaseModel):
+    """Decisão estruturada (mesmo formato de IntentRouter.decide_intent com `use_sql: true`)."""
+    # Campo -> valor; campos fora de utils/metadata_filters.CAMPOS são ignorados
+    filters: dict[str, str | int | float | None] = {}
+    text_search_terms: list[str] = []
+    select_fields: list[str] = ["titulo", "link"]
+    aggregation: Literal["list", "count"] = "list"
+
+
+class ConsultaEstruturada(BaseModel):
+    query: str | None = None
+    # Decisão já estruturada, sem chamar o LLM; formato inválido responde 422
+    decisao: DecisaoSQL | None = None
+
+
+@router.post("", dependencies=[Depends(verify_basic_auth)])
+async def consulta_estruturada(consulta: ConsultaEstruturada):
+    """
+    Listagem e contagem de leis por metadados (caminho SQL do IntentRouter), no engine
+    assíncrono: roda em paralelo às respostas em streaming sem travar o event loop.
+    Perguntas que pedem a leitura do conteúdo voltam com `use_sql: false` (use /v1, /v2 ou /v3).
+    """
+    iniciar_timings("consulta")
+    if consulta.decisao is not None:
+        decisao = consulta.decisao.model_dump()
+    elif consulta.query:
+        openai_scheduler.verificar_admissao(PRIORIDADE_PIPELINE)
+        try:
+            with medir("intent"):
+                bruta = await intent_router.decide_intent(consulta.query)
+            if not bruta.get("use_sql"):
+                return {"use_sql": False, "decisao": bruta}
+            # A decisão do LLM passa pela mesma validação da decisão enviada pelo cliente
+            decisao = DecisaoSQL.model_validate(bruta).model_dump()
+        except (json.JSONDecodeError, AttributeError, ValidationError) as e:
+            print(f"❌ Decisão inválida do roteador de intenção: {e}")
+            raise HTTPException(status_code=502, detail="O roteador de intenção devolveu uma decisão inválida.")
+    else:
+        raise HTTPException(status_code=400, detail="Informe 'query' ou 'decisao'.")
+
+    try:
+        resultado = await intent_router.arun_sql(decisao)
+    except SQLAlchemyError as e:
+        print(f"❌ Erro na consulta estruturada: {e}")
+        raise HTTPException(status_code=503, detail="Banco de dados indisponível.")
+    return {"use_sql": True, "decisao": decisao, **resultado}
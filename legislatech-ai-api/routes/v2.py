@@ -1,94 +1,121 @@
 # routes/v2.py
 import asyncio
-import aiohttp
-import json
+import math
 import uuid
-import itertools
 from typing import AsyncGenerator
 from fastapi import APIRouter, Request, Depends, HTTPException
 from fastapi.responses import StreamingResponse
-from langchain.retrievers import BM25Retriever
-from config import OPENAI_API_KEY, vector_store
+from config import vector_store, RECURSIVE_MAX_DEPTH, RETRIEVAL_BUDGET_SECONDS, RETRIEVER_V2
+from intent_router import intent_router
+from utils.answer_cache import RespostaCacheada, guardar_resposta, resposta_cacheada
 from utils.auth import verify_basic_auth
-from utils.sse import make_sse_event
+from utils.bm25_index import buscar_bm25, fundir_candidatos
+from utils.fanout import FanOut
+from utils.recursive_retrieval import RecursiveRetriever
+from utils.latency_budget import LatencyBudget, iniciar_orcamento
+from utils.metrics import com_timings, iniciar_timings, medir
+from utils.openai_client import openai_client
+from utils.openai_scheduler import OpenAISaturado, openai_scheduler
+from utils.enrichment import enrichment_service
+from utils.pg_retriever import buscar_hibrido_pg
+from utils.retrieval_context import RetrievalContext
+from utils.sse import make_error_event, make_sse_event
+from utils.stream_buffer import stream_store, variante_requisicao
+from utils.stream_writer import DeltaStreamWriter
+from utils.rerank import rerank_stage
 from utils.prompt_helpers import (
     montar_contexto_e_gerar_resposta, 
-    buscar_contexto_enriquecido, 
     expandir_query,
-    recursive_retrieval
+    refinar_query
 )
-import hashlib
-from functools import lru_cache
 
 
 router = APIRouter()
 
-# Cache simples para resultados
-@lru_cache(maxsize=100)
-def get_cache_key(query: str) -> str:
-    return hashlib.md5(query.encode()).hexdigest()
+async def buscar_recursivo_hibrido(contexto: RetrievalContext, expanded_queries: list[str], max_depth: int) -> tuple[list, list | None]:
+    """
+    Nível 0: as queries expandidas (k=30); níveis seguintes: sub-queries em feixe limitado,
+    tudo em fan-out concorrente com o prazo da requisição. Em paralelo, a busca por
+    palavras-chave: índice BM25 do corpus ou, no modo pg_hybrid, a busca híbrida no banco
+    (vetor + full-text numa única consulta).
+    """
+    if RETRIEVER_V2 == "pg_hybrid":
+        busca_palavras_chave = buscar_hibrido_pg(contexto.query, k=30, embedding=await contexto.embedding(), filtros=contexto.filtros)
+    else:
+        busca_palavras_chave = buscar_bm25(contexto.query, vector_store, k=30, filtros=contexto.filtros)
+    (all_semantic_docs, _), keyword_docs = await asyncio.gather(
+        RecursiveRetriever(vector_store, max_depth=max_depth).run(expanded_queries, fanout=FanOut(RETRIEVAL_BUDGET_SECONDS), contexto=contexto),
+        busca_palavras_chave,
+    )
+    contexto.registrar(keyword_docs)
+    return all_semantic_docs, keyword_docs
 
-async def rerank_search_sse(query: str, original_query: str) -> AsyncGenerator[str, None]:
-    """Lógica de streaming para V2 e V3, com busca híbrida, rerank e geração."""
-    response_id = f"resp_{uuid.uuid4().hex}"
+
+async def rerank_search_sse(original_query: str, response_id: str, orcamento: LatencyBudget, vetores: dict | None = None) -> AsyncGenerator[str, None]:
+    """
+    Lógica de streaming para V2 e V3, com busca híbrida, rerank e geração.
+    `vetores` traz o embedding da pergunta original já calculado na consulta ao cache
+    semântico; sem refine, a busca usa esse vetor.
+    """
     message_item_id = f"msg_{uuid.uuid4().hex}"
     
     yield make_sse_event("response.created", {"type": "response.created", "response": {"id": response_id, "status": "in_progress"}})
-    
-    # Expandir a query
-    expanded_queries = await expandir_query(query)
-    print(f"Queries expandidas: {expanded_queries}")
+
+    # Filtros de metadados da pergunta (ano, tipo...) extraídos em paralelo ao refine
+    # (etapas opcionais só rodam se cabem no orçamento de latência e na fila da OpenAI)
+    # (se refine ou expansão falharem ou o stream for cancelado, o finally cancela a extração em andamento)
+    tarefa_filtros = asyncio.create_task(orcamento.executar("filtros", lambda: intent_router.extrair_filtros(original_query), {}))
+    tarefa_filtros.add_done_callback(lambda t: t.cancelled() or t.exception())
+    try:
+        # Refinar a query antes da busca
+        query = await orcamento.executar("refine", lambda: refinar_query(original_query), original_query)
+
+        # Expandir a query
+        expanded_queries = await orcamento.executar("expand", lambda: expandir_query(query), [query])
+        print(f"Queries expandidas: {expanded_queries}")
+        filtros = await tarefa_filtros
+    finally:
+        if not tarefa_filtros.done():
+            tarefa_filtros.cancel()
     
     # --- FASE 1: BUSCA HÍBRIDA COM QUERIES EXPANDIDAS E RECURSIVA ---
-    all_semantic_docs = []
-    for q in expanded_queries:
-        # Busca semântica normal
-        docs = await vector_store.asimilarity_search(q, k=30)
-        all_semantic_docs.extend(docs)
-        
-        # Busca recursiva
-        recursive_docs = await recursive_retrieval(q, vector_store)
-        all_semantic_docs.extend(recursive_docs)
+    # A query e as expandidas são embedadas num único lote, reaproveitado pelas duas buscas;
+    # os filtros restringem as buscas à fatia da coleção que os atende
+    contexto = RetrievalContext(query, vetores=dict(vetores or {}), filtros=filtros)
+    await contexto.aembed([query, *expanded_queries])
+    max_depth = RECURSIVE_MAX_DEPTH if orcamento.cabe("recursao") else 0
+    all_semantic_docs, keyword_docs = await buscar_recursivo_hibrido(contexto, expanded_queries, max_depth)
+    if not all_semantic_docs and not keyword_docs and contexto.filtros:
+        print(f"⚠️ Nenhum documento com os filtros {contexto.filtros}; buscando sem filtros.")
+        contexto.filtros = {}
+        all_semantic_docs, keyword_docs = await buscar_recursivo_hibrido(contexto, expanded_queries, max_depth)
     
-    if not all_semantic_docs:
+    if not all_semantic_docs and not keyword_docs:
         yield make_sse_event("response.output_text.delta", {"delta": "Nenhum documento relevante foi encontrado."})
         return
         
-    # Remover duplicatas mantendo a ordem
-    seen_ids = set()
-    unique_docs = []
-    for doc in all_semantic_docs:
-        doc_id = doc.metadata.get("id")
-        if doc_id not in seen_ids:
-            seen_ids.add(doc_id)
-            unique_docs.append(doc)
-    
-    bm25_retriever = BM25Retriever.from_documents(unique_docs)
-    keyword_docs = bm25_retriever.invoke(query)
-    final_candidates = list({doc.page_content: doc for doc in itertools.chain(keyword_docs, unique_docs)}.values())
-    docs_for_llm_rerank = final_candidates[:20]
-
-    # --- FASE 2: RERANK COM LLM ---
-    formatted_chunks = [f"[{i+1}] {doc.page_content[:300]}..." for i, doc in enumerate(docs_for_llm_rerank)]
-    rerank_instruction = f"Analise os trechos a seguir e escolha os 5-10 mais relevantes para a pergunta: '{query}'. Retorne apenas os números dos trechos, separados por vírgula.\n\n" + "\n".join(formatted_chunks)
-    
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
-    rerank_payload = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": rerank_instruction}], "max_tokens": 50}
-    
-    selected_chunks = []
+    final_candidates = fundir_candidatos(query, all_semantic_docs, keyword_docs)
+    docs_for_rerank = final_candidates[:20]
+
+    # --- FASE 2: RERANK (cross-encoder local ou LLM, conforme RERANKER_BACKEND) ---
+    # Os vizinhos de todos os candidatos são carregados enquanto o rerank roda
+    # (o finally cancela o prefetch se o rerank falhar, o cliente desconectar ou o enriquecimento for pulado)
+    prefetch = enrichment_service.prefetch(docs_for_rerank, contexto)
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=rerank_payload) as resp:
-                resp_json = await resp.json()
-                selected_indexes = [int(x.strip()) - 1 for x in resp_json["choices"][0]["message"]["content"].split(',') if x.strip().isdigit()]
-                selected_chunks = [docs_for_llm_rerank[i] for i in selected_indexes if i < len(docs_for_llm_rerank)]
-    except Exception as e:
-        print(f"Erro no rerank, usando fallback. Erro: {e}")
-        selected_chunks = docs_for_llm_rerank[:5]
+        selected_chunks = await rerank_stage.rerank(query, docs_for_rerank, orcamento)
 
+        if orcamento.cabe("enriquecimento"):
+            with medir("enriquecimento"):
+                docs_enriquecidos = await enrichment_service.enriquecer(selected_chunks, contexto, prefetch=prefetch)
+        else:
+            docs_enriquecidos = selected_chunks
+    finally:
+        if not prefetch.done():
+            prefetch.cancel()
 
-    docs_enriquecidos = await buscar_contexto_enriquecido(selected_chunks, vector_store)
+    evento_pulados = orcamento.evento()
+    if evento_pulados:
+        yield evento_pulados
     
     # --- FASE 3: GERAÇÃO DA RESPOSTA ---
     annotations_list = []
@@ -103,60 +130,64 @@ async def rerank_search_sse(query: str, original_query: str) -> AsyncGenerator[s
             "annotation_index": i,
             "annotation": annotation_payload
         })
-        await asyncio.sleep(0.05)
 
-    final_prompt = await montar_contexto_e_gerar_resposta(original_query, docs_enriquecidos)
+    with medir("prompt"):
+        final_prompt = await montar_contexto_e_gerar_resposta(original_query, docs_enriquecidos)
     generation_payload = {"model": "gpt-4o-mini", "stream": True, "temperature": 0, "messages": [{"role": "user", "content": final_prompt}]}
 
-    full_text_content = ""
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=generation_payload) as resp:
-            async for line in resp.content:
-                if line.strip().endswith(b"[DONE]"): break
-                if line.startswith(b"data: "):
-                    try:
-                        content = json.loads(line[6:])["choices"][0]["delta"].get("content")
-                        if content:
-                            yield make_sse_event("response.output_text.delta", {
-                                "type": "response.output_text.delta",
-                                "item_id": message_item_id,
-                                "output_index": 1,
-                                "content_index": 0,
-                                "delta": content
-                            })
-                            full_text_content += content
-                            await asyncio.sleep(0.01)
-                    except (json.JSONDecodeError, IndexError, KeyError):
-                        continue
+    writer = DeltaStreamWriter(message_item_id)
+    try:
+        async for evento in writer.stream(openai_client.stream_chat_completion(generation_payload)):
+            yield evento
+    except OpenAISaturado as e:
+        # Orçamento da OpenAI esgotado depois de o stream abrir: sem como responder 503, o
+        # aviso e a espera sugerida (Retry-After) vão num evento de erro
+        print(f"⚠️ Geração recusada pelo agendador da OpenAI: {e}")
+        yield make_error_event("openai_saturado", str(e), response_id=response_id, retry_after=math.ceil(e.retry_after))
+        return
+    full_text_content = writer.texto
 
     yield make_sse_event("response.output_text.done", {
         "type": "response.output_text.done",
         "item_id": message_item_id, 
         "text": full_text_content
     })
+    # Respostas com etapas puladas não entram no cache: a próxima pergunta igual recebe o pipeline completo
+    if not orcamento.pulados:
+        await guardar_resposta("v2", original_query, docs_enriquecidos, RespostaCacheada(annotations_list, full_text_content), contexto.vetores.get(original_query))
 
 @router.post("/responses", dependencies=[Depends(verify_basic_auth)])
 async def rerank_search_endpoint(request: Request):
+    # Reconexão com Last-Event-ID: continua do buffer, sem refazer busca nem geração
+    retomada = stream_store.retomar(request, "v2")
+    if retomada:
+        return StreamingResponse(retomada, media_type="text/event-stream")
+
+    timings = iniciar_timings("v2", debug=request.headers.get("x-debug-timings") == "1")
+    orcamento = iniciar_orcamento(request, timings)
     body = await request.json()
     user_query = body.get("input", [{}])[-1].get("content", [{}])[0].get("text")
     if not user_query:
         raise HTTPException(status_code=400, detail="Query é obrigatória.")
-    
-    # Refinar a query antes da busca
-    refined_query = user_query # Fallback
-    refine_prompt = f"Reescreva a seguinte pergunta para otimizar a busca em um sistema de rag sobre as leis do brasil: {user_query}"
-    print(f"Refinando query: {refine_prompt}")
-    try:
-        async with aiohttp.ClientSession() as session:
-            payload = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": refine_prompt}], "max_tokens": 128}
-            headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
-            async with session.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload) as resp:
-                resp.raise_for_status()
-                refined_query = (await resp.json())["choices"][0]["message"]["content"].strip()
-        print(f"Query refinada: {refined_query}")
-    except Exception as e:
-        print(f"Erro ao refinar query: {e}")
-
-    return StreamingResponse(rerank_search_sse(query=refined_query, original_query=user_query), media_type="text/event-stream")
+
+    vetores = {}
+    cached = await resposta_cacheada("v2", user_query, vetores)
+    if cached:
+        return StreamingResponse(cached, media_type="text/event-stream")
+
+    # A mesma pergunta já em andamento: acompanha o stream dela em vez de rodar o pipeline de novo
+    variante = variante_requisicao(timings, orcamento)
+    compartilhada = stream_store.acompanhar(request, "v2", user_query, variante)
+    if compartilhada:
+        return StreamingResponse(compartilhada, media_type="text/event-stream")
+
+    # Sem orçamento da OpenAI para o pipeline inteiro dentro do prazo da fila: 503 com
+    # Retry-After (ver main.py), antes de abrir o stream
+    openai_scheduler.admitir_resposta("v2")
+
+    response_id = f"resp_{uuid.uuid4().hex}"
+    eventos = com_timings(rerank_search_sse(original_query=user_query, response_id=response_id, orcamento=orcamento, vetores=vetores), timings)
+    eventos = stream_store.iniciar(request, response_id, eventos, "v2", query=user_query, variante=variante)
+    return StreamingResponse(eventos, media_type="text/event-stream")
     
     
\ No newline at end of file
@@ -1,38 +1,45 @@
 # routes/v1.py
-import asyncio
-import aiohttp
-import json
+import math
 import time
 import uuid
 from typing import AsyncGenerator
 from fastapi import APIRouter, Request, Depends, HTTPException
 from fastapi.responses import StreamingResponse
-from config import OPENAI_API_KEY, vector_store
+from config import vector_store
+from utils.answer_cache import RespostaCacheada, guardar_resposta, resposta_cacheada
 from utils.auth import verify_basic_auth
-from utils.sse import make_sse_event
+from utils.metrics import com_timings, iniciar_timings, medir
+from utils.openai_client import openai_client
+from utils.openai_scheduler import OpenAISaturado, openai_scheduler
+from utils.sse import make_error_event, make_sse_event
+from utils.stream_buffer import stream_store, variante_requisicao
+from utils.stream_writer import DeltaStreamWriter
 from utils.prompt_helpers import _search_chunks, montar_contexto_com_documentos
+from utils.retrieval_context import RetrievalContext
 
 router = APIRouter()
 
-async def sse_simulate_response(query: str) -> AsyncGenerator[str, None]:
-    """Lógica de streaming para a V1, com busca simples e geração de resposta."""
+async def sse_simulate_response(query: str, response_id: str, vetores: dict | None = None) -> AsyncGenerator[str, None]:
+    """
+    Lógica de streaming para a V1, com busca simples e geração de resposta.
+    `vetores` traz o embedding da pergunta já calculado na consulta ao cache semântico.
+    """
     sequence_number = -1
     def get_next_sequence_number():
         nonlocal sequence_number
         sequence_number += 1
         return sequence_number
 
-    response_id = f"resp_{uuid.uuid4().hex}"
     message_item_id = f"msg_{uuid.uuid4().hex}"
 
     yield make_sse_event("response.created", {
         "type": "response.created", 
         "response": {"id": response_id, "status": "in_progress"}
     })
-    await asyncio.sleep(0.05)
     
-    # Usando o método assíncrono para buscar chunks
-    search_chunks_result = await _search_chunks(query)
+    # Uma única busca semântica: as anotações e o prompt usam os mesmos documentos
+    contexto = RetrievalContext(query, vetores=dict(vetores or {}))
+    search_chunks_result = await _search_chunks(contexto)
     annotations_list = []
     for i, link in enumerate(search_chunks_result.get("links", [])):
         annotation_payload = {"type": "url_citation", "title": search_chunks_result["titles"][i], "url": link}
@@ -45,53 +52,64 @@ async def sse_simulate_response(query: str) -> AsyncGenerator[str, None]:
             "content_index": 0,
             "annotation_index": i,
         })
-        await asyncio.sleep(0.05)
 
     # Montagem do prompt e streaming da resposta do LLM
-    prompt, erro = await montar_contexto_com_documentos(query, vector_store)
+    with medir("prompt"):
+        prompt, erro = await montar_contexto_com_documentos(contexto, vector_store)
     if erro:
         yield make_sse_event("response.output_text.delta", {"delta": erro})
         return
 
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
     payload = {"model": "gpt-4o-mini", "stream": True, "temperature": 0, "messages": [{"role": "user", "content": prompt}]}
     
-    full_text_content = ""
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers, json=payload) as resp:
-            async for line in resp.content:
-                decoded = line.decode()
-                if decoded.startswith("data: "):
-                    json_data = decoded[len("data: "):].strip()
-                    if json_data == "[DONE]": break
-                    try:
-                        j = json.loads(json_data)
-                        content = j.get("choices", [{}])[0].get("delta", {}).get("content")
-                        if content:
-                            yield make_sse_event("response.output_text.delta", {
-                                "type": "response.output_text.delta",
-                                "item_id": message_item_id, 
-                                "delta": content,
-                                "output_index": 1,
-                                "content_index": 0,
-                            })
-                            full_text_content += content
-                            await asyncio.sleep(0.01)
-                    except Exception:
-                        continue
+    writer = DeltaStreamWriter(message_item_id)
+    try:
+        async for evento in writer.stream(openai_client.stream_chat_completion(payload)):
+            yield evento
+    except OpenAISaturado as e:
+        # Orçamento da OpenAI esgotado depois de o stream abrir: sem como responder 503, o
+        # aviso e a espera sugerida (Retry-After) vão num evento de erro
+        print(f"⚠️ Geração recusada pelo agendador da OpenAI: {e}")
+        yield make_error_event("openai_saturado", str(e), response_id=response_id, retry_after=math.ceil(e.retry_after))
+        return
+    full_text_content = writer.texto
     
     yield make_sse_event("response.output_text.done", {
         "type": "response.output_text.done",
         "item_id": message_item_id, 
         "text": full_text_content
     })
+    await guardar_resposta("v3", query, search_chunks_result["documents"], RespostaCacheada(annotations_list, full_text_content), contexto.vetores.get(query))
 
 
 @router.post("/responses", dependencies=[Depends(verify_basic_auth)])
 async def simular_fluxo_response_generico(request: Request):
+    # Reconexão com Last-Event-ID: continua do buffer, sem refazer busca nem geração
+    retomada = stream_store.retomar(request, "v3")
+    if retomada:
+        return StreamingResponse(retomada, media_type="text/event-stream")
+
+    timings = iniciar_timings("v3", debug=request.headers.get("x-debug-timings") == "1")
     body = await request.json()
     query = body.get("input", [{}])[-1].get("content", [{}])[0].get("text")
     if not query:
         raise HTTPException(status_code=400, detail="Query é obrigatória.")
-    return StreamingResponse(sse_simulate_response(query), media_type="text/event-stream")
\ No newline at end of file
+    vetores = {}
+    cached = await resposta_cacheada("v3", query, vetores)
+    if cached:
+        return StreamingResponse(cached, media_type="text/event-stream")
+
+    # A mesma pergunta já em andamento: acompanha o stream dela em vez de rodar o pipeline de novo
+    variante = variante_requisicao(timings)
+    compartilhada = stream_store.acompanhar(request, "v3", query, variante)
+    if compartilhada:
+        return StreamingResponse(compartilhada, media_type="text/event-stream")
+
+    # Sem orçamento da OpenAI para o pipeline inteiro dentro do prazo da fila: 503 com
+    # Retry-After (ver main.py), antes de abrir o stream
+    openai_scheduler.admitir_resposta("v3")
+
+    response_id = f"resp_{uuid.uuid4().hex}"
+    eventos = com_timings(sse_simulate_response(query, response_id, vetores), timings)
+    eventos = stream_store.iniciar(request, response_id, eventos, "v3", query=query, variante=variante)
+    return StreamingResponse(eventos, media_type="text/event-stream")
\ No newline at end of file
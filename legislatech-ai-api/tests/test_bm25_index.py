@@ -0,0 +1,97 @@
+# tests/test_bm25_index.py
+import pytest
+from langchain_core.documents import Document
+from utils.bm25_index import BM25Index, fundir_candidatos, fundir_rrf, radical, tokenizar
+
+
+@pytest.mark.parametrize("token, esperado", [
+    ("nacionais", "nacional"),
+    ("acoes", "acao"),
+    ("bens", "bem"),
+    ("mares", "mar"),
+    ("pais", "pais"),  # radical curto demais: não é plural
+    ("paises", "pais"),
+    ("claramente", "clara"),
+    ("lei", "lei"),
+    ("14129", "14129"),
+])
+def test_radical(token, esperado):
+    assert radical(token) == esperado
+
+
+def test_tokenizar_acentos_stopwords_e_numeros_de_lei():
+    assert tokenizar("Constituição do País") == ["constituicao", "pais"]
+    assert tokenizar("Lei nº 14.129") == ["14129"]
+    assert tokenizar("Lei 8.078/90") == ["8078", "90"]
+
+
+def doc(chunk_id: str) -> Document:
+    return Document(page_content=f"texto {chunk_id}", metadata={"id": chunk_id})
+
+
+def test_fundir_rrf_soma_as_posicoes_das_listas():
+    fundidos = fundir_rrf([[doc("a"), doc("b"), doc("c")], [doc("c"), doc("b")]])
+    # c: 1/63 + 1/61 > b: 1/62 + 1/62 > a: 1/61
+    assert [d.metadata["id"] for d in fundidos] == ["c", "b", "a"]
+
+
+def test_fundir_rrf_mantem_o_primeiro_documento_de_cada_id():
+    primeiro, repetido = doc("a"), doc("a")
+    fundidos = fundir_rrf([[primeiro], [repetido]])
+    assert len(fundidos) == 1
+    assert fundidos[0] is primeiro
+
+
+@pytest.fixture
+def indice(tmp_path):
+    return BM25Index.build(str(tmp_path), [
+        ("a_0", "energia elétrica renovável"),
+        ("b_0", "saúde pública e vigilância sanitária"),
+        ("c_0", "energia nuclear e energia solar"),
+    ])
+
+
+def test_busca_ordena_por_relevancia(indice):
+    resultados = indice.search("energia", k=10)
+    assert [chunk_id for chunk_id, _ in resultados] == ["c_0", "a_0"]
+    assert resultados[0][1] > resultados[1][1] > 0
+
+
+def test_busca_respeita_k_e_termos_ausentes(indice):
+    assert len(indice.search("energia saúde", k=1)) == 1
+    assert indice.search("inexistente") == []
+    assert indice.search("de a o") == []
+
+
+def test_reabre_do_disco(indice, tmp_path):
+    reaberto = BM25Index.open(str(tmp_path))
+    assert reaberto.search("sanitária") == indice.search("sanitária")
+
+
+def test_update_remove_apagados_e_reindexa_alterados(indice):
+    atualizado = indice.append([("a_0", "educação básica"), ("d_0", "energia eólica")], remover=["a_0", "c_0"])
+    assert atualizado.ids() == {"a_0", "b_0", "d_0"}
+    assert [chunk_id for chunk_id, _ in atualizado.search("energia")] == ["d_0"]
+    assert [chunk_id for chunk_id, _ in atualizado.search("educação")] == ["a_0"]
+    assert atualizado.n_docs == 3
+
+
+def test_build_apaga_segmentos_antigos(indice, tmp_path):
+    BM25Index.build(str(tmp_path), [("x_0", "energia")])
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["meta.json", "seg_0001"]
+
+
+def test_fundir_candidatos_remove_repetidos_da_busca_vetorial():
+    semanticos = [doc("a"), doc("b"), doc("a")]
+    fundidos = fundir_candidatos("texto", semanticos, [doc("b")])
+    assert [d.metadata["id"] for d in fundidos] == ["b", "a"]
+
+
+def test_fundir_candidatos_sem_indice_usa_bm25_sobre_os_vetoriais():
+    semanticos = [
+        Document(page_content="saúde pública", metadata={"id": "a"}),
+        Document(page_content="energia solar", metadata={"id": "b"}),
+    ]
+    fundidos = fundir_candidatos("energia", semanticos, None)
+    assert sorted(d.metadata["id"] for d in fundidos) == ["a", "b"]
+    assert fundir_candidatos("energia", [], None) == []
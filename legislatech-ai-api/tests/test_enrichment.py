@@ -0,0 +1,29 @@
+# tests/test_enrichment.py
+from langchain_core.documents import Document
+from utils.enrichment import EnrichmentService, _faixas, _posicao
+
+
+def test_posicao_do_id():
+    assert _posicao("lei_14129_3") == ("lei_14129", 3)
+    assert _posicao("lei_14129_abc") is None
+    assert _posicao("semnumero") is None
+    assert _posicao(None) is None
+
+
+def test_faixas_agrupam_numeros_contiguos_por_prefixo():
+    prefixos, inicios, fins = _faixas(["a_3", "a_1", "a_2", "a_7", "b_0", "a_8", "b_5"])
+    assert list(zip(prefixos, inicios, fins)) == [("a", 1, 3), ("a", 7, 8), ("b", 0, 0), ("b", 5, 5)]
+
+
+def test_faixas_ignoram_repetidos():
+    assert _faixas(["a_1", "a_1", "a_2"]) == (["a"], [1], [2])
+
+
+def test_faixas_vazias():
+    assert _faixas([]) == ([], [], [])
+
+
+def test_planejar_prioriza_chunk_zero_e_depois_os_vizinhos_proximos():
+    servico = EnrichmentService(engine=None, vs=None, collection_name="teste", max_janela=2)
+    docs = [Document(page_content="", metadata={"id": "a_3"}), Document(page_content="", metadata={"id": "b_0"})]
+    assert servico._planejar(docs, 2) == ["a_0", "a_4", "b_1", "a_5", "b_2"]
@@ -0,0 +1,80 @@
+# tests/test_metadata_filters.py
+import pytest
+from langchain_core.documents import Document
+from utils.metadata_filters import (
+    _numero,
+    atende_filtros,
+    filtrar_documentos,
+    normalizar_filtros,
+    predicados_sql,
+)
+
+
+@pytest.mark.parametrize("valor, esperado", [
+    (14129, 14129.0),
+    (14129.0, 14129.0),
+    ("14129", 14129.0),
+    ("14.129", 14129.0),
+    ("1.234.567", 1234567.0),
+    (" 8078 ", 8078.0),
+    ("10,5", 10.5),
+])
+def test_numero_da_lei(valor, esperado):
+    assert _numero(valor) == esperado
+
+
+def test_numero_invalido():
+    with pytest.raises(ValueError):
+        _numero("catorze")
+
+
+def test_normalizar_converte_e_descarta():
+    filtros = normalizar_filtros({
+        "ano": "2023",
+        "tipo": " MPV ",
+        "num_lei": "14.129",
+        "main_sancionador": "Lula",
+        "titulo": "energia",     # fora da lista
+        "link": None,
+        "sancionador": "",
+    })
+    assert filtros == {"ano": 2023, "tipo": "mpv", "num_lei": 14129.0, "main_sancionador": "lula"}
+
+
+def test_normalizar_ignora_valores_invalidos():
+    assert normalizar_filtros({"ano": "dois mil", "tipo": ["mpv"], "num_lei": {"n": 1}}) == {}
+    assert normalizar_filtros(None) == {}
+
+
+def test_predicados_sql_tipados_e_parametrizados():
+    predicados, params = predicados_sql({"ano": "2023", "tipo": "MPV", "desconhecido": "x"})
+    assert predicados.startswith(" AND ")
+    assert "CAST(e.cmetadata->>'ano' AS integer) END) = :filtro_ano" in predicados
+    assert "lower(e.cmetadata->>'tipo') = :filtro_tipo" in predicados
+    assert "desconhecido" not in predicados
+    assert params == {"filtro_ano": 2023, "filtro_tipo": "mpv"}
+
+
+def test_predicados_sql_vazios_e_sem_alias():
+    assert predicados_sql({}) == ("", {})
+    predicados, _ = predicados_sql({"tipo": "mpv"}, alias="")
+    assert "lower(cmetadata->>'tipo')" in predicados
+
+
+def doc(**metadata) -> Document:
+    return Document(page_content="", metadata=metadata)
+
+
+def test_atende_filtros_com_a_mesma_conversao():
+    assert atende_filtros(doc(ano="2023", tipo="MPV"), {"ano": 2023, "tipo": "mpv"})
+    assert atende_filtros(doc(num_lei="14129"), {"num_lei": "14.129"})
+    assert not atende_filtros(doc(ano="2022"), {"ano": 2023})
+    assert not atende_filtros(doc(ano="sem data"), {"ano": 2023})
+    assert not atende_filtros(doc(), {"tipo": "mpv"})
+
+
+def test_filtrar_documentos():
+    docs = [doc(ano=2023), doc(ano=2021)]
+    assert filtrar_documentos(docs, {"ano": 2023}) == [docs[0]]
+    assert filtrar_documentos(docs, {}) is docs
+    assert filtrar_documentos(None, {"ano": 2023}) is None
@@ -0,0 +1,155 @@
+# tests/test_openai_scheduler.py
+import asyncio
+import pytest
+from utils import openai_scheduler as modulo
+from utils.openai_scheduler import (
+    OpenAIScheduler,
+    OpenAISaturado,
+    TokenBucket,
+    PRIORIDADE_GERACAO,
+    PRIORIDADE_OPCIONAL,
+    PRIORIDADE_PIPELINE,
+    _segundos,
+)
+
+
+class Relogio:
+    """time.monotonic controlado pelo teste."""
+
+    def __init__(self, agora: float = 1000.0):
+        self.agora = agora
+
+    def __call__(self) -> float:
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(modulo.time, "monotonic", relogio)
+    return relogio
+
+
+# --- TokenBucket ---
+
+def test_balde_comeca_cheio_e_repoe_pela_taxa(relogio):
+    balde = TokenBucket(60)  # 1 ficha por segundo
+    assert balde.espera(60) == 0
+    balde.consumir(60)
+    assert balde.espera(1) == pytest.approx(1.0)
+    relogio.agora += 30
+    assert balde.espera(30) == 0
+    assert balde.espera(40) == pytest.approx(10.0)
+
+
+def test_balde_nao_passa_da_capacidade(relogio):
+    balde = TokenBucket(60, capacidade=10)
+    relogio.agora += 3600
+    balde.consumir(0)
+    assert balde.nivel == 10
+
+
+def test_ajustar_troca_estimativa_pelo_consumo_real(relogio):
+    balde = TokenBucket(600)
+    balde.consumir(100)
+    balde.ajustar(-80)  # consumiu 80 a menos que o estimado
+    assert balde.nivel == pytest.approx(580)
+    balde.ajustar(1000)
+    assert balde.nivel == pytest.approx(-420)
+
+
+def test_sincronizar_nunca_fica_acima_do_restante(relogio):
+    balde = TokenBucket(600)
+    balde.sincronizar(0, 50)
+    assert balde.nivel == 50
+    assert balde.capacidade == 600
+    balde.sincronizar(1200, 5000)
+    assert balde.capacidade == 1200
+    assert balde.taxa == pytest.approx(20)
+    assert balde.nivel == 50
+
+
+# --- _segundos (cabeçalhos de rate limit da OpenAI) ---
+
+@pytest.mark.parametrize("valor, esperado", [
+    ("20", 20.0),
+    ("1.5", 1.5),
+    ("6m0s", 360.0),
+    ("1h2m3s", 3723.0),
+    ("250ms", 0.25),
+    ("1s500ms", 1.5),
+    ("0.5s", 0.5),
+])
+def test_segundos_formatos_validos(valor, esperado):
+    assert _segundos(valor) == pytest.approx(esperado)
+
+
+@pytest.mark.parametrize("valor", [None, "", "abc", "10x", "m"])
+def test_segundos_formatos_invalidos(valor):
+    assert _segundos(valor) is None
+
+
+# --- Admissão e despacho por prioridade ---
+
+def test_admissao_recusa_quando_a_espera_passa_do_prazo(relogio):
+    scheduler = OpenAIScheduler(rpm=60, tpm=0, max_espera=5)
+    scheduler.requisicoes.consumir(60)
+    scheduler.verificar_admissao(PRIORIDADE_GERACAO, requisicoes=5)
+    with pytest.raises(OpenAISaturado) as erro:
+        scheduler.verificar_admissao(PRIORIDADE_GERACAO, requisicoes=6)
+    assert erro.value.retry_after == pytest.approx(6.0)
+
+
+def test_admissao_da_resposta_conta_o_pipeline_inteiro(relogio, monkeypatch):
+    monkeypatch.setitem(modulo.OPENAI_ADMISSION_TOKENS, "v1", 6000)
+    monkeypatch.setitem(modulo.OPENAI_ADMISSION_CALLS, "v1", 3)
+    scheduler = OpenAIScheduler(rpm=0, tpm=60_000, max_espera=2)
+    scheduler.tokens.consumir(57_000)  # restam 3000 tokens; repõe 1000 por segundo
+    # Só a geração (0 tokens estimados) seria admitida, mas o pipeline precisa de 6000 (3 s de espera)
+    scheduler.verificar_admissao(PRIORIDADE_GERACAO)
+    with pytest.raises(OpenAISaturado):
+        scheduler.admitir_resposta("v1")
+
+
+def test_despacho_libera_por_prioridade():
+    async def cenario():
+        scheduler = OpenAIScheduler(rpm=600, tpm=0, max_espera=5)  # 10 chamadas por segundo
+        scheduler.requisicoes.consumir(600)
+        ordem = []
+
+        async def chamada(nome, prioridade):
+            await scheduler.adquirir(0, prioridade)
+            ordem.append(nome)
+
+        tarefas = [asyncio.create_task(chamada("opcional", PRIORIDADE_OPCIONAL))]
+        await asyncio.sleep(0)
+        tarefas.append(asyncio.create_task(chamada("pipeline", PRIORIDADE_PIPELINE)))
+        await asyncio.sleep(0)
+        tarefas.append(asyncio.create_task(chamada("geracao", PRIORIDADE_GERACAO)))
+        await asyncio.gather(*tarefas)
+        return ordem
+
+    assert asyncio.run(cenario()) == ["geracao", "pipeline", "opcional"]
+
+
+def test_despacho_recusa_quem_passaria_do_prazo():
+    async def cenario():
+        scheduler = OpenAIScheduler(rpm=60, tpm=0, max_espera=1.5)  # 1 chamada por segundo
+        scheduler.requisicoes.consumir(60)
+        primeira = asyncio.create_task(scheduler.adquirir(0, PRIORIDADE_PIPELINE))
+        await asyncio.sleep(0)
+        # A segunda esperaria ~2 s na fila, além do prazo de 1,5 s
+        with pytest.raises(OpenAISaturado):
+            await scheduler.adquirir(0, PRIORIDADE_PIPELINE)
+        await primeira
+
+    asyncio.run(cenario())
+
+
+def test_pausa_por_429_usa_retry_after(relogio):
+    scheduler = OpenAIScheduler(rpm=0, tpm=0, max_espera=5)
+    assert scheduler.pausar_por_429({"retry-after-ms": "1500"}) == pytest.approx(1.5)
+    assert scheduler.espera_estimada() == pytest.approx(1.5)
+    assert scheduler.pausar_por_429({"retry-after": "2"}) == pytest.approx(2.0)
+    assert scheduler.pausar_por_429({}) == pytest.approx(1.0)
+    assert scheduler.espera_estimada() == pytest.approx(2.0)
@@ -0,0 +1,94 @@
+# tests/test_semantic_cache.py
+import numpy as np
+import pytest
+from utils import semantic_cache as modulo
+from utils.semantic_cache import SemanticCache
+
+
+class Relogio:
+    """time.monotonic controlado pelo teste."""
+
+    def __init__(self, agora: float = 1000.0):
+        self.agora = agora
+
+    def __call__(self) -> float:
+        return self.agora
+
+
+@pytest.fixture
+def relogio(monkeypatch):
+    relogio = Relogio()
+    monkeypatch.setattr(modulo.time, "monotonic", relogio)
+    return relogio
+
+
+def vetor_com_similaridade(similaridade: float) -> list[float]:
+    """Vetor unitário com o cosseno informado em relação a [1, 0]."""
+    return [similaridade, float(np.sqrt(1 - similaridade ** 2))]
+
+
+def test_hit_acima_do_limiar(relogio):
+    cache = SemanticCache(threshold=0.95, maxsize=4)
+    cache.adicionar("v1", "lei de energia", [1.0, 0.0], ["a_0"], "resposta")
+    entrada, similaridade = cache.buscar("v1", vetor_com_similaridade(0.97))
+    assert entrada.resposta == "resposta"
+    assert similaridade == pytest.approx(0.97, abs=1e-6)
+    assert cache.hits == 1
+
+
+def test_abaixo_do_limiar_conta_quase_hit(relogio):
+    cache = SemanticCache(threshold=0.95, maxsize=4, margem_quase_hit=0.03)
+    cache.adicionar("v1", "lei de energia", [1.0, 0.0], ["a_0"], "resposta")
+    assert cache.buscar("v1", vetor_com_similaridade(0.93)) is None
+    assert cache.buscar("v1", vetor_com_similaridade(0.5)) is None
+    assert cache.hits == 0
+    assert cache.quase_hits == 1
+
+
+def test_nao_mistura_rotas(relogio):
+    cache = SemanticCache(maxsize=4)
+    cache.adicionar("v1", "lei de energia", [1.0, 0.0], ["a_0"], "resposta")
+    assert cache.buscar("v2", [1.0, 0.0]) is None
+
+
+def test_entrada_vencida_nao_e_servida(relogio):
+    cache = SemanticCache(maxsize=4, ttl=60)
+    cache.adicionar("v1", "lei de energia", [1.0, 0.0], ["a_0"], "resposta")
+    relogio.agora += 59
+    assert cache.buscar("v1", [1.0, 0.0]) is not None
+    relogio.agora += 2
+    assert cache.buscar("v1", [1.0, 0.0]) is None
+    assert cache.stats()["entradas"] == 0
+
+
+def test_vencidas_liberam_vaga_antes_das_validas(relogio):
+    cache = SemanticCache(maxsize=2, ttl=60)
+    cache.adicionar("v1", "antiga", [1.0, 0.0], ["a_0"], "antiga")
+    relogio.agora += 50
+    cache.adicionar("v1", "recente", [0.0, 1.0], ["b_0"], "recente")
+    relogio.agora += 20  # só a primeira venceu
+    cache.adicionar("v1", "nova", [-1.0, 0.0], ["c_0"], "nova")
+    assert cache.buscar("v1", [0.0, 1.0])[0].resposta == "recente"
+    assert cache.buscar("v1", [-1.0, 0.0])[0].resposta == "nova"
+
+
+def test_cheio_descarta_a_usada_ha_mais_tempo(relogio):
+    cache = SemanticCache(maxsize=2, ttl=None)
+    cache.adicionar("v1", "primeira", [1.0, 0.0], ["a_0"], "primeira")
+    relogio.agora += 1
+    cache.adicionar("v1", "segunda", [0.0, 1.0], ["b_0"], "segunda")
+    relogio.agora += 1
+    cache.buscar("v1", [1.0, 0.0])  # a primeira passa a ser a mais recente
+    cache.adicionar("v1", "terceira", [-1.0, 0.0], ["c_0"], "terceira")
+    assert cache.buscar("v1", [0.0, 1.0]) is None
+    assert cache.buscar("v1", [1.0, 0.0])[0].resposta == "primeira"
+
+
+def test_falso_hit_remove_a_entrada(relogio):
+    cache = SemanticCache(maxsize=4)
+    entrada = cache.adicionar("v1", "lei de energia", [1.0, 0.0], ["a_0"], "resposta")
+    cache.registrar_servido("resp_1", entrada)
+    assert cache.registrar_falso_hit("resp_1") is True
+    assert cache.registrar_falso_hit("resp_1") is False
+    assert cache.buscar("v1", [1.0, 0.0]) is None
+    assert cache.falsos_hits == 1
@@ -0,0 +1,118 @@
+# tests/test_stream_buffer.py
+import asyncio
+import json
+from utils.sse import make_sse_event
+from utils.stream_buffer import StreamStore
+
+
+class RequisicaoFalsa:
+    """O mínimo de Request que o StreamStore usa: cabeçalhos e is_disconnected."""
+
+    def __init__(self, last_event_id: str | None = None):
+        self.headers = {"last-event-id": last_event_id} if last_event_id else {}
+        self.desconectada = False
+
+    async def is_disconnected(self) -> bool:
+        return self.desconectada
+
+
+def evento(i: int) -> str:
+    return make_sse_event("response.output_text.delta", {"delta": str(i)})
+
+
+async def gerar(total: int, liberar: asyncio.Event | None = None, depois_de: int = 0):
+    """Gera `total` eventos; com `liberar`, para depois de `depois_de` eventos até o sinal."""
+    for i in range(total):
+        if liberar is not None and i == depois_de:
+            await liberar.wait()
+        yield evento(i)
+
+
+def deltas(eventos: list[str]) -> list[str]:
+    return [json.loads(e.split("data: ", 1)[1])["delta"] for e in eventos if "output_text.delta" in e]
+
+
+def test_eventos_numerados_com_o_response_id():
+    async def cenario():
+        store = StreamStore()
+        leitor = store.iniciar(RequisicaoFalsa(), "resp_1", gerar(3), "v1")
+        return [e async for e in leitor]
+
+    eventos = asyncio.run(cenario())
+    assert [e.split("\n", 1)[0] for e in eventos] == ["id: resp_1:0", "id: resp_1:1", "id: resp_1:2"]
+    assert deltas(eventos) == ["0", "1", "2"]
+
+
+def test_retomada_continua_depois_do_last_event_id():
+    async def cenario():
+        store = StreamStore(grace=5)
+        liberar = asyncio.Event()
+        leitor = store.iniciar(RequisicaoFalsa(), "resp_1", gerar(5, liberar, depois_de=2), "v1")
+        recebidos = [await leitor.__anext__(), await leitor.__anext__()]
+        await leitor.aclose()  # cliente caiu depois do evento 1
+
+        retomada = store.retomar(RequisicaoFalsa("resp_1:1"), "v1")
+        liberar.set()
+        return recebidos, [e async for e in retomada]
+
+    recebidos, retomados = asyncio.run(cenario())
+    assert deltas(recebidos) == ["0", "1"]
+    assert deltas(retomados) == ["2", "3", "4"]
+
+
+def test_retomada_recusada_fora_da_rota_ou_com_id_invalido():
+    async def cenario():
+        store = StreamStore()
+        leitor = store.iniciar(RequisicaoFalsa(), "resp_1", gerar(2), "v1")
+        [e async for e in leitor]
+        return (
+            store.retomar(RequisicaoFalsa("resp_1:0"), "v2"),
+            store.retomar(RequisicaoFalsa("resp_1"), "v1"),
+            store.retomar(RequisicaoFalsa("resp_2:0"), "v1"),
+            store.retomar(RequisicaoFalsa(), "v1"),
+        )
+
+    assert asyncio.run(cenario()) == (None, None, None, None)
+
+
+def test_retomada_recusada_quando_os_eventos_sairam_do_buffer():
+    async def cenario():
+        store = StreamStore(max_eventos=2)
+        leitor = store.iniciar(RequisicaoFalsa(), "resp_1", gerar(5), "v1")
+        [e async for e in leitor]
+        return store.retomar(RequisicaoFalsa("resp_1:0"), "v1"), store.retomar(RequisicaoFalsa("resp_1:2"), "v1")
+
+    descartado, disponivel = asyncio.run(cenario())
+    assert descartado is None
+    assert disponivel is not None
+
+
+def test_leitor_atrasado_recebe_stream_truncated():
+    async def cenario():
+        store = StreamStore(max_eventos=2)
+        leitor = store.iniciar(RequisicaoFalsa(), "resp_1", gerar(5), "v1")
+        await asyncio.sleep(0)  # a geração termina antes da primeira leitura
+        return [e async for e in leitor]
+
+    eventos = asyncio.run(cenario())
+    assert len(eventos) == 1
+    assert eventos[0].startswith("event: error\n")
+    erro = json.loads(eventos[0].split("data: ", 1)[1])
+    assert erro["code"] == "stream_truncated"
+    assert erro["response_id"] == "resp_1"
+
+
+def test_sem_reconexao_a_geracao_e_cancelada_apos_o_grace():
+    async def cenario():
+        store = StreamStore(grace=0.01)
+        liberar = asyncio.Event()
+        leitor = store.iniciar(RequisicaoFalsa(), "resp_1", gerar(3, liberar, depois_de=1), "v1")
+        await leitor.__anext__()
+        await leitor.aclose()
+        await asyncio.sleep(0.05)
+        buffer = store._buffers.get("resp_1")
+        return buffer.tarefa.cancelled(), store.retomar(RequisicaoFalsa("resp_1:0"), "v1")
+
+    cancelada, retomada = asyncio.run(cenario())
+    assert cancelada
+    assert retomada is None
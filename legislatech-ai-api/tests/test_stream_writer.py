@@ -0,0 +1,100 @@
+# tests/test_stream_writer.py
+import asyncio
+import json
+import pytest
+from utils.stream_writer import DeltaStreamWriter
+
+FIM = object()
+
+
+async def de_fila(fila: asyncio.Queue):
+    """Deltas do LLM entregues pelo teste, um a um, até FIM (ou uma exceção)."""
+    while True:
+        delta = await fila.get()
+        if delta is FIM:
+            return
+        if isinstance(delta, Exception):
+            raise delta
+        yield delta
+
+
+def deltas(eventos: list[str]) -> list[str]:
+    return [json.loads(e.split("data: ", 1)[1])["delta"] for e in eventos]
+
+
+async def coletar(writer: DeltaStreamWriter, fila: asyncio.Queue, eventos: list[str]):
+    async for evento in writer.stream(de_fila(fila)):
+        eventos.append(evento)
+
+
+def test_sem_intervalo_cada_delta_vira_um_evento():
+    async def cenario():
+        writer = DeltaStreamWriter("msg_1", flush_interval=0)
+        fila, eventos = asyncio.Queue(), []
+        for delta in ("a", "b", "c", FIM):
+            fila.put_nowait(delta)
+        await coletar(writer, fila, eventos)
+        return writer, eventos
+
+    writer, eventos = asyncio.run(cenario())
+    assert deltas(eventos) == ["a", "b", "c"]
+    assert writer.texto == "abc"
+    assert json.loads(eventos[0].split("data: ", 1)[1])["item_id"] == "msg_1"
+
+
+def test_envia_ao_atingir_o_tamanho_do_lote():
+    async def cenario():
+        writer = DeltaStreamWriter("msg_1", flush_interval=10, flush_bytes=5)
+        fila, eventos = asyncio.Queue(), []
+        consumidor = asyncio.create_task(coletar(writer, fila, eventos))
+        fila.put_nowait("abc")
+        await asyncio.sleep(0.01)
+        enviados_antes = len(eventos)  # 3 bytes: abaixo do lote e do intervalo
+        fila.put_nowait("de")
+        await asyncio.sleep(0.01)
+        enviados_no_lote = deltas(eventos)
+        fila.put_nowait("f")
+        fila.put_nowait(FIM)
+        await consumidor
+        return writer, enviados_antes, enviados_no_lote, eventos
+
+    writer, enviados_antes, enviados_no_lote, eventos = asyncio.run(cenario())
+    assert enviados_antes == 0
+    assert enviados_no_lote == ["abcde"]
+    assert deltas(eventos) == ["abcde", "f"]
+    assert writer.texto == "abcdef"
+
+
+def test_envia_quando_passa_o_intervalo():
+    async def cenario():
+        writer = DeltaStreamWriter("msg_1", flush_interval=0.05, flush_bytes=1000)
+        fila, eventos = asyncio.Queue(), []
+        consumidor = asyncio.create_task(coletar(writer, fila, eventos))
+        fila.put_nowait("a")
+        await asyncio.sleep(0.01)
+        fila.put_nowait("b")
+        await asyncio.sleep(0.01)
+        enviados_antes = len(eventos)
+        await asyncio.sleep(0.1)
+        enviados_pelo_timer = deltas(eventos)
+        fila.put_nowait(FIM)
+        await consumidor
+        return enviados_antes, enviados_pelo_timer, eventos
+
+    enviados_antes, enviados_pelo_timer, eventos = asyncio.run(cenario())
+    assert enviados_antes == 0
+    assert enviados_pelo_timer == ["ab"]
+    assert deltas(eventos) == ["ab"]
+
+
+def test_erro_do_upstream_chega_depois_do_que_ja_foi_recebido():
+    async def cenario():
+        writer = DeltaStreamWriter("msg_1", flush_interval=10, flush_bytes=1000)
+        fila, eventos = asyncio.Queue(), []
+        fila.put_nowait("parcial")
+        fila.put_nowait(RuntimeError("conexão perdida"))
+        with pytest.raises(RuntimeError, match="conexão perdida"):
+            await coletar(writer, fila, eventos)
+        return eventos
+
+    assert deltas(asyncio.run(cenario())) == ["parcial"]
@@ -0,0 +1,283 @@
+# utils/ann_index.py
+"""
+Índice ANN (HNSW ou IVFFlat) dos embeddings da coleção no pgvector.
+
+Os vetores do text-embedding-3-large têm 3072 dimensões, acima do limite de 2000 dos índices
+sobre `vector`. Por isso o índice é de expressão sobre `embedding::halfvec(3072)`
+(pgvector >= 0.7) e parcial na coleção configurada (PGVECTOR_COLLECTION). As buscas de
+utils/pg_retriever.py ordenam pela mesma expressão e filtram pela mesma coleção, para que o
+planejador use o índice. Elas também ajustam `hnsw.ef_search` / `ivfflat.probes` por rota
+(ANN_EF_SEARCH_*, ANN_PROBES_*) só na transação da consulta.
+
+Gerenciamento (CREATE INDEX CONCURRENTLY; a tabela continua recebendo leituras e escritas):
+    python -m utils.ann_index build --metodo hnsw --m 16 --ef-construction 64
+    python -m utils.ann_index build --metodo ivfflat --lists 1000
+    python -m utils.ann_index rebuild --metodo hnsw --m 24 --memoria 2GB
+    python -m utils.ann_index status
+    python -m utils.ann_index drop --metodo ivfflat
+"""
+import argparse
+import asyncio
+import re
+import time
+import uuid
+from sqlalchemy import text
+from config import (
+    async_engine,
+    COLLECTION_NAME,
+    EMBEDDING_DIMENSIONS,
+    VECTOR_SEARCH_BACKEND,
+    ANN_EF_SEARCH,
+    ANN_PROBES,
+)
+from utils.metrics import rota_atual
+
+# Padrão do hnsw.ef_search no pgvector, usado quando a rota não configura ANN_EF_SEARCH_*
+EF_SEARCH_PADRAO = 40
+
+# Suporte a busca iterativa no pgvector instalado (None = ainda não consultado)
+_busca_iterativa: bool | None = None
+
+# Índice ANN válido da coleção: encontrado (fica em cache) ou momento da última consulta sem ele
+_indice_encontrado = False
+_indice_consultado_em: float | None = None
+INTERVALO_VERIFICACAO_INDICE = 60
+
+SQL_PROGRESSO = """
+SELECT p.phase, p.blocks_done, p.blocks_total, p.tuples_done, p.tuples_total
+FROM pg_stat_progress_create_index p
+WHERE p.relid = 'langchain_pg_embedding'::regclass
+"""
+
+SQL_INDICES = """
+SELECT c.relname AS nome, am.amname AS metodo, i.indisvalid AS valido,
+       pg_size_pretty(pg_relation_size(c.oid)) AS tamanho, pg_get_indexdef(c.oid) AS definicao
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+JOIN pg_am am ON am.oid = c.relam
+WHERE i.indrelid = 'langchain_pg_embedding'::regclass
+  AND am.amname IN ('hnsw', 'ivfflat')
+ORDER BY c.relname
+"""
+
+
+def _halfvec(coluna: str) -> str:
+    return f"CAST({coluna} AS halfvec({EMBEDDING_DIMENSIONS}))"
+
+
+def expressao_embedding(alias: str = "e", indice: bool | None = None) -> str:
+    """
+    Expressão do embedding usada nas buscas: a mesma do índice com `indice=True`, a coluna
+    original com `indice=False` (busca exata, sem o índice ANN); None segue o
+    VECTOR_SEARCH_BACKEND (o índice só no modo pg_ann).
+    """
+    if indice is None:
+        indice = VECTOR_SEARCH_BACKEND == "pg_ann"
+    coluna = f"{alias}.embedding"
+    return _halfvec(coluna) if indice else coluna
+
+
+def tipo_parametro(indice: bool | None = None) -> str:
+    """Tipo para o CAST do embedding da query, compatível com `expressao_embedding`."""
+    if indice is None:
+        indice = VECTOR_SEARCH_BACKEND == "pg_ann"
+    return f"halfvec({EMBEDDING_DIMENSIONS})" if indice else "vector"
+
+
+async def busca_iterativa_disponivel(conn) -> bool:
+    """pgvector >= 0.8 (hnsw.iterative_scan / ivfflat.iterative_scan); a versão é lida uma vez."""
+    global _busca_iterativa
+    if _busca_iterativa is None:
+        versao = (await conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'"))).scalar() or "0"
+        numeros = tuple(int(parte) for parte in re.findall(r"\d+", versao)[:2])
+        _busca_iterativa = numeros >= (0, 8)
+    return _busca_iterativa
+
+
+async def indice_ann_disponivel(conn, colecao: str) -> bool:
+    """
+    Há um índice ANN válido (HNSW ou IVFFlat) parcial na coleção? Uma vez encontrado, fica
+    em cache; a ausência é consultada de novo a cada INTERVALO_VERIFICACAO_INDICE segundos,
+    para que um índice criado com a API no ar passe a ser usado sem reinício.
+    """
+    global _indice_encontrado, _indice_consultado_em
+    agora = time.monotonic()
+    if _indice_encontrado or (_indice_consultado_em is not None and agora - _indice_consultado_em < INTERVALO_VERIFICACAO_INDICE):
+        return _indice_encontrado
+    indices = (await conn.execute(text(SQL_INDICES))).fetchall()
+    _indice_encontrado = any(indice.valido and colecao in indice.definicao for indice in indices)
+    _indice_consultado_em = agora
+    return _indice_encontrado
+
+
+async def uuid_colecao(conn, nome: str = COLLECTION_NAME) -> str | None:
+    """UUID da coleção, validado (é interpolado no SQL para casar com o índice parcial)."""
+    valor = (await conn.execute(text("SELECT uuid FROM langchain_pg_collection WHERE name = :nome"), {"nome": nome})).scalar()
+    return str(uuid.UUID(str(valor))) if valor is not None else None
+
+
+async def aplicar_parametros_busca(conn, k: int, rota: str | None = None, iterativa: bool = False):
+    """
+    Ajusta ef_search / probes da rota só na transação atual (set_config com is_local).
+    O ef_search é sempre definido e nunca fica abaixo de k (o LIMIT da consulta): o HNSW
+    devolve no máximo ef_search linhas, e o padrão do servidor (40) cortaria os 100
+    candidatos da busca híbrida.
+
+    Com `iterativa` (busca com filtros de metadados, pgvector >= 0.8), o índice continua a
+    varredura até achar linhas que atendem aos filtros, em vez de filtrar só os primeiros
+    vizinhos. No IVFFlat a ordem volta aproximada; o rerank reordena os candidatos.
+    """
+    rota = rota or rota_atual()
+    parametros = {"hnsw.ef_search": str(max(ANN_EF_SEARCH.get(rota, 0) or EF_SEARCH_PADRAO, k))}
+    if ANN_PROBES.get(rota, 0) > 0:
+        parametros["ivfflat.probes"] = str(ANN_PROBES[rota])
+    if iterativa:
+        parametros["hnsw.iterative_scan"] = "strict_order"
+        parametros["ivfflat.iterative_scan"] = "relaxed_order"
+    selecoes = ", ".join(f"set_config(:nome{i}, :valor{i}, true)" for i in range(len(parametros)))
+    valores = {}
+    for i, (nome, valor) in enumerate(parametros.items()):
+        valores[f"nome{i}"] = nome
+        valores[f"valor{i}"] = valor
+    await conn.execute(text(f"SELECT {selecoes}"), valores)
+
+
+def nome_indice(metodo: str, sufixo: str = "") -> str:
+    colecao = re.sub(r"[^a-z0-9]+", "_", COLLECTION_NAME.lower()).strip("_")
+    return f"ix_ann_{colecao}_{metodo}"[:63 - len(sufixo)] + sufixo
+
+
+async def _acompanhar_progresso(intervalo: float = 5):
+    """Mostra a fase e o andamento do CREATE INDEX enquanto ele roda."""
+    while True:
+        await asyncio.sleep(intervalo)
+        try:
+            async with async_engine.connect() as conn:
+                linhas = (await conn.execute(text(SQL_PROGRESSO))).fetchall()
+        except Exception as e:
+            print(f"⚠️ Não foi possível ler o progresso: {e}")
+            continue
+        for linha in linhas:
+            feito, total = (linha.tuples_done, linha.tuples_total) if linha.tuples_total else (linha.blocks_done, linha.blocks_total)
+            percentual = f"{100 * feito / total:.1f}%" if total else "-"
+            print(f"⏳ {linha.phase}: {percentual} ({feito}/{total})")
+
+
+async def _existe(conn, nome: str) -> bool:
+    return (await conn.execute(text("SELECT to_regclass(:nome) IS NOT NULL"), {"nome": nome})).scalar()
+
+
+async def _executar_autocommit(*comandos: str):
+    # CREATE/DROP INDEX CONCURRENTLY não podem rodar dentro de uma transação
+    async with async_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for comando in comandos:
+            await conn.execute(text(comando))
+
+
+async def construir(metodo: str, nome: str, m: int, ef_construction: int, lists: int, memoria: str | None, workers: int | None):
+    """Cria o índice da coleção (CONCURRENTLY), mostrando o progresso; se falhar, remove o índice inválido."""
+    async with async_engine.connect() as conn:
+        colecao = await uuid_colecao(conn)
+        if colecao is None:
+            raise SystemExit(f"❌ Coleção {COLLECTION_NAME} não encontrada.")
+        if await _existe(conn, nome):
+            raise SystemExit(f"❌ O índice {nome} já existe; use rebuild para reconstruí-lo.")
+        if metodo == "ivfflat" and lists <= 0:
+            linhas = (await conn.execute(text("SELECT count(*) FROM langchain_pg_embedding WHERE collection_id = :c"), {"c": colecao})).scalar()
+            # Recomendação do pgvector: linhas/1000 até 1M de linhas, raiz quadrada acima disso
+            lists = max(10, linhas // 1000) if linhas <= 1_000_000 else int(linhas ** 0.5)
+
+    opcoes = f"m = {m}, ef_construction = {ef_construction}" if metodo == "hnsw" else f"lists = {lists}"
+    ajustes = []
+    if memoria:
+        if not re.fullmatch(r"\d+(kB|MB|GB)", memoria):
+            raise SystemExit("❌ --memoria deve ser como 512MB ou 2GB.")
+        ajustes.append(f"SET maintenance_work_mem = '{memoria}'")
+    if workers is not None:
+        ajustes.append(f"SET max_parallel_maintenance_workers = {int(workers)}")
+    sql = (
+        f"CREATE INDEX CONCURRENTLY {nome} ON langchain_pg_embedding "
+        f"USING {metodo} (({_halfvec('embedding')}) halfvec_cosine_ops) WITH ({opcoes}) "
+        f"WHERE collection_id = '{colecao}'"
+    )
+
+    print(f"🔨 Criando {nome} ({metodo}, {opcoes}) na coleção {COLLECTION_NAME}...")
+    monitor = asyncio.create_task(_acompanhar_progresso())
+    try:
+        await _executar_autocommit(*ajustes, sql)
+    except Exception:
+        await _executar_autocommit(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")
+        raise
+    finally:
+        monitor.cancel()
+    print(f"✅ Índice {nome} criado.")
+
+
+async def reconstruir(metodo: str, **opcoes):
+    """Cria o novo índice ao lado do atual e troca os nomes, sem deixar a coleção sem índice."""
+    nome = nome_indice(metodo)
+    novo, antigo = nome_indice(metodo, "_novo"), nome_indice(metodo, "_antigo")
+    await _executar_autocommit(f"DROP INDEX CONCURRENTLY IF EXISTS {novo}")
+    await construir(metodo, novo, **opcoes)
+    async with async_engine.begin() as conn:
+        existia = await _existe(conn, nome)
+        if existia:
+            await conn.execute(text(f"ALTER INDEX {nome} RENAME TO {antigo}"))
+        await conn.execute(text(f"ALTER INDEX {novo} RENAME TO {nome}"))
+    if existia:
+        await _executar_autocommit(f"DROP INDEX CONCURRENTLY IF EXISTS {antigo}")
+    print(f"✅ Índice {nome} reconstruído.")
+
+
+async def status():
+    async with async_engine.connect() as conn:
+        colecao = await uuid_colecao(conn)
+        linhas = (await conn.execute(text("SELECT count(*) FROM langchain_pg_embedding WHERE collection_id = :c"), {"c": colecao})).scalar() if colecao else 0
+        tabela = (await conn.execute(text("SELECT pg_size_pretty(pg_total_relation_size('langchain_pg_embedding'))"))).scalar()
+        indices = (await conn.execute(text(SQL_INDICES))).fetchall()
+        progresso = (await conn.execute(text(SQL_PROGRESSO))).fetchall()
+    print(f"Coleção {COLLECTION_NAME}: {linhas} chunks; tabela langchain_pg_embedding: {tabela}")
+    if not indices:
+        print("Nenhum índice ANN.")
+    for indice in indices:
+        situacao = "válido" if indice.valido else "INVÁLIDO (construção interrompida)"
+        print(f"- {indice.nome} [{indice.metodo}] {indice.tamanho}, {situacao}\n  {indice.definicao}")
+    for linha in progresso:
+        print(f"⏳ Em construção: {linha.phase} ({linha.tuples_done}/{linha.tuples_total} tuplas, {linha.blocks_done}/{linha.blocks_total} blocos)")
+
+
+async def remover(metodo: str):
+    await _executar_autocommit(f"DROP INDEX CONCURRENTLY IF EXISTS {nome_indice(metodo)}")
+    print(f"🗑️ Índice {nome_indice(metodo)} removido.")
+
+
+async def _main(args):
+    try:
+        opcoes = {"m": args.m, "ef_construction": args.ef_construction, "lists": args.lists, "memoria": args.memoria, "workers": args.workers}
+        if args.comando == "build":
+            await construir(args.metodo, nome_indice(args.metodo), **opcoes)
+        elif args.comando == "rebuild":
+            await reconstruir(args.metodo, **opcoes)
+        elif args.comando == "status":
+            await status()
+        else:
+            await remover(args.metodo)
+    finally:
+        await async_engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice ANN (HNSW/IVFFlat) da coleção no pgvector")
+    parser.add_argument("comando", choices=["build", "rebuild", "status", "drop"])
+    parser.add_argument("--metodo", choices=["hnsw", "ivfflat"], default="hnsw")
+    parser.add_argument("--m", type=int, default=16, help="HNSW: conexões por nó")
+    parser.add_argument("--ef-construction", type=int, default=64, help="HNSW: candidatos na construção")
+    parser.add_argument("--lists", type=int, default=0, help="IVFFlat: listas (0 = pelo número de chunks)")
+    parser.add_argument("--memoria", default=None, help="maintenance_work_mem da construção (ex.: 2GB)")
+    parser.add_argument("--workers", type=int, default=None, help="max_parallel_maintenance_workers")
+    asyncio.run(_main(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# utils/answer_cache.py
+import uuid
+from dataclasses import dataclass
+from typing import AsyncGenerator
+from config import ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_SIZE
+from utils.cache import LRUCache, normalizar_query
+from utils.query_embeddings import query_embeddings
+from utils.semantic_cache import SemanticCache
+from utils.sse import make_sse_event
+
+
+@dataclass
+class RespostaCacheada:
+    """Resultado final de uma resposta: anotações (citações) e texto completo."""
+    annotations: list[dict]
+    text: str
+
+
+class AnswerCache:
+    """Cache de respostas completas por versão da rota e pergunta normalizada, com TTL e limite de tamanho."""
+
+    def __init__(self, maxsize: int = 512, ttl: float | None = 3600):
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def key(route: str, query: str) -> str:
+        return f"{route}:{normalizar_query(query)}"
+
+    def get(self, route: str, query: str) -> RespostaCacheada | None:
+        return self._cache.get(self.key(route, query))
+
+    def set(self, route: str, query: str, resposta: RespostaCacheada):
+        if resposta.text:
+            self._cache.set(self.key(route, query), resposta)
+
+
+async def replay_sse(resposta: RespostaCacheada, response_id: str | None = None) -> AsyncGenerator[str, None]:
+    """Reproduz uma resposta cacheada com os mesmos eventos `response.*` do fluxo normal."""
+    response_id = response_id or f"resp_{uuid.uuid4().hex}"
+    message_item_id = f"msg_{uuid.uuid4().hex}"
+
+    yield make_sse_event("response.created", {"type": "response.created", "response": {"id": response_id, "status": "in_progress"}})
+    for i, annotation_payload in enumerate(resposta.annotations):
+        yield make_sse_event("response.output_text.annotation.added", {
+            "type": "response.output_text.annotation.added",
+            "item_id": message_item_id,
+            "output_index": 1,
+            "content_index": 0,
+            "annotation_index": i,
+            "annotation": annotation_payload
+        })
+    yield make_sse_event("response.output_text.delta", {
+        "type": "response.output_text.delta",
+        "item_id": message_item_id,
+        "output_index": 1,
+        "content_index": 0,
+        "delta": resposta.text
+    })
+    yield make_sse_event("response.output_text.done", {
+        "type": "response.output_text.done",
+        "item_id": message_item_id,
+        "text": resposta.text
+    })
+
+
+# Instâncias compartilhadas por todas as rotas
+answer_cache = AnswerCache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+semantic_cache = SemanticCache(threshold=SEMANTIC_CACHE_THRESHOLD, maxsize=SEMANTIC_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+
+
+async def resposta_cacheada(route: str, query: str, vetores: dict | None = None) -> AsyncGenerator[str, None] | None:
+    """
+    Procura uma resposta pronta: primeiro pela pergunta exata, depois por uma pergunta
+    semanticamente equivalente. Retorna o gerador SSE de replay ou None.
+    O embedding da pergunta fica em `vetores` (os vetores do RetrievalContext da
+    requisição), para a busca não embedar a mesma pergunta de novo.
+    """
+    cached = answer_cache.get(route, query)
+    if cached:
+        return replay_sse(cached)
+
+    try:
+        embedding = await query_embeddings.aembed_query(query)
+    except Exception as e:
+        print(f"Erro ao embedar a query para o cache semântico: {e}")
+        return None
+    if vetores is not None:
+        vetores[query] = embedding
+    encontrado = semantic_cache.buscar(route, embedding)
+    if encontrado is None:
+        return None
+
+    entrada, similaridade = encontrado
+    print(f"Cache semântico: '{query}' ≈ '{entrada.query}' (similaridade {similaridade:.3f})")
+    response_id = f"resp_{uuid.uuid4().hex}"
+    semantic_cache.registrar_servido(response_id, entrada)
+    return replay_sse(entrada.resposta, response_id=response_id)
+
+
+async def guardar_resposta(route: str, query: str, docs: list, resposta: RespostaCacheada, embedding: list[float] | None = None):
+    """Guarda uma resposta concluída nos caches exato e semântico (com o embedding já calculado, se houver)."""
+    if not resposta.text:
+        return
+    answer_cache.set(route, query, resposta)
+    try:
+        if embedding is None:
+            embedding = await query_embeddings.aembed_query(query)
+    except Exception as e:
+        print(f"Erro ao embedar a query para o cache semântico: {e}")
+        return
+    chunk_ids = [doc.metadata.get("id") for doc in docs]
+    semantic_cache.adicionar(route, query, embedding, chunk_ids, resposta)
@@ -0,0 +1,451 @@
+# utils/bm25_index.py
+"""
+Índice BM25 de todo o corpus (`langchain_pg_embedding`), construído offline.
+
+Formato em disco (diretório BM25_INDEX_PATH):
+- meta.json: parâmetros, segmentos, totais (tokens) e removidos (posições apagadas por segmento);
+- seg_NNNN/: vocab.json, offsets.npy, postings_docs.npy, postings_tf.npy, doc_len.npy, doc_ids.json,
+  doc_hashes.json (md5 do texto de cada chunk).
+Os arrays são abertos com np.load(mmap_mode="r"). Atualizações incrementais gravam
+um novo segmento com os chunks novos ou alterados (md5 diferente do indexado) e marcam no
+meta.json, como removidos, os chunks apagados do banco e as versões antigas dos alterados;
+a busca ignora as posições removidas. Um build completo grava um segmento novo, troca o
+meta.json e apaga os segmentos anteriores (e os removidos).
+
+Uso:
+    python -m utils.bm25_index build
+    python -m utils.bm25_index update
+    python -m utils.bm25_index query "energia elétrica" -k 10
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import os
+import re
+import shutil
+import unicodedata
+from collections import Counter, defaultdict
+import numpy as np
+from langchain_community.retrievers import BM25Retriever
+from sqlalchemy import text
+from config import BM25_INDEX_PATH, COLLECTION_NAME, engine
+from utils.metadata_filters import filtrar_documentos
+from utils.metrics import medir
+
+STOPWORDS = frozenset("""
+a ao aos aquela aquelas aquele aqueles aquilo as ate com como da das de dela delas dele deles
+depois do dos e ela elas ele eles em entre era eram essa essas esse esses esta estas este estes
+eu foi foram ha isso isto ja la lhe lhes mais mas me mesmo meu meus minha minhas muito na nao
+nas nem no nos nossa nossas nosso nossos num numa o os ou para pela pelas pelo pelos por qual
+quando que quem se sem ser seu seus so sua suas tambem te tem tinha um uma umas uns voce voces
+vos art artigo inciso paragrafo sobre lei leis
+""".split())
+
+# Sufixos de plural (texto já sem acento), do mais longo para o mais curto
+_SUFIXOS_PLURAL = (
+    ("oes", "ao"), ("aes", "ao"), ("ais", "al"), ("eis", "el"), ("ois", "ol"),
+    ("res", "r"), ("zes", "z"), ("ses", "s"), ("ns", "m"),
+)
+
+
+def dobrar_acentos(texto: str) -> str:
+    """Remove acentos e cedilha (ex.: 'Constituição' -> 'constituicao')."""
+    decomposto = unicodedata.normalize("NFKD", texto.casefold())
+    return "".join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def radical(token: str) -> str:
+    """Radicalização leve: reduz plurais e advérbios em -mente."""
+    if len(token) <= 3 or token.isdigit():
+        return token
+    if token.endswith("mente") and len(token) > 7:
+        return token[:-5]
+    for sufixo, troca in _SUFIXOS_PLURAL:
+        # O radical precisa de ao menos 2 letras: "pais" não é plural de "pal"
+        if token.endswith(sufixo) and len(token) - len(sufixo) >= 2:
+            return token[: -len(sufixo)] + troca
+    if token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+def tokenizar(texto: str) -> list[str]:
+    """Tokenização para textos legais em português: acentos, números de lei, stopwords e radical."""
+    texto = dobrar_acentos(texto)
+    # "14.129" vira "14129", um único número de lei; em "8.078/90" o ano fica num token à parte ("8078", "90")
+    texto = re.sub(r"(?<=\d)\.(?=\d{3})", "", texto)
+    return [radical(t) for t in re.findall(r"[a-z0-9]+", texto) if t not in STOPWORDS and len(t) > 1]
+
+
+def _hash_texto(texto: str | None) -> str | None:
+    """md5 do texto do chunk; igual ao md5(document) de um banco em UTF-8."""
+    return hashlib.md5(texto.encode("utf-8")).hexdigest() if texto is not None else None
+
+
+class _Segmento:
+    def __init__(self, path: str, base: int, removidos: list[int] | None = None):
+        self.path = path
+        self.base = base
+        with open(os.path.join(path, "vocab.json"), encoding="utf-8") as f:
+            self.vocab = json.load(f)
+        with open(os.path.join(path, "doc_ids.json"), encoding="utf-8") as f:
+            self.doc_ids = json.load(f)
+        # Segmentos gravados antes dos hashes: alterações nos seus chunks não são detectadas
+        caminho_hashes = os.path.join(path, "doc_hashes.json")
+        if os.path.exists(caminho_hashes):
+            with open(caminho_hashes, encoding="utf-8") as f:
+                self.doc_hashes = json.load(f)
+        else:
+            self.doc_hashes = [None] * len(self.doc_ids)
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.docs = np.load(os.path.join(path, "postings_docs.npy"), mmap_mode="r")
+        self.tfs = np.load(os.path.join(path, "postings_tf.npy"), mmap_mode="r")
+        self.doc_len = np.load(os.path.join(path, "doc_len.npy"), mmap_mode="r")
+        self.removidos = set(removidos or [])
+        # Máscara das posições ainda válidas (None quando nada foi removido do segmento)
+        self.vivos = None
+        if self.removidos:
+            self.vivos = np.ones(len(self.doc_ids), dtype=bool)
+            self.vivos[sorted(self.removidos)] = False
+
+    def postings(self, termo: str):
+        idx = self.vocab.get(termo)
+        if idx is None:
+            return None
+        inicio, fim = int(self.offsets[idx]), int(self.offsets[idx + 1])
+        docs, tfs = self.docs[inicio:fim], self.tfs[inicio:fim]
+        if self.vivos is not None:
+            validos = self.vivos[docs]
+            docs, tfs = docs[validos], tfs[validos]
+        return docs, tfs
+
+    def tocar(self):
+        """Lê os arrays uma vez para trazer as páginas do mmap para a memória."""
+        for arr in (self.offsets, self.docs, self.tfs, self.doc_len):
+            if arr.size:
+                np.asarray(arr).sum()
+
+
+def _escrever_segmento(path: str, docs: list[tuple[str, str]]) -> int:
+    """Grava um segmento com os (chunk_id, texto) informados. Retorna o total de tokens."""
+    os.makedirs(path, exist_ok=True)
+    postings = defaultdict(list)
+    doc_ids, doc_hashes, doc_len = [], [], []
+    for local, (chunk_id, texto) in enumerate(docs):
+        tokens = tokenizar(texto or "")
+        doc_ids.append(chunk_id)
+        doc_hashes.append(_hash_texto(texto))
+        doc_len.append(len(tokens))
+        for termo, tf in Counter(tokens).items():
+            postings[termo].append((local, tf))
+
+    termos = sorted(postings)
+    offsets = np.zeros(len(termos) + 1, dtype=np.int64)
+    for i, termo in enumerate(termos):
+        offsets[i + 1] = offsets[i] + len(postings[termo])
+    docs_arr = np.empty(int(offsets[-1]), dtype=np.int32)
+    tfs_arr = np.empty(int(offsets[-1]), dtype=np.float32)
+    for i, termo in enumerate(termos):
+        lista = postings[termo]
+        docs_arr[offsets[i]:offsets[i + 1]] = [d for d, _ in lista]
+        tfs_arr[offsets[i]:offsets[i + 1]] = [tf for _, tf in lista]
+
+    np.save(os.path.join(path, "offsets.npy"), offsets)
+    np.save(os.path.join(path, "postings_docs.npy"), docs_arr)
+    np.save(os.path.join(path, "postings_tf.npy"), tfs_arr)
+    np.save(os.path.join(path, "doc_len.npy"), np.asarray(doc_len, dtype=np.int32))
+    with open(os.path.join(path, "vocab.json"), "w", encoding="utf-8") as f:
+        json.dump({termo: i for i, termo in enumerate(termos)}, f, ensure_ascii=False)
+    with open(os.path.join(path, "doc_ids.json"), "w", encoding="utf-8") as f:
+        json.dump(doc_ids, f, ensure_ascii=False)
+    with open(os.path.join(path, "doc_hashes.json"), "w", encoding="utf-8") as f:
+        json.dump(doc_hashes, f)
+    return int(sum(doc_len))
+
+
+class BM25Index:
+    """Índice BM25 segmentado e mapeado em memória."""
+
+    def __init__(self, path: str, meta: dict):
+        self.path = path
+        self.meta = meta
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+        self.segmentos = []
+        removidos = meta.get("removidos", {})
+        base = 0
+        for nome in meta["segmentos"]:
+            segmento = _Segmento(os.path.join(path, nome), base, removidos.get(nome))
+            self.segmentos.append(segmento)
+            base += len(segmento.doc_ids)
+        # total_tokens já desconta os chunks removidos
+        self.n_docs = base - sum(len(segmento.removidos) for segmento in self.segmentos)
+        self.avgdl = meta["total_tokens"] / self.n_docs if self.n_docs else 0.0
+
+    @classmethod
+    def open(cls, path: str) -> "BM25Index":
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            return cls(path, json.load(f))
+
+    @staticmethod
+    def _gravar_meta(path: str, meta: dict):
+        tmp = os.path.join(path, "meta.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, os.path.join(path, "meta.json"))
+
+    @staticmethod
+    def _remover_segmentos_antigos(path: str, manter: list[str]):
+        """
+        Apaga os segmentos que o meta.json não referencia mais (depois da troca do meta).
+        Um processo da API que ainda tenha os arrays antigos mapeados continua lendo-os: no
+        Linux os arquivos só somem do disco quando o último mapeamento é fechado.
+        """
+        for nome in os.listdir(path):
+            if re.fullmatch(r"seg_\d+", nome) and nome not in manter:
+                shutil.rmtree(os.path.join(path, nome), ignore_errors=True)
+
+    @staticmethod
+    def _novo_segmento(path: str) -> str:
+        # Nunca reescreve um segmento existente: ele pode estar mapeado por um processo da API
+        existentes = [int(n[4:]) for n in os.listdir(path) if re.fullmatch(r"seg_\d+", n)]
+        return f"seg_{max(existentes, default=-1) + 1:04d}"
+
+    @classmethod
+    def build(cls, path: str, docs: list[tuple[str, str]], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """Cria um índice novo (um único segmento) com todos os documentos."""
+        os.makedirs(path, exist_ok=True)
+        nome = cls._novo_segmento(path)
+        total_tokens = _escrever_segmento(os.path.join(path, nome), docs)
+        cls._gravar_meta(path, {"k1": k1, "b": b, "segmentos": [nome], "total_tokens": total_tokens, "colecao": COLLECTION_NAME})
+        cls._remover_segmentos_antigos(path, [nome])
+        return cls.open(path)
+
+    def append(self, docs: list[tuple[str, str]], remover: list[str] | None = None) -> "BM25Index":
+        """
+        Atualização incremental: marca como removidas as posições atuais dos ids em `remover`
+        (chunks apagados ou alterados) e grava os documentos novos num segmento adicional.
+        """
+        if not docs and not remover:
+            return self
+        removidos = {nome: list(posicoes) for nome, posicoes in self.meta.get("removidos", {}).items()}
+        total_tokens = self.meta["total_tokens"]
+        posicoes = self.vivos()
+        for chunk_id in remover or []:
+            if chunk_id not in posicoes:
+                continue
+            segmento, local = posicoes[chunk_id]
+            removidos.setdefault(os.path.basename(segmento.path), []).append(local)
+            total_tokens -= int(segmento.doc_len[local])
+
+        segmentos = list(self.meta["segmentos"])
+        if docs:
+            nome = self._novo_segmento(self.path)
+            total_tokens += _escrever_segmento(os.path.join(self.path, nome), docs)
+            segmentos.append(nome)
+        meta = {**self.meta, "segmentos": segmentos, "total_tokens": total_tokens, "removidos": removidos}
+        self._gravar_meta(self.path, meta)
+        return BM25Index.open(self.path)
+
+    def vivos(self) -> dict[str, tuple[_Segmento, int]]:
+        """Posição (segmento, índice local) de cada chunk indexado que não foi removido."""
+        return {
+            chunk_id: (segmento, local)
+            for segmento in self.segmentos
+            for local, chunk_id in enumerate(segmento.doc_ids)
+            if local not in segmento.removidos
+        }
+
+    def hashes(self) -> dict[str, str | None]:
+        """md5 do texto indexado de cada chunk válido (None em segmentos sem hashes)."""
+        return {chunk_id: segmento.doc_hashes[local] for chunk_id, (segmento, local) in self.vivos().items()}
+
+    def ids(self) -> set[str]:
+        return set(self.vivos())
+
+    def tocar(self):
+        for segmento in self.segmentos:
+            segmento.tocar()
+
+    def search(self, query: str, k: int = 30) -> list[tuple[str, float]]:
+        """Retorna até k pares (chunk_id, score), do mais para o menos relevante."""
+        termos = list(dict.fromkeys(tokenizar(query)))
+        if not termos or not self.n_docs:
+            return []
+
+        docs_parciais, scores_parciais = [], []
+        for termo in termos:
+            por_segmento = [(seg, seg.postings(termo)) for seg in self.segmentos]
+            por_segmento = [(seg, p) for seg, p in por_segmento if p is not None]
+            df = sum(len(p[0]) for _, p in por_segmento)
+            if not df:
+                continue
+            idf = math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+            for seg, (docs, tfs) in por_segmento:
+                dl = seg.doc_len[docs]
+                tfs = np.asarray(tfs)
+                norm = tfs + self.k1 * (1 - self.b + self.b * dl / self.avgdl)
+                scores_parciais.append(idf * tfs * (self.k1 + 1) / norm)
+                docs_parciais.append(np.asarray(docs, dtype=np.int64) + seg.base)
+
+        if not docs_parciais:
+            return []
+        docs = np.concatenate(docs_parciais)
+        scores = np.concatenate(scores_parciais)
+        unicos, inverso = np.unique(docs, return_inverse=True)
+        totais = np.bincount(inverso, weights=scores)
+        k = min(k, len(unicos))
+        top = np.argpartition(-totais, k - 1)[:k]
+        top = top[np.argsort(-totais[top])]
+        return [(self._chunk_id(int(unicos[i])), float(totais[i])) for i in top]
+
+    def _chunk_id(self, doc_global: int) -> str:
+        for segmento in reversed(self.segmentos):
+            if doc_global >= segmento.base:
+                return segmento.doc_ids[doc_global - segmento.base]
+        raise IndexError(doc_global)
+
+
+# --- Uso pela API ---
+
+_indice: BM25Index | None = None
+_indice_mtime: float | None = None
+
+
+def get_bm25_index() -> BM25Index | None:
+    """Índice carregado (recarrega se meta.json mudou); None se não houver índice construído."""
+    global _indice, _indice_mtime
+    if not BM25_INDEX_PATH:
+        return None
+    try:
+        mtime = os.stat(os.path.join(BM25_INDEX_PATH, "meta.json")).st_mtime
+    except FileNotFoundError:
+        return None
+    if _indice is None or mtime != _indice_mtime:
+        _indice = BM25Index.open(BM25_INDEX_PATH)
+        _indice_mtime = mtime
+    return _indice
+
+
+def _buscar_indice(query: str, k: int) -> list[tuple[str, float]] | None:
+    # Roda fora do event loop: a recarga do índice (após build/update) lê o vocab.json de cada segmento
+    indice = get_bm25_index()
+    if indice is None:
+        return None
+    return indice.search(query, k)
+
+
+async def buscar_bm25(query: str, vs, k: int = 30, filtros: dict | None = None) -> list | None:
+    """
+    Busca por palavras-chave em todo o corpus e carrega os documentos encontrados.
+    Com `filtros`, busca mais resultados e mantém os que atendem aos filtros de metadados.
+    Retorna None quando não há índice (a rota decide o fallback).
+    """
+    try:
+        with medir("bm25"):
+            resultados = await asyncio.to_thread(_buscar_indice, query, k * 4 if filtros else k)
+            if resultados is None:
+                return None
+            if not resultados:
+                return []
+            ids = [chunk_id for chunk_id, _ in resultados]
+            docs = {doc.metadata.get("id"): doc for doc in await vs.aget_by_ids(ids)}
+        return filtrar_documentos([docs[chunk_id] for chunk_id in ids if chunk_id in docs], filtros)[:k]
+    except Exception as e:
+        print(f"⚠️ Erro na busca BM25 do corpus, usando fallback: {e}")
+        return None
+
+
+def fundir_rrf(listas: list[list], k: int = 60) -> list:
+    """Reciprocal rank fusion de listas de documentos (identificados pelo id do chunk)."""
+    scores, docs = defaultdict(float), {}
+    for lista in listas:
+        for posicao, doc in enumerate(lista):
+            chave = doc.metadata.get("id") or doc.page_content
+            scores[chave] += 1.0 / (k + posicao + 1)
+            docs.setdefault(chave, doc)
+    return [docs[chave] for chave in sorted(scores, key=scores.get, reverse=True)]
+
+
+def fundir_candidatos(query: str, docs_semanticos: list, docs_palavras_chave: list | None) -> list:
+    """
+    Candidatos ao rerank: os da busca vetorial (sem ids repetidos, na ordem) fundidos aos da
+    busca por palavras-chave por RRF. Sem o índice do corpus (`docs_palavras_chave` None), o
+    BM25 roda só sobre os candidatos da busca vetorial e as duas listas são unidas pelo texto.
+    """
+    # Remover duplicatas mantendo a ordem
+    seen_ids = set()
+    unique_docs = []
+    for doc in docs_semanticos:
+        doc_id = doc.metadata.get("id")
+        if doc_id not in seen_ids:
+            seen_ids.add(doc_id)
+            unique_docs.append(doc)
+
+    if docs_palavras_chave is not None:
+        return fundir_rrf([unique_docs, docs_palavras_chave])
+    keyword_docs = BM25Retriever.from_documents(unique_docs).invoke(query) if unique_docs else []
+    return list({doc.page_content: doc for doc in itertools.chain(keyword_docs, unique_docs)}.values())
+
+
+# --- Construção offline ---
+
+_SQL_CHUNKS = """
+    SELECT e.id, e.document
+    FROM langchain_pg_embedding e
+    JOIN langchain_pg_collection c ON c.uuid = e.collection_id
+    WHERE c.name = :colecao
+"""
+
+
+def _ler_chunks(ids: list[str] | None = None) -> list[tuple[str, str]]:
+    sql, params = _SQL_CHUNKS, {"colecao": COLLECTION_NAME}
+    if ids is not None:
+        sql += " AND e.id = ANY(:ids)"
+        params["ids"] = ids
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=5000).execute(text(sql), params)
+        return [(row.id, row.document) for row in result]
+
+
+def _ler_hashes() -> dict[str, str | None]:
+    """id -> md5 do texto de cada chunk da coleção, calculado no banco (sem trafegar os textos)."""
+    sql = "SELECT e.id, md5(e.document) AS hash FROM langchain_pg_embedding e JOIN langchain_pg_collection c ON c.uuid = e.collection_id WHERE c.name = :colecao"
+    with engine.connect() as conn:
+        return {row.id: row.hash for row in conn.execute(text(sql), {"colecao": COLLECTION_NAME})}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Índice BM25 do corpus de legislação")
+    parser.add_argument("comando", choices=["build", "update", "query"])
+    parser.add_argument("texto", nargs="?", help="Texto da consulta (comando query)")
+    parser.add_argument("--path", default=BM25_INDEX_PATH, help="Diretório do índice (padrão: BM25_INDEX_PATH)")
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+    if not args.path:
+        parser.error("Informe --path ou defina BM25_INDEX_PATH.")
+
+    if args.comando == "build":
+        docs = _ler_chunks()
+        indice = BM25Index.build(args.path, docs)
+        print(f"Índice criado com {indice.n_docs} chunks em {args.path}")
+    elif args.comando == "update":
+        indice = BM25Index.open(args.path)
+        atuais, indexados = _ler_hashes(), indice.hashes()
+        apagados = sorted(set(indexados) - set(atuais))
+        # Chunks reingeridos com o mesmo id: texto diferente do indexado (sem hash salvo, não há como saber)
+        alterados = sorted(i for i in set(indexados) & set(atuais) if indexados[i] is not None and indexados[i] != atuais[i])
+        novos = sorted(set(atuais) - set(indexados))
+        indice = indice.append(_ler_chunks(novos + alterados) if novos or alterados else [], remover=apagados + alterados)
+        print(f"{len(novos)} chunks novos, {len(alterados)} alterados e {len(apagados)} removidos "
+              f"({indice.n_docs} no total, {len(indice.segmentos)} segmentos)")
+    else:
+        for chunk_id, score in BM25Index.open(args.path).search(args.texto or "", args.k):
+            print(f"{score:8.3f}  {chunk_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# utils/completion_cache.py
+import hashlib
+import json
+from utils.cache import LRUCache, SQLiteStore
+
+MODOS = ("off", "readwrite", "record", "replay")
+
+
+class CompletionCacheMiss(Exception):
+    """Chamada sem gravação no modo replay (nenhum acesso à rede é permitido)."""
+
+
+class CompletionCache:
+    """
+    Cache de completions da OpenAI, com chave = hash do payload (modelo, prompt e parâmetros).
+    Modos:
+    - off: desligado;
+    - readwrite: só as chamadas marcadas como cacheáveis (helpers curtos) leem e gravam;
+    - record: toda chamada vai à rede e é gravada (inclusive streaming);
+    - replay: toda chamada vem do cache; sem gravação, levanta CompletionCacheMiss.
+    """
+
+    def __init__(self, maxsize: int = 4096, disk_path: str | None = None, mode: str = "readwrite"):
+        if mode not in MODOS:
+            raise ValueError(f"Modo de cache inválido: {mode}. Use um de {MODOS}.")
+        self.mode = mode
+        self._memory = LRUCache(maxsize=maxsize)
+        self._disk = SQLiteStore(disk_path, table="completions") if disk_path else None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(payload: dict) -> str:
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+    def deve_ler(self, cacheavel: bool) -> bool:
+        return self.mode == "replay" or (self.mode == "readwrite" and cacheavel)
+
+    def deve_gravar(self, cacheavel: bool) -> bool:
+        return self.mode == "record" or (self.mode == "readwrite" and cacheavel)
+
+    def get(self, key: str):
+        valor = self._memory.get(key)
+        if valor is None and self._disk is not None:
+            raw = self._disk.get(key)
+            if raw is not None:
+                valor = json.loads(raw)
+                self._memory.set(key, valor)
+        if valor is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return valor
+
+    def set(self, key: str, valor):
+        self._memory.set(key, valor)
+        if self._disk is not None:
+            self._disk.set(key, json.dumps(valor, ensure_ascii=False).encode())
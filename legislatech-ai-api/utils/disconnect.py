@@ -0,0 +1,9 @@
+# utils/disconnect.py
+import asyncio
+from fastapi import Request
+
+
+async def esperar_desconexao(request: Request, intervalo: float = 0.5):
+    """Retorna quando o cliente fecha a conexão (verificado a cada `intervalo` segundos)."""
+    while not await request.is_disconnected():
+        await asyncio.sleep(intervalo)
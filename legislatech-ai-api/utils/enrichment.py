@@ -0,0 +1,221 @@
+# utils/enrichment.py
+"""
+Enriquecimento do contexto com os chunks vizinhos dos trechos escolhidos no rerank.
+
+Os ids seguem o esquema `{prefixo}_{n}` (prefixo da lei, número do chunk). Cada trecho
+ganha o chunk 0 da lei e os seguintes (n+1, n+2, ...), numa janela que se ajusta aos
+tokens que ainda cabem no prompt. Os vizinhos que faltam vêm de uma única consulta por
+faixas (prefixo, início, fim), apoiada num índice de expressão, e ficam num LRU em
+processo, para que as leis mais consultadas não voltem ao banco a cada pergunta.
+Enquanto o rerank roda, `prefetch` já carrega os vizinhos de todos os candidatos.
+
+Preparação do banco (uma vez):
+    python -m utils.enrichment setup
+"""
+import argparse
+import asyncio
+from langchain_core.documents import Document
+from sqlalchemy import text
+from config import (
+    async_engine,
+    vector_store,
+    COLLECTION_NAME,
+    ENRICHMENT_CACHE_SIZE,
+    ENRICHMENT_CACHE_TTL,
+    ENRICHMENT_MAX_WINDOW,
+)
+from utils.cache import LRUCache
+from utils.metrics import medir
+from utils.prompt_helpers import contar_tokens
+from utils.retrieval_context import RetrievalContext
+
+# Prefixo e número do chunk extraídos do id. A consulta usa as mesmas expressões do índice;
+# números com mais de 9 dígitos viram NULL em vez de estourar o integer
+SQL_SETUP = [
+    """
+    CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_prefixo_chunk
+    ON langchain_pg_embedding (
+        collection_id,
+        (regexp_replace(id, '_[0-9]+$', '')),
+        (CAST(substring(id from '_([0-9]{1,9})$') AS integer))
+    )
+    """,
+]
+
+SQL_FAIXAS = """
+SELECT e.id, e.document, e.cmetadata
+FROM unnest(CAST(:prefixos AS text[]), CAST(:inicios AS integer[]), CAST(:fins AS integer[])) AS f(prefixo, inicio, fim)
+JOIN langchain_pg_embedding e
+  ON e.collection_id = (SELECT uuid FROM langchain_pg_collection WHERE name = :colecao)
+ AND regexp_replace(e.id, '_[0-9]+$', '') = f.prefixo
+ AND CAST(substring(e.id from '_([0-9]{1,9})$') AS integer) BETWEEN f.inicio AND f.fim
+"""
+
+# Marca, no LRU, ids consultados que não existem (fim da lei), para não consultá-los de novo
+_AUSENTE = "__ausente__"
+
+
+def _doc_id(doc) -> str | None:
+    return doc.metadata.get("id") or getattr(doc, "id", None)
+
+
+def _posicao(doc_id: str | None) -> tuple[str, int] | None:
+    """(prefixo, número do chunk) de um id no esquema `{prefixo}_{n}`."""
+    if not doc_id or "_" not in doc_id:
+        return None
+    prefixo, numero = doc_id.rsplit("_", 1)
+    if not numero.isdigit():
+        return None
+    return prefixo, int(numero)
+
+
+def _faixas(ids: list[str]) -> tuple[list[str], list[int], list[int]]:
+    """Agrupa os ids em faixas contíguas de números por prefixo (colunas do unnest)."""
+    por_prefixo: dict[str, set[int]] = {}
+    for doc_id in ids:
+        prefixo, numero = _posicao(doc_id)
+        por_prefixo.setdefault(prefixo, set()).add(numero)
+
+    prefixos, inicios, fins = [], [], []
+    for prefixo, numeros in por_prefixo.items():
+        ordenados = sorted(numeros)
+        inicio = anterior = ordenados[0]
+        for numero in ordenados[1:] + [None]:
+            if numero is not None and numero == anterior + 1:
+                anterior = numero
+                continue
+            prefixos.append(prefixo)
+            inicios.append(inicio)
+            fins.append(anterior)
+            if numero is not None:
+                inicio = anterior = numero
+    return prefixos, inicios, fins
+
+
+class EnrichmentService:
+    def __init__(self, engine, vs, collection_name: str, cache_size: int = 4096, cache_ttl: float | None = 600, max_janela: int = 4):
+        self.engine = engine
+        self.vs = vs
+        self.collection_name = collection_name
+        self.max_janela = max_janela
+        self._cache = LRUCache(maxsize=cache_size, ttl=cache_ttl)
+
+    async def ensure_schema(self):
+        """Cria o índice de expressão (coleção, prefixo, número do chunk) (idempotente)."""
+        async with self.engine.begin() as conn:
+            for sql in SQL_SETUP:
+                await conn.execute(text(sql))
+
+    def _planejar(self, docs: list, janela: int) -> list[str]:
+        """
+        Ids vizinhos em ordem de prioridade: o chunk 0 de cada lei, depois n+1 de todos os
+        trechos, depois n+2, e assim por diante até a janela.
+        """
+        posicoes = [p for p in (_posicao(_doc_id(doc)) for doc in docs) if p is not None]
+        plano = [f"{prefixo}_0" for prefixo, numero in posicoes if numero > 0]
+        for passo in range(1, janela + 1):
+            plano.extend(f"{prefixo}_{numero + passo}" for prefixo, numero in posicoes)
+        return list(dict.fromkeys(plano))
+
+    async def _consultar_faixas(self, ids: list[str]) -> list[Document]:
+        prefixos, inicios, fins = _faixas(ids)
+        params = {"colecao": self.collection_name, "prefixos": prefixos, "inicios": inicios, "fins": fins}
+        async with self.engine.connect() as conn:
+            result = await conn.execute(text(SQL_FAIXAS), params)
+            rows = result.fetchall()
+        return [Document(id=row.id, page_content=row.document, metadata=row.cmetadata or {}) for row in rows]
+
+    async def _carregar(self, ids: list[str]):
+        """Traz ao LRU os ids que ainda não estão nele, numa única ida ao banco."""
+        faltantes = [doc_id for doc_id in ids if self._cache.get(doc_id) is None]
+        if not faltantes:
+            return
+        try:
+            docs = await self._consultar_faixas(faltantes)
+        except Exception as e:
+            print(f"⚠️ Erro na consulta por faixas, buscando os vizinhos por id: {e}")
+            try:
+                docs = await self.vs.aget_by_ids(faltantes)
+            except Exception as e:
+                print(f"⚠️ Erro ao buscar chunks adicionais: {e}")
+                return
+        encontrados = {_doc_id(doc): doc for doc in docs}
+        for doc_id in faltantes:
+            self._cache.set(doc_id, encontrados.get(doc_id, _AUSENTE))
+
+    def prefetch(self, candidatos: list, contexto: RetrievalContext | None = None) -> asyncio.Task:
+        """Carrega em segundo plano os vizinhos de todos os candidatos (janela máxima)."""
+        ids = [doc_id for doc_id in self._planejar(candidatos, self.max_janela)
+               if contexto is None or doc_id not in contexto.por_id]
+
+        async def carregar():
+            with medir("prefetch_vizinhos"):
+                await self._carregar(ids)
+
+        return asyncio.create_task(carregar())
+
+    def _conhecido(self, doc_id: str, contexto: RetrievalContext | None):
+        if contexto is not None and doc_id in contexto.por_id:
+            return contexto.por_id[doc_id]
+        return self._cache.get(doc_id)
+
+    async def enriquecer(self, docs_relevantes: list, contexto: RetrievalContext | None = None, limite_tokens: int = 8000, prefetch: asyncio.Task | None = None) -> list:
+        """
+        Os trechos escolhidos seguidos dos vizinhos que cabem em `limite_tokens` (o limite do
+        prompt em montar_contexto_e_gerar_resposta). Vizinhos ainda não carregados entram
+        com o tamanho médio dos trechos escolhidos como estimativa.
+        """
+        if not docs_relevantes:
+            return []
+        if prefetch is not None:
+            await prefetch
+
+        documentos_finais = {_doc_id(doc): doc for doc in docs_relevantes}
+        tamanhos = [contar_tokens(doc.page_content) for doc in docs_relevantes]
+        restante = limite_tokens - sum(tamanhos)
+        estimativa = max(1, sum(tamanhos) // len(tamanhos))
+
+        escolhidos = []
+        for doc_id in self._planejar(docs_relevantes, self.max_janela):
+            if doc_id in documentos_finais:
+                continue
+            doc = self._conhecido(doc_id, contexto)
+            if doc is _AUSENTE:
+                continue
+            custo = estimativa if doc is None else contar_tokens(doc.page_content)
+            if custo > restante:
+                break
+            escolhidos.append(doc_id)
+            restante -= custo
+
+        await self._carregar([doc_id for doc_id in escolhidos if self._conhecido(doc_id, contexto) is None])
+        for doc_id in escolhidos:
+            doc = self._conhecido(doc_id, contexto)
+            if doc is not None and doc is not _AUSENTE:
+                documentos_finais[doc_id] = doc
+
+        print(f"Total de documentos enriquecidos: {len(documentos_finais)}")
+        return list(documentos_finais.values())
+
+
+# Instância compartilhada por todas as rotas
+enrichment_service = EnrichmentService(
+    async_engine,
+    vector_store,
+    COLLECTION_NAME,
+    cache_size=ENRICHMENT_CACHE_SIZE,
+    cache_ttl=ENRICHMENT_CACHE_TTL or None,
+    max_janela=ENRICHMENT_MAX_WINDOW,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enriquecimento com chunks vizinhos")
+    parser.add_argument("comando", choices=["setup"])
+    parser.parse_args()
+    asyncio.run(enrichment_service.ensure_schema())
+    print("Índice (coleção, prefixo, número do chunk) pronto.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+# utils/fanout.py
+import asyncio
+import time
+from config import RETRIEVAL_MAX_CONCURRENCY
+from utils.cache import normalizar_query
+
+# Limite global de operações de rede simultâneas (buscas e chamadas ao LLM) do fan-out,
+# compartilhado por todas as requisições do processo
+_limite_global = asyncio.Semaphore(RETRIEVAL_MAX_CONCURRENCY)
+
+
+class FanOut:
+    """
+    Fan-out concorrente com prazo por requisição.
+    - `run` limita operações-folha ao semáforo global (nunca envolva ramos inteiros nele,
+      para que um ramo que espera os filhos não segure uma vaga).
+    - `gather` executa ramos em paralelo e cancela os que ainda estiverem rodando no fim do prazo.
+    """
+
+    def __init__(self, budget_seconds: float, semaphore: asyncio.Semaphore | None = None):
+        self.deadline = time.monotonic() + budget_seconds
+        self._semaphore = semaphore or _limite_global
+        self._queries_vistas = set()
+        self.cancelados = 0
+
+    def restante(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+    def reservar_query(self, query: str) -> bool:
+        """Retorna False se uma query equivalente já foi disparada nesta requisição."""
+        chave = normalizar_query(query)
+        if not chave or chave in self._queries_vistas:
+            return False
+        self._queries_vistas.add(chave)
+        return True
+
+    async def run(self, coro):
+        """Executa uma operação-folha respeitando o limite global de concorrência."""
+        async with self._semaphore:
+            return await coro
+
+    async def gather(self, coros) -> list:
+        """
+        Executa os ramos em paralelo até o prazo. Ramos que falharam ou foram
+        cancelados pelo prazo retornam None.
+        """
+        tasks = [asyncio.create_task(c) for c in coros]
+        if not tasks:
+            return []
+        try:
+            done, pending = await asyncio.wait(tasks, timeout=self.restante())
+        finally:
+            # Também cancela os ramos se a própria requisição for cancelada
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.cancelados += len(pending)
+        if pending:
+            print(f"⏱️ Prazo do fan-out esgotado: {len(pending)} ramo(s) cancelado(s).")
+
+        resultados = []
+        for task in tasks:
+            if task in pending or task.cancelled():
+                resultados.append(None)
+            elif task.exception() is not None:
+                print(f"Erro em ramo do fan-out: {task.exception()}")
+                resultados.append(None)
+            else:
+                resultados.append(task.result())
+        return resultados
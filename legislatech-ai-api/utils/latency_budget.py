@@ -0,0 +1,92 @@
+# utils/latency_budget.py
+"""
+Orçamento de latência por requisição: tempo até o primeiro token, vindo do cabeçalho
+`X-Latency-Budget-Ms` ou do padrão da rota (LATENCY_BUDGET_MS).
+
+Antes de cada etapa opcional (refine, expansão, busca recursiva, rerank, enriquecimento)
+a rota pergunta `orcamento.cabe(etapa)`: a etapa só roda se o p95 recente dela cabe no que
+resta, já reservado o p95 das etapas obrigatórias que ainda não rodaram. As decisões são
+tomadas na ordem do pipeline, e as etapas puladas são informadas no stream
+(`response.stages.skipped`). Etapas ainda sem medição sempre rodam.
+
+Etapas opcionais recusadas pela fila da OpenAI (OpenAISaturado) também entram nas puladas,
+com `reason: "openai_saturado"`, em vez de a resposta perder qualidade em silêncio.
+"""
+from fastapi import HTTPException, Request
+from config import LATENCY_BUDGET_MS
+from utils.metrics import Timings, etapas_puladas, p95_fase
+from utils.openai_scheduler import OpenAISaturado
+from utils.sse import make_sse_event
+
+# Fases sem as quais não há resposta: a busca principal, a montagem do prompt e a
+# espera pelo primeiro token da geração
+ETAPAS_OBRIGATORIAS = ("pg_hybrid", "vector_search", "prompt", "primeiro_token")
+
+
+class LatencyBudget:
+    def __init__(self, timings: Timings, segundos: float | None, obrigatorias: tuple[str, ...] = ETAPAS_OBRIGATORIAS):
+        self.timings = timings
+        self.segundos = segundos
+        self.obrigatorias = obrigatorias
+        self.pulados: list[dict] = []
+
+    def restante(self) -> float:
+        return self.segundos - self.timings.decorrido()
+
+    def cabe(self, etapa: str) -> bool:
+        """Se a etapa opcional cabe no orçamento; se não couber, registra a etapa como pulada."""
+        if self.segundos is None:
+            return True
+        custo = p95_fase(self.timings.rota, etapa)
+        if custo is None:
+            return True
+        reserva = sum(p95_fase(self.timings.rota, fase) or 0.0 for fase in self.obrigatorias if fase not in self.timings.fases)
+        disponivel = self.restante() - reserva
+        if custo <= disponivel:
+            return True
+        self.pulados.append({"stage": etapa, "p95_ms": round(custo * 1000), "available_ms": round(max(disponivel, 0.0) * 1000)})
+        etapas_puladas.labels(rota=self.timings.rota, etapa=etapa).inc()
+        print(f"⏭️ Pulando {etapa}: p95 de {custo * 1000:.0f} ms, restam {max(disponivel, 0.0) * 1000:.0f} ms do orçamento.")
+        return False
+
+    def saturado(self, etapa: str, erro: OpenAISaturado):
+        """Registra a etapa como pulada porque a fila da OpenAI recusou a chamada."""
+        self.pulados.append({"stage": etapa, "reason": "openai_saturado", "retry_after_s": round(erro.retry_after, 1)})
+        etapas_puladas.labels(rota=self.timings.rota, etapa=etapa).inc()
+        print(f"⏭️ Pulando {etapa}: OpenAI saturada ({erro}).")
+
+    async def executar(self, etapa: str, chamada, padrao):
+        """
+        Roda a etapa opcional `chamada()` se ela cabe no orçamento; pulada (por tempo ou por
+        OpenAISaturado), a etapa vale `padrao`.
+        """
+        if not self.cabe(etapa):
+            return padrao
+        try:
+            return await chamada()
+        except OpenAISaturado as e:
+            self.saturado(etapa, e)
+            return padrao
+
+    def evento(self) -> str | None:
+        """Evento SSE com as etapas puladas (None se nenhuma foi pulada)."""
+        if not self.pulados:
+            return None
+        return make_sse_event("response.stages.skipped", {
+            "type": "response.stages.skipped",
+            "budget_ms": round(self.segundos * 1000) if self.segundos is not None else None,
+            "stages": self.pulados,
+        })
+
+
+def iniciar_orcamento(request: Request, timings: Timings) -> LatencyBudget:
+    """Orçamento da requisição: cabeçalho `X-Latency-Budget-Ms` ou o padrão da rota."""
+    cabecalho = request.headers.get("x-latency-budget-ms")
+    if cabecalho is None:
+        ms = LATENCY_BUDGET_MS.get(timings.rota, 0)
+    else:
+        try:
+            ms = float(cabecalho)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Latency-Budget-Ms deve ser um número de milissegundos.")
+    return LatencyBudget(timings, ms / 1000 if ms > 0 else None)
@@ -0,0 +1,42 @@
+# utils/lazy.py
+import threading
+from typing import Any, Callable
+
+
+class LazySingleton:
+    """
+    Proxy de uma instância global construída só no primeiro uso (ou no aquecimento do
+    lifespan, via `obter()`). Atributos e métodos são repassados à instância real, então
+    `from config import vector_store` continua funcionando sem custo na importação.
+    """
+
+    def __init__(self, nome: str, fabrica: Callable[[], Any]):
+        self._nome = nome
+        self._fabrica = fabrica
+        self._instancia = None
+        self._lock = threading.Lock()
+
+    @property
+    def construido(self) -> bool:
+        return self._instancia is not None
+
+    def obter(self) -> Any:
+        """A instância real (construída aqui se ainda não existir)."""
+        if self._instancia is None:
+            with self._lock:
+                if self._instancia is None:
+                    self._instancia = self._fabrica()
+        return self._instancia
+
+    def __getattr__(self, nome: str) -> Any:
+        return getattr(self.obter(), nome)
+
+    def __setattr__(self, nome: str, valor: Any):
+        if nome.startswith("_"):
+            object.__setattr__(self, nome, valor)
+        else:
+            setattr(self.obter(), nome, valor)
+
+    def __repr__(self) -> str:
+        estado = "construído" if self.construido else "pendente"
+        return f"<LazySingleton {self._nome} ({estado})>"
@@ -0,0 +1,122 @@
+# utils/metadata_filters.py
+"""
+Filtros de metadados (ano, tipo, sancionador, número da lei) aplicados dentro das buscas e
+nas listagens/contagens do IntentRouter.run_sql.
+
+Os filtros vêm do IntentRouter (`extrair_filtros`) e só entram campos desta lista, com o
+valor convertido para o tipo do campo. Na busca, cada filtro vira um predicado SQL sobre
+uma expressão tipada de `cmetadata`. A mesma expressão tem um índice, então "MPs de 2023"
+compara `ano` como integer pelo índice em vez de casar texto na coleção inteira. As
+conversões só acontecem quando o texto tem o formato esperado, senão a expressão dá NULL;
+um metadado malformado não derruba a consulta.
+
+Preparação do banco (uma vez; o run_sql usa também a coluna full-text de
+`python -m utils.pg_retriever setup`):
+    python -m utils.metadata_filters setup
+"""
+import argparse
+import asyncio
+import re
+from sqlalchemy import text
+from config import async_engine
+
+
+def _numero(valor) -> float:
+    """Número da lei: aceita 14129, 14129.0 e "14.129" (ponto de milhar)."""
+    if isinstance(valor, str):
+        valor = valor.strip()
+        valor = valor.replace(".", "") if re.fullmatch(r"\d{1,3}(\.\d{3})+", valor) else valor.replace(",", ".")
+    return float(valor)
+
+
+# Campo -> (expressão SQL sobre a coluna {c}, conversão do valor em Python)
+CAMPOS = {
+    "ano": (
+        r"(CASE WHEN ({c}->>'ano') ~ '^[0-9]{{1,4}}$' THEN CAST({c}->>'ano' AS integer) END)",
+        lambda v: int(str(v).strip()),
+    ),
+    "num_lei": (
+        r"(CASE WHEN ({c}->>'num_lei') ~ '^[0-9]{{1,12}}(\.[0-9]+)?$' THEN CAST({c}->>'num_lei' AS numeric) END)",
+        _numero,
+    ),
+    "tipo": (
+        "lower({c}->>'tipo')",
+        lambda v: str(v).strip().lower(),
+    ),
+    "main_sancionador": (
+        "lower({c}->>'main_sancionador')",
+        lambda v: str(v).strip().lower(),
+    ),
+}
+
+# Campos que podem aparecer no SELECT da listagem (IntentRouter.run_sql)
+CAMPOS_SELECAO = ("titulo", "link", "ano", "tipo", "num_lei", "data_lei", "main_sancionador")
+
+SQL_SETUP = [
+    f"CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_meta_{campo} "
+    f"ON langchain_pg_embedding (collection_id, {expressao.format(c='cmetadata')})"
+    for campo, (expressao, _) in CAMPOS.items()
+] + [
+    # Termos no título (ILIKE '%termo%') por trigramas
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_titulo_trgm ON langchain_pg_embedding USING gin ((cmetadata->>'titulo') gin_trgm_ops)",
+]
+
+
+def normalizar_filtros(filtros: dict | None) -> dict:
+    """Só os campos permitidos, com valores convertidos; valores inválidos são descartados."""
+    normalizados = {}
+    for campo, valor in (filtros or {}).items():
+        if campo not in CAMPOS or valor is None or valor == "" or isinstance(valor, (list, dict)):
+            continue
+        try:
+            normalizados[campo] = CAMPOS[campo][1](valor)
+        except (TypeError, ValueError):
+            print(f"⚠️ Filtro ignorado ({campo}={valor!r}): valor inválido.")
+    return normalizados
+
+
+def predicados_sql(filtros: dict | None, alias: str = "e") -> tuple[str, dict]:
+    """Trecho `AND ...` com os filtros (vazio sem filtros) e os parâmetros correspondentes."""
+    coluna = f"{alias}.cmetadata" if alias else "cmetadata"
+    clausulas, params = [], {}
+    for campo, valor in normalizar_filtros(filtros).items():
+        clausulas.append(f" AND {CAMPOS[campo][0].format(c=coluna)} = :filtro_{campo}")
+        params[f"filtro_{campo}"] = valor
+    return "".join(clausulas), params
+
+
+def atende_filtros(doc, filtros: dict | None) -> bool:
+    """Mesma comparação dos predicados SQL, para documentos vindos de fora do banco (BM25, fallback)."""
+    for campo, valor in normalizar_filtros(filtros).items():
+        try:
+            if CAMPOS[campo][1](doc.metadata.get(campo)) != valor:
+                return False
+        except (TypeError, ValueError):
+            return False
+    return True
+
+
+def filtrar_documentos(docs: list | None, filtros: dict | None) -> list | None:
+    if not filtros or docs is None:
+        return docs
+    return [doc for doc in docs if atende_filtros(doc, filtros)]
+
+
+async def ensure_schema():
+    """Cria os índices de expressão dos campos filtráveis (idempotente)."""
+    async with async_engine.begin() as conn:
+        for sql in SQL_SETUP:
+            await conn.execute(text(sql))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Filtros de metadados nas buscas")
+    parser.add_argument("comando", choices=["setup"])
+    parser.parse_args()
+    asyncio.run(ensure_schema())
+    print(f"Índices de metadados prontos: {', '.join(CAMPOS)}.")
+
+
+if __name__ == "__main__":
+    main()
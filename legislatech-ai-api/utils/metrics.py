@@ -0,0 +1,178 @@
+# utils/metrics.py
+"""
+Métricas Prometheus (expostas em /metrics) e tempos por fase de cada requisição.
+
+A rota chama `iniciar_timings(rota)` no início; as fases do pipeline são medidas com
+`with medir("fase"):`. Como o objeto de tempos fica num ContextVar definido antes de criar
+as tasks da resposta, buscas e chamadas feitas em tasks filhas também são registradas.
+"""
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import AsyncGenerator
+from prometheus_client import Counter, Gauge, Histogram
+from utils.sse import make_sse_event
+
+streams_cancelados = Counter(
+    "legislatech_streams_cancelados_total",
+    "Respostas SSE canceladas porque o cliente desconectou",
+    ["rota"],
+)
+
+respostas_compartilhadas = Counter(
+    "legislatech_respostas_compartilhadas_total",
+    "Requisições atendidas acompanhando o stream de uma pergunta igual já em andamento",
+    ["rota"],
+)
+
+fase_duracao = Histogram(
+    "legislatech_fase_duracao_segundos",
+    "Duração de cada fase do pipeline RAG",
+    ["rota", "fase"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40),
+)
+
+tokens_openai = Counter(
+    "legislatech_openai_tokens_total",
+    "Tokens consumidos na OpenAI por fase",
+    ["rota", "fase", "tipo"],
+)
+
+openai_espera_fila = Histogram(
+    "legislatech_openai_espera_fila_segundos",
+    "Espera na fila do agendador até a chamada à OpenAI ser liberada",
+    ["prioridade"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20),
+)
+
+openai_rejeicoes = Counter(
+    "legislatech_openai_rejeicoes_total",
+    "Chamadas à OpenAI recusadas porque não seriam liberadas dentro do prazo da fila",
+    ["prioridade"],
+)
+
+openai_429 = Counter(
+    "legislatech_openai_429_total",
+    "Respostas 429 (rate limit) recebidas da OpenAI",
+)
+
+etapas_puladas = Counter(
+    "legislatech_etapas_puladas_total",
+    "Etapas opcionais puladas porque o p95 delas não cabia no orçamento de latência",
+    ["rota", "etapa"],
+)
+
+import_ate_pronto = Gauge(
+    "legislatech_import_ate_pronto_segundos",
+    "Tempo da importação de main.py até o fim do aquecimento",
+)
+
+_timings: ContextVar["Timings | None"] = ContextVar("timings", default=None)
+_fase: ContextVar[str] = ContextVar("fase", default="outros")
+# Durações recentes por (rota, fase), para estimar o custo de cada etapa (ver utils/latency_budget.py)
+_recentes: dict[tuple[str, str], deque] = defaultdict(lambda: deque(maxlen=500))
+
+
+class Timings:
+    """Tempos e tokens de uma requisição, agregados por fase."""
+
+    def __init__(self, rota: str, debug: bool = False):
+        self.rota = rota
+        self.debug = debug
+        self.inicio = time.perf_counter()
+        self.fases: dict[str, dict] = {}
+        self.tokens: dict[str, dict] = {}
+
+    def decorrido(self) -> float:
+        return time.perf_counter() - self.inicio
+
+    def registrar(self, fase: str, duracao: float):
+        fase_duracao.labels(rota=self.rota, fase=fase).observe(duracao)
+        _recentes[(self.rota, fase)].append(duracao)
+        estatistica = self.fases.setdefault(fase, {"chamadas": 0, "total_ms": 0.0, "max_ms": 0.0})
+        estatistica["chamadas"] += 1
+        estatistica["total_ms"] += duracao * 1000
+        estatistica["max_ms"] = max(estatistica["max_ms"], duracao * 1000)
+
+    def registrar_tokens(self, fase: str, usage: dict):
+        por_fase = self.tokens.setdefault(fase, {"prompt": 0, "completion": 0})
+        for tipo in ("prompt", "completion"):
+            quantidade = usage.get(f"{tipo}_tokens") or 0
+            por_fase[tipo] += quantidade
+            tokens_openai.labels(rota=self.rota, fase=fase, tipo=tipo).inc(quantidade)
+
+    def resumo(self) -> dict:
+        return {
+            "total_ms": round(self.decorrido() * 1000, 1),
+            "fases": {fase: {k: round(v, 1) for k, v in e.items()} for fase, e in self.fases.items()},
+            "tokens": self.tokens,
+        }
+
+
+def iniciar_timings(rota: str, debug: bool = False) -> Timings:
+    timings = Timings(rota, debug=debug)
+    _timings.set(timings)
+    return timings
+
+
+@contextmanager
+def medir(fase: str):
+    """Mede a duração de um trecho e associa à fase as chamadas à OpenAI feitas nele."""
+    timings = _timings.get()
+    token = _fase.set(fase)
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        _fase.reset(token)
+        if timings is not None:
+            timings.registrar(fase, time.perf_counter() - inicio)
+
+
+def registrar_tempo(fase: str, duracao: float):
+    timings = _timings.get()
+    if timings is not None:
+        timings.registrar(fase, duracao)
+
+
+def registrar_uso(usage: dict | None, fase: str | None = None):
+    """Contabiliza os tokens de uma resposta da OpenAI na fase atual (ou na informada)."""
+    timings = _timings.get()
+    if timings is not None and usage:
+        timings.registrar_tokens(fase or _fase.get(), usage)
+
+
+def p95_fase(rota: str, fase: str) -> float | None:
+    """p95 das durações recentes de uma fase na rota (None sem medições)."""
+    recentes = sorted(_recentes.get((rota, fase), ()))
+    if not recentes:
+        return None
+    return recentes[min(len(recentes) - 1, int(len(recentes) * 0.95))]
+
+
+def rota_atual() -> str | None:
+    """Rota da requisição em andamento (None fora de uma requisição)."""
+    timings = _timings.get()
+    return timings.rota if timings is not None else None
+
+
+def tempo_desde_inicio() -> float | None:
+    timings = _timings.get()
+    return timings.decorrido() if timings is not None else None
+
+
+async def com_timings(eventos: AsyncGenerator[str, None], timings: Timings) -> AsyncGenerator[str, None]:
+    """
+    Repassa os eventos da resposta e registra a duração total. Com o cabeçalho
+    `X-Debug-Timings: 1`, envia os tempos e tokens por fase num evento final.
+    """
+    concluido = False
+    try:
+        async for evento in eventos:
+            yield evento
+        concluido = True
+    finally:
+        timings.registrar("total", timings.decorrido())
+    if concluido and timings.debug:
+        yield make_sse_event("response.debug.timings", {"type": "response.debug.timings", **timings.resumo()})
@@ -0,0 +1,211 @@
+# utils/openai_client.py
+import itertools
+import json
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator
+import aiohttp
+from config import (
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_POOL_LIMIT,
+    OPENAI_POOL_LIMIT_PER_HOST,
+    OPENAI_KEEPALIVE_TIMEOUT,
+    OPENAI_CONNECT_TIMEOUT,
+    OPENAI_REQUEST_TIMEOUT,
+    OPENAI_STREAM_READ_TIMEOUT,
+    LLM_CACHE_MODE,
+    LLM_CACHE_SIZE,
+    LLM_CACHE_PATH,
+    OPENAI_MAX_RETRIES_429,
+)
+from utils.completion_cache import CompletionCache, CompletionCacheMiss
+from utils.metrics import registrar_uso
+from utils.openai_scheduler import (
+    OpenAIScheduler,
+    PRIORIDADE_GERACAO,
+    PRIORIDADE_PIPELINE,
+    estimar_tokens,
+    openai_scheduler,
+)
+
+
+class OpenAIClient:
+    """
+    Cliente HTTP único para a API da OpenAI, com pool de conexões persistentes.
+    A sessão é aberta e fechada no lifespan da aplicação (ver main.py).
+    Toda chamada à rede passa pelo agendador (orçamento RPM/TPM, prioridade e 429).
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str,
+        pool_limit: int = 100,
+        pool_limit_per_host: int = 50,
+        keepalive_timeout: float = 60,
+        connect_timeout: float = 5,
+        request_timeout: float = 30,
+        stream_read_timeout: float = 60,
+        cache: CompletionCache | None = None,
+        scheduler: OpenAIScheduler | None = None,
+        max_retries_429: int = 2,
+    ):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.pool_limit = pool_limit
+        self.pool_limit_per_host = pool_limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.stream_read_timeout = stream_read_timeout
+        self.cache = cache
+        self.scheduler = scheduler
+        self.max_retries_429 = max_retries_429
+        self._session: aiohttp.ClientSession | None = None
+
+    async def start(self):
+        """Abre a sessão compartilhada (idempotente)."""
+        if self._session is not None and not self._session.closed:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_limit,
+            limit_per_host=self.pool_limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=300,
+        )
+        self._session = aiohttp.ClientSession(
+            connector=connector,
+            headers={"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"},
+        )
+
+    async def close(self):
+        """Fecha a sessão e libera as conexões do pool."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        # Permite uso fora do lifespan (scripts, notebooks) abrindo a sessão sob demanda
+        if self._session is None or self._session.closed:
+            await self.start()
+        return self._session
+
+    @asynccontextmanager
+    async def _post(self, payload: dict, client_timeout: aiohttp.ClientTimeout, prioridade: int, estimado: int):
+        """
+        POST a /chat/completions liberado pelo agendador. Num 429, pausa a fila pelo
+        `Retry-After` e tenta de novo (até `max_retries_429` vezes).
+        """
+        session = await self._get_session()
+        for tentativa in itertools.count():
+            if self.scheduler is not None:
+                await self.scheduler.adquirir(estimado, prioridade)
+            async with session.post(f"{self.base_url}/chat/completions", json=payload, timeout=client_timeout) as resp:
+                if self.scheduler is not None:
+                    self.scheduler.sincronizar(resp.headers)
+                    if resp.status == 429 and tentativa < self.max_retries_429:
+                        espera = self.scheduler.pausar_por_429(resp.headers)
+                        print(f"⏳ OpenAI retornou 429, nova tentativa em {espera:.1f}s.")
+                        continue
+                resp.raise_for_status()
+                yield resp
+                return
+
+    async def chat_completion(self, payload: dict, timeout: float | None = None, cache: bool = False, prioridade: int = PRIORIDADE_PIPELINE) -> dict:
+        """
+        Chamada não-streaming a /chat/completions. Retorna o JSON da resposta.
+        `cache=True` marca helpers curtos e repetitivos como cacheáveis (ver CompletionCache).
+        `prioridade` ordena a chamada na fila do agendador (ver utils/openai_scheduler.py).
+        """
+        key = CompletionCache.key(payload) if self.cache is not None else None
+        if self.cache is not None and self.cache.deve_ler(cache):
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+            if self.cache.mode == "replay":
+                raise CompletionCacheMiss(f"Completion não gravada (modelo {payload.get('model')}).")
+
+        client_timeout = aiohttp.ClientTimeout(
+            total=timeout or self.request_timeout,
+            connect=self.connect_timeout,
+        )
+        estimado = estimar_tokens(payload)
+        async with self._post(payload, client_timeout, prioridade, estimado) as resp:
+            resp_json = await resp.json()
+        registrar_uso(resp_json.get("usage"))
+        if self.scheduler is not None:
+            self.scheduler.ajustar(estimado, resp_json.get("usage"))
+
+        if self.cache is not None and self.cache.deve_gravar(cache):
+            self.cache.set(key, resp_json)
+        return resp_json
+
+    async def stream_chat_completion(self, payload: dict, timeout: float | None = None, prioridade: int = PRIORIDADE_GERACAO) -> AsyncGenerator[str, None]:
+        """
+        Chamada streaming a /chat/completions. Gera apenas os trechos de texto (delta.content).
+        Fechar o gerador fecha a conexão com a OpenAI.
+        Nos modos record/replay do cache, os trechos são gravados/reproduzidos.
+        """
+        payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+        key = CompletionCache.key(payload) if self.cache is not None else None
+        if self.cache is not None and self.cache.mode == "replay":
+            cached = self.cache.get(key)
+            if cached is None:
+                raise CompletionCacheMiss(f"Streaming não gravado (modelo {payload.get('model')}).")
+            for content in cached:
+                yield content
+            return
+
+        gravar = self.cache is not None and self.cache.mode == "record"
+        gravados = []
+        client_timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=self.connect_timeout,
+            sock_read=timeout or self.stream_read_timeout,
+        )
+        estimado = estimar_tokens(payload)
+        async with self._post(payload, client_timeout, prioridade, estimado) as resp:
+            async for line in resp.content:
+                if not line.startswith(b"data: "):
+                    continue
+                data = line[len(b"data: "):].strip()
+                if data == b"[DONE]":
+                    # Lê o fim do corpo para a conexão voltar ao pool (keep-alive)
+                    await resp.read()
+                    break
+                try:
+                    chunk = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                # Com include_usage, o último chunk traz o consumo (e choices vazio)
+                if chunk.get("usage"):
+                    registrar_uso(chunk["usage"], fase="geracao")
+                    if self.scheduler is not None:
+                        self.scheduler.ajustar(estimado, chunk["usage"])
+                try:
+                    content = chunk["choices"][0]["delta"].get("content")
+                except (IndexError, KeyError, TypeError):
+                    continue
+                if content:
+                    if gravar:
+                        gravados.append(content)
+                    yield content
+
+        if gravar:
+            self.cache.set(key, gravados)
+
+
+# Instância compartilhada por todas as rotas
+openai_client = OpenAIClient(
+    api_key=OPENAI_API_KEY,
+    base_url=OPENAI_BASE_URL,
+    pool_limit=OPENAI_POOL_LIMIT,
+    pool_limit_per_host=OPENAI_POOL_LIMIT_PER_HOST,
+    keepalive_timeout=OPENAI_KEEPALIVE_TIMEOUT,
+    connect_timeout=OPENAI_CONNECT_TIMEOUT,
+    request_timeout=OPENAI_REQUEST_TIMEOUT,
+    stream_read_timeout=OPENAI_STREAM_READ_TIMEOUT,
+    scheduler=openai_scheduler,
+    max_retries_429=OPENAI_MAX_RETRIES_429,
+    cache=None if LLM_CACHE_MODE == "off" else CompletionCache(maxsize=LLM_CACHE_SIZE, disk_path=LLM_CACHE_PATH, mode=LLM_CACHE_MODE),
+)
@@ -0,0 +1,251 @@
+# utils/openai_scheduler.py
+"""
+Agendamento das chamadas à OpenAI dentro dos limites da conta.
+
+Dois baldes de fichas acompanham os orçamentos de requisições e de tokens por minuto
+(OPENAI_RPM / OPENAI_TPM; com 0, os limites são lidos dos cabeçalhos `x-ratelimit-*`
+das respostas). Quando não há orçamento, as chamadas esperam numa fila por prioridade:
+a geração da resposta ao usuário passa na frente das etapas do pipeline (refine, rerank,
+intenção), que passam na frente das opcionais (expansão e sub-queries da busca recursiva).
+
+Uma chamada que não seria liberada dentro de OPENAI_QUEUE_MAX_WAIT segundos é recusada
+com OpenAISaturado (a API responde 503 com `Retry-After`). Um 429 da OpenAI pausa a fila
+pelo tempo de `Retry-After`.
+
+Cada rota admite uma resposta nova (`admitir_resposta`) pelo custo estimado do pipeline
+inteiro (OPENAI_ADMISSION_CALLS / OPENAI_ADMISSION_TOKENS), e não só pela geração; assim a
+recusa acontece com 503 antes do stream, e não no meio dele. As etapas opcionais que ainda
+assim forem recusadas aparecem em `response.stages.skipped` (ver utils/latency_budget.py).
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from config import (
+    OPENAI_RPM,
+    OPENAI_TPM,
+    OPENAI_QUEUE_MAX_WAIT,
+    OPENAI_COMPLETION_ESTIMATE,
+    OPENAI_ADMISSION_CALLS,
+    OPENAI_ADMISSION_TOKENS,
+    tiktoken_encoder,
+)
+from utils.metrics import openai_429, openai_espera_fila, openai_rejeicoes
+
+PRIORIDADE_GERACAO = 0
+PRIORIDADE_PIPELINE = 1
+PRIORIDADE_OPCIONAL = 2
+NOMES_PRIORIDADE = {PRIORIDADE_GERACAO: "geracao", PRIORIDADE_PIPELINE: "pipeline", PRIORIDADE_OPCIONAL: "opcional"}
+
+
+class OpenAISaturado(Exception):
+    """O orçamento da OpenAI não libera a chamada dentro do prazo da fila."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Limite de uso da OpenAI atingido; tente novamente em {math.ceil(retry_after)}s.")
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Balde de fichas reposto continuamente (`por_minuto` fichas por minuto, até `capacidade`)."""
+
+    def __init__(self, por_minuto: float, capacidade: float | None = None):
+        self.capacidade = capacidade or por_minuto
+        self.taxa = por_minuto / 60
+        self.nivel = self.capacidade
+        self._atualizado = time.monotonic()
+
+    def _repor(self):
+        agora = time.monotonic()
+        self.nivel = min(self.capacidade, self.nivel + (agora - self._atualizado) * self.taxa)
+        self._atualizado = agora
+
+    def espera(self, quantidade: float) -> float:
+        """Segundos até haver `quantidade` fichas no balde."""
+        self._repor()
+        return max(0.0, (quantidade - self.nivel) / self.taxa)
+
+    def consumir(self, quantidade: float):
+        self._repor()
+        self.nivel -= quantidade
+
+    def ajustar(self, diferenca: float):
+        """Corrige uma estimativa depois do consumo real (positivo = consumiu mais)."""
+        self._repor()
+        self.nivel = min(self.capacidade, self.nivel - diferenca)
+
+    def sincronizar(self, limite: float, restante: float):
+        """Alinha o balde ao que a OpenAI informa (nunca acima do que ela diz restar)."""
+        if limite > 0 and limite != self.capacidade:
+            self.capacidade = limite
+            self.taxa = limite / 60
+        self._repor()
+        self.nivel = min(self.nivel, restante)
+
+
+def estimar_tokens(payload: dict, completion: int = OPENAI_COMPLETION_ESTIMATE) -> int:
+    """Tokens que a chamada deve consumir: prompt (tiktoken) + max_tokens ou uma estimativa."""
+    prompt = "".join(str(m.get("content", "")) for m in payload.get("messages", []))
+    return len(tiktoken_encoder.encode(prompt)) + (payload.get("max_tokens") or completion)
+
+
+def _segundos(valor: str | None) -> float | None:
+    # Cabeçalhos da OpenAI: "20", "1.5", "6m0s", "250ms"
+    if not valor:
+        return None
+    try:
+        return float(valor)
+    except ValueError:
+        pass
+    total, numero = 0.0, ""
+    unidades = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    i = 0
+    while i < len(valor):
+        c = valor[i]
+        if c.isdigit() or c == ".":
+            numero += c
+            i += 1
+            continue
+        unidade = "ms" if valor[i:i + 2] == "ms" else c
+        if unidade not in unidades or not numero:
+            return None
+        total += float(numero) * unidades[unidade]
+        numero = ""
+        i += len(unidade)
+    return total
+
+
+class OpenAIScheduler:
+    def __init__(self, rpm: int = 0, tpm: int = 0, max_espera: float = 10):
+        self.requisicoes = TokenBucket(rpm) if rpm > 0 else None
+        self.tokens = TokenBucket(tpm) if tpm > 0 else None
+        # Sem limites configurados, os baldes são criados com os valores dos cabeçalhos
+        self.limites_automaticos = rpm <= 0 and tpm <= 0
+        self.max_espera = max_espera
+        self._fila: list[tuple] = []
+        self._seq = itertools.count()
+        self._acordar = asyncio.Event()
+        self._pausa_ate = 0.0
+        self._despachante: asyncio.Task | None = None
+
+    def _espera_ate_liberar(self, requisicoes: int, tokens: int) -> float:
+        espera = max(0.0, self._pausa_ate - time.monotonic())
+        if self.requisicoes is not None:
+            espera = max(espera, self.requisicoes.espera(requisicoes))
+        if self.tokens is not None:
+            espera = max(espera, self.tokens.espera(tokens))
+        return espera
+
+    def espera_estimada(self, prioridade: int = PRIORIDADE_GERACAO, tokens: int = 0, requisicoes: int = 1) -> float:
+        """
+        Tempo até `requisicoes` chamadas novas (~`tokens` tokens) serem liberadas, contando a
+        fila de mesma prioridade ou maior. O custo novo é limitado à capacidade dos baldes.
+        """
+        if self.requisicoes is not None:
+            requisicoes = min(requisicoes, int(self.requisicoes.capacidade))
+        if self.tokens is not None:
+            tokens = min(tokens, int(self.tokens.capacidade))
+        a_frente = [item for item in self._fila if item[0] <= prioridade and not item[4].done()]
+        return self._espera_ate_liberar(len(a_frente) + requisicoes, sum(item[2] for item in a_frente) + tokens)
+
+    def verificar_admissao(self, prioridade: int = PRIORIDADE_GERACAO, tokens: int = 0, requisicoes: int = 1):
+        """Levanta OpenAISaturado se as chamadas não seriam liberadas dentro do prazo da fila."""
+        espera = self.espera_estimada(prioridade, tokens, requisicoes)
+        if espera > self.max_espera:
+            openai_rejeicoes.labels(prioridade=NOMES_PRIORIDADE[prioridade]).inc()
+            raise OpenAISaturado(espera)
+
+    def admitir_resposta(self, rota: str):
+        """Admissão de uma resposta nova da rota, pelo custo estimado do pipeline inteiro."""
+        self.verificar_admissao(PRIORIDADE_GERACAO, OPENAI_ADMISSION_TOKENS.get(rota, 0), OPENAI_ADMISSION_CALLS.get(rota, 1))
+
+    async def adquirir(self, tokens: int, prioridade: int = PRIORIDADE_PIPELINE):
+        """Espera o orçamento para uma chamada de ~`tokens` tokens, na ordem de prioridade."""
+        if self.tokens is not None:
+            tokens = min(tokens, int(self.tokens.capacidade))
+        self.verificar_admissao(prioridade, tokens)
+        if not self._fila and self._espera_ate_liberar(1, tokens) <= 0:
+            self._consumir(tokens)
+            openai_espera_fila.labels(prioridade=NOMES_PRIORIDADE[prioridade]).observe(0)
+            return
+
+        inicio = time.monotonic()
+        futuro = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._fila, (prioridade, next(self._seq), tokens, inicio + self.max_espera, futuro))
+        if self._despachante is None or self._despachante.done():
+            self._despachante = asyncio.create_task(self._despachar())
+        self._acordar.set()
+        try:
+            await futuro
+        except asyncio.CancelledError:
+            futuro.cancel()
+            raise
+        openai_espera_fila.labels(prioridade=NOMES_PRIORIDADE[prioridade]).observe(time.monotonic() - inicio)
+
+    def _consumir(self, tokens: int):
+        if self.requisicoes is not None:
+            self.requisicoes.consumir(1)
+        if self.tokens is not None:
+            self.tokens.consumir(tokens)
+
+    async def _despachar(self):
+        while self._fila:
+            prioridade, _, tokens, prazo, futuro = self._fila[0]
+            if futuro.done():
+                heapq.heappop(self._fila)
+                continue
+            espera = self._espera_ate_liberar(1, tokens)
+            if espera <= 0:
+                heapq.heappop(self._fila)
+                self._consumir(tokens)
+                futuro.set_result(None)
+                continue
+            if time.monotonic() + espera > prazo:
+                heapq.heappop(self._fila)
+                openai_rejeicoes.labels(prioridade=NOMES_PRIORIDADE[prioridade]).inc()
+                futuro.set_exception(OpenAISaturado(espera))
+                continue
+            # Dorme até haver orçamento, ou até chegar uma chamada de prioridade maior
+            self._acordar.clear()
+            try:
+                await asyncio.wait_for(self._acordar.wait(), timeout=espera)
+            except asyncio.TimeoutError:
+                pass
+
+    def ajustar(self, estimado: int, usage: dict | None):
+        """Troca a estimativa de tokens pelo consumo real informado em `usage`."""
+        if self.tokens is not None and usage and usage.get("total_tokens"):
+            self.tokens.ajustar(usage["total_tokens"] - estimado)
+
+    def sincronizar(self, headers):
+        """Atualiza os baldes com os cabeçalhos `x-ratelimit-*` de uma resposta da OpenAI."""
+        for nome, atributo in (("requests", "requisicoes"), ("tokens", "tokens")):
+            try:
+                limite = float(headers.get(f"x-ratelimit-limit-{nome}", 0))
+                restante = float(headers.get(f"x-ratelimit-remaining-{nome}", -1))
+            except ValueError:
+                continue
+            if restante < 0:
+                continue
+            balde = getattr(self, atributo)
+            if balde is None:
+                if not self.limites_automaticos or limite <= 0:
+                    continue
+                balde = TokenBucket(limite)
+                setattr(self, atributo, balde)
+            balde.sincronizar(limite if self.limites_automaticos else 0, restante)
+
+    def pausar_por_429(self, headers) -> float:
+        """Pausa a fila pelo `Retry-After` de um 429 (ou 1 s sem o cabeçalho). Retorna a pausa."""
+        openai_429.inc()
+        espera = _segundos(headers.get("retry-after-ms"))
+        espera = espera / 1000 if espera is not None else _segundos(headers.get("retry-after"))
+        espera = 1.0 if espera is None else espera
+        self._pausa_ate = max(self._pausa_ate, time.monotonic() + espera)
+        self._acordar.set()
+        return espera
+
+
+# Instância compartilhada pelo cliente da OpenAI
+openai_scheduler = OpenAIScheduler(rpm=OPENAI_RPM, tpm=OPENAI_TPM, max_espera=OPENAI_QUEUE_MAX_WAIT)
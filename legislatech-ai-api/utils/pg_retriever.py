@@ -0,0 +1,204 @@
+# utils/pg_retriever.py
+"""
+Busca híbrida no próprio Postgres: distância de cosseno (pgvector) e ts_rank_cd
+(full-text em português) fundidas por reciprocal rank fusion numa única consulta.
+
+Também faz a busca só vetorial das rotas (modo VECTOR_SEARCH_BACKEND=pg_ann), com a mesma
+expressão do índice ANN da coleção e os parâmetros de busca da rota (ver utils/ann_index.py).
+
+Preparação do banco (uma vez; o ALTER TABLE reescreve a tabela):
+    python -m utils.pg_retriever setup
+"""
+import argparse
+import asyncio
+from langchain_core.documents import Document
+from sqlalchemy import text
+from config import async_engine, COLLECTION_NAME, VECTOR_SEARCH_BACKEND
+from utils.ann_index import (
+    aplicar_parametros_busca,
+    busca_iterativa_disponivel,
+    expressao_embedding,
+    indice_ann_disponivel,
+    tipo_parametro,
+    uuid_colecao,
+)
+from utils.metadata_filters import predicados_sql
+from utils.metrics import medir
+from utils.query_embeddings import query_embeddings
+
+SQL_SETUP = [
+    """
+    ALTER TABLE langchain_pg_embedding
+    ADD COLUMN IF NOT EXISTS document_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('portuguese', coalesce(document, ''))) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_document_tsv ON langchain_pg_embedding USING gin (document_tsv)",
+]
+
+# Cada lado gera sua lista ordenada de candidatos; a fusão soma 1/(k_rrf + posição).
+# O tsquery troca AND por OR para que perguntas longas ainda encontrem trechos parciais.
+# O UUID da coleção entra literal (como no índice ANN parcial), a distância usa a
+# expressão do índice (halfvec, em qualquer VECTOR_SEARCH_BACKEND) e os filtros de metadados
+# viram predicados; tudo preenchido por `_preparar`.
+SQL_HIBRIDO = """
+WITH denso AS (
+    SELECT id, ROW_NUMBER() OVER (ORDER BY distancia) AS posicao
+    FROM (
+        SELECT e.id, {distancia} AS distancia
+        FROM langchain_pg_embedding e
+        WHERE e.collection_id = '{colecao}'{filtros}
+        ORDER BY distancia
+        LIMIT :candidatos
+    ) t
+),
+consulta AS (
+    SELECT NULLIF(replace(plainto_tsquery('portuguese', :query)::text, '&', '|'), '')::tsquery AS q
+),
+esparso AS (
+    SELECT id, ROW_NUMBER() OVER (ORDER BY relevancia DESC) AS posicao
+    FROM (
+        SELECT e.id, ts_rank_cd(e.document_tsv, consulta.q) AS relevancia
+        FROM langchain_pg_embedding e, consulta
+        WHERE e.collection_id = '{colecao}'
+          AND e.document_tsv @@ consulta.q{filtros}
+        ORDER BY relevancia DESC
+        LIMIT :candidatos
+    ) t
+),
+fundido AS (
+    SELECT COALESCE(d.id, s.id) AS id,
+           COALESCE(1.0 / (:k_rrf + d.posicao), 0) + COALESCE(1.0 / (:k_rrf + s.posicao), 0) AS score
+    FROM denso d
+    FULL OUTER JOIN esparso s ON s.id = d.id
+)
+SELECT e.id, e.document, e.cmetadata, f.score
+FROM fundido f
+JOIN langchain_pg_embedding e ON e.id = f.id
+ORDER BY f.score DESC
+LIMIT :k
+"""
+
+SQL_VETORIAL = """
+SELECT e.id, e.document, e.cmetadata
+FROM langchain_pg_embedding e
+WHERE e.collection_id = '{colecao}'{filtros}
+ORDER BY {distancia}
+LIMIT :k
+"""
+
+
+def _vetor_sql(embedding: list[float]) -> str:
+    return "[" + ",".join(f"{x:.7g}" for x in embedding) + "]"
+
+
+class PgHybridRetriever:
+    """Retriever híbrido (vetor + full-text) em uma única ida ao banco."""
+
+    def __init__(self, engine, collection_name: str, k_rrf: int = 60, candidatos: int = 100):
+        self.engine = engine
+        self.collection_name = collection_name
+        self.k_rrf = k_rrf
+        self.candidatos = candidatos
+        self._colecao: str | None = None
+
+    async def _preparar(self, conn, modelo: str, limite: int, filtros: dict | None = None, hibrido: bool = False) -> tuple[str, dict]:
+        """
+        Ajusta os parâmetros do índice ANN na transação e preenche a consulta com o UUID da
+        coleção (lido uma vez), a expressão de distância e os predicados dos filtros;
+        retorna o SQL e os parâmetros dos filtros.
+
+        Com filtros, o índice ANN só devolveria os vizinhos mais próximos de toda a coleção,
+        e os predicados cortariam quase todos (um `tipo` raro dá 0 linhas). No pgvector
+        >= 0.8 a varredura do índice passa a ser iterativa; antes disso a distância usa a
+        coluna original, fora do índice ANN, e o planejador busca a fatia pelos índices dos
+        metadados e ordena as distâncias exatas.
+
+        A busca híbrida (`hibrido`) ordena pela expressão do índice mesmo fora do modo pg_ann
+        e recusa a consulta se a coleção não tiver índice ANN válido: sem ele, cada requisição
+        faria uma varredura sequencial da coleção inteira (a rota usa o fallback BM25).
+        """
+        if self._colecao is None:
+            self._colecao = await uuid_colecao(conn, self.collection_name)
+            if self._colecao is None:
+                raise RuntimeError(f"Coleção {self.collection_name} não encontrada.")
+        predicados, params = predicados_sql(filtros)
+        iterativa = bool(predicados) and await busca_iterativa_disponivel(conn)
+        indice = (not predicados or iterativa) and (hibrido or VECTOR_SEARCH_BACKEND == "pg_ann")
+        if hibrido and indice and not await indice_ann_disponivel(conn, self._colecao):
+            raise RuntimeError(
+                f"A coleção {self.collection_name} não tem índice ANN válido; "
+                "crie-o com `python -m utils.ann_index build` para usar o pg_hybrid."
+            )
+        await aplicar_parametros_busca(conn, limite, iterativa=iterativa)
+        distancia = f"{expressao_embedding('e', indice)} <=> CAST(:embedding AS {tipo_parametro(indice)})"
+        return modelo.format(colecao=self._colecao, distancia=distancia, filtros=predicados), params
+
+    async def ensure_schema(self):
+        """Cria a coluna tsvector gerada e o índice GIN (idempotente)."""
+        async with self.engine.begin() as conn:
+            for sql in SQL_SETUP:
+                await conn.execute(text(sql))
+
+    async def asearch(self, query: str, embedding: list[float], k: int = 30, filtros: dict | None = None) -> list[Document]:
+        params = {
+            "embedding": _vetor_sql(embedding),
+            "query": query,
+            "candidatos": max(self.candidatos, k),
+            "k_rrf": self.k_rrf,
+            "k": k,
+        }
+        # Transação própria: os parâmetros do índice ANN (SET LOCAL) valem só para esta consulta
+        async with self.engine.begin() as conn:
+            sql, params_filtros = await self._preparar(conn, SQL_HIBRIDO, params["candidatos"], filtros, hibrido=True)
+            result = await conn.execute(text(sql), {**params, **params_filtros})
+            rows = result.fetchall()
+        return [Document(id=row.id, page_content=row.document, metadata=row.cmetadata or {}) for row in rows]
+
+    async def asearch_vetorial(self, embedding: list[float], k: int = 5, filtros: dict | None = None) -> list[Document]:
+        """Os k chunks mais próximos do embedding (distância de cosseno), pelo índice ANN."""
+        async with self.engine.begin() as conn:
+            sql, params_filtros = await self._preparar(conn, SQL_VETORIAL, k, filtros)
+            result = await conn.execute(text(sql), {"embedding": _vetor_sql(embedding), "k": k, **params_filtros})
+            rows = result.fetchall()
+        return [Document(id=row.id, page_content=row.document, metadata=row.cmetadata or {}) for row in rows]
+
+
+# Instância compartilhada por todas as rotas
+pg_hybrid_retriever = PgHybridRetriever(async_engine, COLLECTION_NAME)
+
+
+async def buscar_hibrido_pg(query: str, k: int = 30, embedding: list[float] | None = None, filtros: dict | None = None) -> list | None:
+    """
+    Busca híbrida no banco (com o embedding da query, se a rota já o tiver). Retorna None
+    em caso de erro (por exemplo, coluna document_tsv ainda não criada) para que a rota
+    use o fallback.
+    """
+    try:
+        if embedding is None:
+            embedding = await query_embeddings.aembed_query(query)
+        with medir("pg_hybrid"):
+            return await pg_hybrid_retriever.asearch(query, embedding, k=k, filtros=filtros)
+    except Exception as e:
+        print(f"⚠️ Erro na busca híbrida no Postgres, usando fallback: {e}")
+        return None
+
+
+async def buscar_vetorial_pg(embedding: list[float], k: int = 5, filtros: dict | None = None) -> list | None:
+    """Busca vetorial pelo índice ANN; None em caso de erro, para a busca usar o vector store."""
+    try:
+        return await pg_hybrid_retriever.asearch_vetorial(embedding, k=k, filtros=filtros)
+    except Exception as e:
+        print(f"⚠️ Erro na busca vetorial no Postgres, usando o vector store: {e}")
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Busca híbrida no Postgres")
+    parser.add_argument("comando", choices=["setup"])
+    parser.parse_args()
+    asyncio.run(pg_hybrid_retriever.ensure_schema())
+    print("Coluna document_tsv e índice GIN prontos.")
+
+
+if __name__ == "__main__":
+    main()
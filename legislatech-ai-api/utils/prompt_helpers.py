@@ -1,6 +1,12 @@
 # utils/prompt_helpers.py
-from config import tiktoken_encoder, vector_store, OPENAI_API_KEY
-import aiohttp
+from config import tiktoken_encoder, vector_store, VECTOR_SEARCH_BACKEND
+from utils.metrics import medir
+from utils.openai_client import openai_client
+from utils.metadata_filters import filtrar_documentos
+from utils.openai_scheduler import OpenAISaturado, PRIORIDADE_OPCIONAL
+from utils.pg_retriever import buscar_vetorial_pg
+from utils.query_embeddings import query_embeddings
+from utils.retrieval_context import RetrievalContext
 
 def contar_tokens(texto: str) -> int:
     """Conta o número de tokens em um texto usando o encoder do tiktoken."""
@@ -35,65 +41,32 @@ def adicionar_trechos(docs, limite_tokens):
     contexto_str = "\n".join(blocos)
     return contexto_str, tokens
 
-async def buscar_contexto_enriquecido(docs_relevantes: list, vector_store) -> list:
+async def buscar_similares(query: str, vs, k: int = 5, embedding: list[float] | None = None, filtros: dict | None = None) -> list:
     """
-    Recebe uma lista de documentos relevantes e enriquece essa lista
-    buscando o chunk inicial e os vizinhos de cada documento.
+    Busca semântica pelo vetor da query, usando o cache de embeddings
+    (ou um embedding já calculado, quando informado). No modo pg_ann a busca usa o índice
+    ANN da coleção; se ela falhar, usa o vector store. Com `filtros`, a busca é sempre a do
+    Postgres, só na fatia que atende aos filtros; o vector store (que apenas filtra uma
+    busca maior) fica como fallback.
     """
-    if not docs_relevantes:
-        return []
-
-    documentos_finais = {doc.metadata.get("id"): doc for doc in docs_relevantes}
-    ids_adicionais_para_buscar = set()
-
-    for doc in docs_relevantes:
-        doc_id = doc.metadata.get("id")
-        if not doc_id or "_" not in doc_id:
-            continue
-
-        try:
-            prefixo, chunk_num_str = doc_id.rsplit("_", 1)
-            chunk_num = int(chunk_num_str)
-        except ValueError:
-            continue
-
-        if chunk_num > 0:
-            id_chunk_zero = f"{prefixo}_0"
-            if id_chunk_zero not in documentos_finais:
-                ids_adicionais_para_buscar.add(id_chunk_zero)
-
-        id_vizinho_1 = f"{prefixo}_{chunk_num + 1}"
-        if id_vizinho_1 not in documentos_finais:
-            ids_adicionais_para_buscar.add(id_vizinho_1)
-
-        id_vizinho_2 = f"{prefixo}_{chunk_num + 2}"
-        if id_vizinho_2 not in documentos_finais:
-            ids_adicionais_para_buscar.add(id_vizinho_2)
-
-    if ids_adicionais_para_buscar:
-        try:
-            # Usando o método assíncrono correto para buscar por IDs
-            fetched_docs = await vector_store.aget_by_ids(list(ids_adicionais_para_buscar))
-
-            for doc_adicional in fetched_docs:
-                doc_id_adicional = doc_adicional.metadata.get("id")
-                if doc_id_adicional not in documentos_finais:
-                    documentos_finais[doc_id_adicional] = doc_adicional
-
-        except Exception as e:
-            print(f"⚠️ Erro ao buscar chunks adicionais: {e}")
-
-    print(f"Total de documentos enriquecidos: {len(documentos_finais)}")
-
-    return list(documentos_finais.values())
-
-async def _search_chunks(query: str, k: int = 5) -> dict:
+    if embedding is None:
+        embedding = await query_embeddings.aembed_query(query)
+    with medir("vector_search"):
+        docs = await buscar_vetorial_pg(embedding, k, filtros) if VECTOR_SEARCH_BACKEND == "pg_ann" or filtros else None
+        if docs is None:
+            docs = await vs.asimilarity_search_by_vector(embedding, k=k * 4 if filtros else k)
+            docs = filtrar_documentos(docs, filtros)[:k]
+        return docs
+
+async def _search_chunks(contexto: RetrievalContext, k: int = 5) -> dict:
     """
     Busca chunks de documentos usando o retriever do vector_store.
+    O resultado fica em `contexto.documentos` para a montagem do prompt.
     """
+    query = contexto.query
     print(f"Buscando chunks para a query: {query}")
-    # Usando o método assíncrono correto para busca semântica
-    docs = await vector_store.asimilarity_search(query, k=k)
+    docs = await buscar_similares(query, vector_store, k=k, embedding=await contexto.embedding(), filtros=contexto.filtros)
+    contexto.documentos = contexto.registrar(docs)
     print(f"Encontrados {len(docs)} chunks para a query: {query}")
     
     return {
@@ -104,12 +77,16 @@ async def _search_chunks(query: str, k: int = 5) -> dict:
         "documents": docs
     }
 
-async def montar_contexto_com_documentos(query, vs, limite_contexto=4000, top_k=5):
+async def montar_contexto_com_documentos(contexto: RetrievalContext, vs, limite_contexto=4000, top_k=5):
     """
-    Monta um contexto rico buscando documentos relacionados e formata o prompt.
+    Monta um contexto rico com os documentos relacionados e formata o prompt.
+    Usa os documentos já buscados em `contexto`; só busca se a rota ainda não buscou.
     """
-    # Usando o método assíncrono correto para busca semântica
-    top_docs = await vs.asimilarity_search(query, k=top_k)
+    query = contexto.query
+    if contexto.documentos:
+        top_docs = contexto.documentos[:top_k]
+    else:
+        top_docs = await buscar_similares(query, vs, k=top_k, embedding=await contexto.embedding(), filtros=contexto.filtros)
     
     contexto_str, _ = adicionar_trechos(top_docs, limite_contexto)
     
@@ -142,9 +119,30 @@ Responda com uma lista de leis identificadas nos documentos abaixo e faça uma *
 
     return prompt
 
+async def refinar_query(user_query: str) -> str:
+    """
+    Reescreve a pergunta do usuário para otimizar a busca; em caso de erro usa a original.
+    OpenAISaturado é repassado, para a rota registrar a etapa como pulada.
+    """
+    refine_prompt = f"Reescreva a seguinte pergunta para otimizar a busca em um sistema de rag sobre as leis do brasil: {user_query}"
+    print(f"Refinando query: {refine_prompt}")
+    try:
+        payload = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": refine_prompt}], "max_tokens": 128}
+        with medir("refine"):
+            resp_json = await openai_client.chat_completion(payload, cache=True)
+        refined_query = resp_json["choices"][0]["message"]["content"].strip()
+        print(f"Query refinada: {refined_query}")
+        return refined_query
+    except OpenAISaturado:
+        raise
+    except Exception as e:
+        print(f"Erro ao refinar query: {e}")
+        return user_query
+
 async def expandir_query(query: str) -> list:
     """
     Expande uma query gerando variações e termos relacionados usando GPT-4.
+    OpenAISaturado é repassado, para a rota registrar a etapa como pulada.
     """
     prompt = f"""Gere 3 variações da seguinte pergunta, mantendo o significado principal mas usando diferentes palavras e estruturas:
     Pergunta original: {query}
@@ -152,35 +150,27 @@ async def expandir_query(query: str) -> list:
     Retorne apenas as variações, uma por linha, sem numeração ou marcadores."""
     
     try:
-        async with aiohttp.ClientSession() as session:
-            payload = {
-                "model": "gpt-4o-mini",
-                "messages": [{"role": "user", "content": prompt}],
-                "max_tokens": 150
-            }
-            headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
-            async with session.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload) as resp:
-                resp.raise_for_status()
-                variations = (await resp.json())["choices"][0]["message"]["content"].strip().split("\n")
-                return [query] + [v.strip() for v in variations if v.strip()]
+        payload = {
+            "model": "gpt-4o-mini",
+            "messages": [{"role": "user", "content": prompt}],
+            "max_tokens": 150
+        }
+        with medir("expand"):
+            resp_json = await openai_client.chat_completion(payload, cache=True, prioridade=PRIORIDADE_OPCIONAL)
+        variations = resp_json["choices"][0]["message"]["content"].strip().split("\n")
+        return [query] + [v.strip() for v in variations if v.strip()]
+    except OpenAISaturado:
+        raise
     except Exception as e:
         print(f"Erro ao expandir query: {e}")
         return [query]
 
-async def recursive_retrieval(query: str, vector_store, max_depth: int = 2) -> list:
+async def gerar_sub_queries(query: str, docs: list, n: int = 2) -> list:
     """
-    Implementa busca recursiva, gerando sub-queries baseadas nos resultados iniciais.
+    Gera perguntas complementares a partir dos primeiros documentos encontrados para uma query.
     """
-    all_docs = []
-    current_docs = await vector_store.asimilarity_search(query, k=5)
-    all_docs.extend(current_docs)
-    
-    if not current_docs or max_depth <= 0:
-        return all_docs
-    
-    # Gerar sub-queries baseadas nos resultados
-    context = "\n".join([doc.page_content for doc in current_docs[:3]])
-    sub_query_prompt = f"""Com base no seguinte contexto, gere 2 perguntas específicas que ajudariam a encontrar mais informações relevantes:
+    context = "\n".join([doc.page_content for doc in docs[:3]])
+    sub_query_prompt = f"""Com base no seguinte contexto, gere {n} perguntas específicas que ajudariam a encontrar mais informações relevantes:
     
     Contexto:
     {context}
@@ -189,25 +179,12 @@ async def recursive_retrieval(query: str, vector_store, max_depth: int = 2) -> l
     
     Retorne apenas as perguntas, uma por linha, sem numeração."""
     
-    try:
-        async with aiohttp.ClientSession() as session:
-            payload = {
-                "model": "gpt-4o-mini",
-                "messages": [{"role": "user", "content": sub_query_prompt}],
-                "max_tokens": 150
-            }
-            headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
-            async with session.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload) as resp:
-                resp.raise_for_status()
-                sub_queries = (await resp.json())["choices"][0]["message"]["content"].strip().split("\n")
-                
-                # Buscar documentos para cada sub-query
-                for sub_query in sub_queries:
-                    sub_query = sub_query.strip()
-                    if sub_query:
-                        sub_docs = await recursive_retrieval(sub_query, vector_store, max_depth - 1)
-                        all_docs.extend(sub_docs)
-    except Exception as e:
-        print(f"Erro na busca recursiva: {e}")
-    
-    return all_docs
\ No newline at end of file
+    payload = {
+        "model": "gpt-4o-mini",
+        "messages": [{"role": "user", "content": sub_query_prompt}],
+        "max_tokens": 150
+    }
+    with medir("sub_queries"):
+        resp_json = await openai_client.chat_completion(payload, prioridade=PRIORIDADE_OPCIONAL)
+    sub_queries = [q.strip() for q in resp_json["choices"][0]["message"]["content"].strip().split("\n") if q.strip()]
+    return sub_queries[:n]
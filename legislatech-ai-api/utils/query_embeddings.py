@@ -0,0 +1,105 @@
+# utils/query_embeddings.py
+import asyncio
+import numpy as np
+from config import embeddings, EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_PATH, LLM_CACHE_MODE, LLM_CACHE_PATH
+from utils.cache import LRUCache, SQLiteStore, normalizar_query
+from utils.completion_cache import CompletionCacheMiss
+from utils.metrics import medir
+
+
+class QueryEmbeddingCache:
+    """
+    Camada de embeddings de consultas na frente do modelo da OpenAI.
+    Embeda em lote todas as queries ainda desconhecidas e guarda os vetores
+    num LRU em memória (chave: modelo + texto normalizado), com camada opcional em disco.
+    Uma query que já está sendo embedada por outra requisição espera o mesmo resultado
+    em vez de gerar outra chamada (N perguntas iguais simultâneas, um embedding).
+
+    Segue os modos record/replay do cache de completions (LLM_CACHE_MODE): em record os
+    vetores novos são gravados em disco; em replay nada vai à rede e uma query sem
+    gravação levanta CompletionCacheMiss.
+    """
+
+    def __init__(self, embeddings_model, maxsize: int = 2048, disk_path: str | None = None, replay: bool = False):
+        self.embeddings = embeddings_model
+        self.replay = replay
+        self._memory = LRUCache(maxsize=maxsize)
+        self._disk = SQLiteStore(disk_path, table="query_embeddings") if disk_path else None
+        self._em_andamento: dict[str, asyncio.Future] = {}
+
+    @property
+    def model(self) -> str:
+        # Lido sob demanda: o modelo de embeddings só é construído no primeiro uso
+        return getattr(self.embeddings, "model", "desconhecido")
+
+    def _key(self, texto: str) -> str:
+        return f"{self.model}:{normalizar_query(texto)}"
+
+    def _lookup(self, key: str) -> list[float] | None:
+        vetor = self._memory.get(key)
+        if vetor is None and self._disk is not None:
+            raw = self._disk.get(key)
+            if raw is not None:
+                vetor = np.frombuffer(raw, dtype=np.float32).tolist()
+                self._memory.set(key, vetor)
+        return vetor
+
+    async def _embedar(self, faltantes: dict[str, str]) -> dict[str, list[float]]:
+        if self.replay:
+            for chave in faltantes:
+                self._em_andamento.pop(chave, None)
+            raise CompletionCacheMiss(f"Embedding sem gravação no modo replay: {list(faltantes.values())}")
+        try:
+            with medir("embed"):
+                vetores = await self.embeddings.aembed_documents(list(faltantes.values()))
+        finally:
+            for chave in faltantes:
+                self._em_andamento.pop(chave, None)
+        resultado = dict(zip(faltantes.keys(), vetores))
+        for chave, vetor in resultado.items():
+            self._memory.set(chave, vetor)
+            if self._disk is not None:
+                self._disk.set(chave, np.asarray(vetor, dtype=np.float32).tobytes())
+        return resultado
+
+    async def aembed_queries(self, textos: list[str]) -> list[list[float]]:
+        """Retorna os embeddings de todas as queries, com uma única chamada para as que faltam no cache."""
+        chaves = [self._key(t) for t in textos]
+        resolvidos, faltantes, tarefas = {}, {}, {}
+        for chave, texto in zip(chaves, textos):
+            if chave in resolvidos or chave in faltantes or chave in tarefas:
+                continue
+            vetor = self._lookup(chave)
+            if vetor is not None:
+                resolvidos[chave] = vetor
+            elif chave in self._em_andamento:
+                tarefas[chave] = self._em_andamento[chave]
+            else:
+                faltantes[chave] = texto
+
+        if faltantes:
+            # Task própria: quem chega depois espera por ela, e cancelar a requisição que a
+            # iniciou não cancela o embedding das outras
+            tarefa = asyncio.ensure_future(self._embedar(faltantes))
+            tarefa.add_done_callback(lambda t: t.cancelled() or t.exception())
+            for chave in faltantes:
+                self._em_andamento[chave] = tarefa
+                tarefas[chave] = tarefa
+
+        for chave, tarefa in tarefas.items():
+            resolvidos[chave] = (await asyncio.shield(tarefa))[chave]
+
+        return [resolvidos[chave] for chave in chaves]
+
+    async def aembed_query(self, texto: str) -> list[float]:
+        return (await self.aembed_queries([texto]))[0]
+
+
+# Instância compartilhada por todas as rotas
+# Em record/replay, sem EMBEDDING_CACHE_PATH os vetores ficam no mesmo arquivo das completions
+query_embeddings = QueryEmbeddingCache(
+    embeddings,
+    maxsize=EMBEDDING_CACHE_SIZE,
+    disk_path=EMBEDDING_CACHE_PATH or (LLM_CACHE_PATH if LLM_CACHE_MODE in ("record", "replay") else None),
+    replay=LLM_CACHE_MODE == "replay",
+)
@@ -0,0 +1,147 @@
+# utils/recursive_retrieval.py
+import time
+from dataclasses import dataclass
+from config import (
+    RETRIEVAL_BUDGET_SECONDS,
+    RECURSIVE_BEAM_WIDTH,
+    RECURSIVE_MAX_DEPTH,
+    RECURSIVE_MAX_SEARCHES,
+    RECURSIVE_SUB_QUERIES,
+)
+from utils.fanout import FanOut
+from utils.metrics import registrar_tempo
+from utils.prompt_helpers import buscar_similares, gerar_sub_queries
+from utils.query_embeddings import query_embeddings
+from utils.retrieval_context import RetrievalContext
+
+
+@dataclass
+class EstatisticaNivel:
+    """Custo e rendimento de um nível da busca recursiva."""
+    nivel: int
+    queries: int = 0
+    buscas: int = 0
+    chamadas_llm: int = 0
+    chunks_novos: int = 0
+    chunks_repetidos: int = 0
+    ramos_podados: int = 0
+    duracao_s: float = 0.0
+
+
+@dataclass
+class _Ramo:
+    query: str
+    docs: list
+    novos: int
+
+
+def _chunk_id(doc) -> str:
+    return doc.metadata.get("id") or doc.page_content
+
+
+class RecursiveRetriever:
+    """
+    Busca recursiva em largura com feixe limitado.
+    Cada nível busca todas as suas queries em paralelo; só os `beam_width` ramos que mais
+    trouxeram chunks inéditos geram sub-queries, ramos sem chunks novos não são expandidos
+    e o total de buscas nunca passa de `max_searches`.
+    """
+
+    def __init__(
+        self,
+        vs,
+        beam_width: int = RECURSIVE_BEAM_WIDTH,
+        max_depth: int = RECURSIVE_MAX_DEPTH,
+        max_searches: int = RECURSIVE_MAX_SEARCHES,
+        sub_queries_por_ramo: int = RECURSIVE_SUB_QUERIES,
+        k_raiz: int = 30,
+        k_sub: int = 5,
+    ):
+        self.vs = vs
+        self.beam_width = beam_width
+        self.max_depth = max_depth
+        self.max_searches = max_searches
+        self.sub_queries_por_ramo = sub_queries_por_ramo
+        self.k_raiz = k_raiz
+        self.k_sub = k_sub
+
+    async def run(self, queries: list[str], fanout: FanOut | None = None, contexto: RetrievalContext | None = None) -> tuple[list, list[EstatisticaNivel]]:
+        """
+        Executa a busca a partir das queries iniciais (nível 0).
+        Retorna os documentos sem repetição, na ordem em que apareceram, e as estatísticas por nível.
+        Com `contexto`, reaproveita os embeddings já calculados e registra os documentos encontrados.
+        """
+        fanout = fanout or FanOut(RETRIEVAL_BUDGET_SECONDS)
+        vistos = set()
+        docs_finais = []
+        estatisticas = []
+        buscas = 0
+
+        nivel_queries = [q for q in queries if fanout.reservar_query(q)][:self.max_searches]
+        k = self.k_raiz
+        inicio_recursao = None
+        for nivel in range(self.max_depth + 1):
+            if not nivel_queries or fanout.restante() <= 0:
+                break
+            inicio = time.monotonic()
+            stats = EstatisticaNivel(nivel=nivel, queries=len(nivel_queries), buscas=len(nivel_queries))
+            buscas += len(nivel_queries)
+
+            # Queries irmãs: um único lote de embeddings e buscas em paralelo
+            vetores = await fanout.run(contexto.aembed(nivel_queries) if contexto is not None else query_embeddings.aembed_queries(nivel_queries))
+            resultados = await fanout.gather([
+                fanout.run(buscar_similares(q, self.vs, k=k, embedding=v, filtros=contexto.filtros if contexto is not None else None))
+                for q, v in zip(nivel_queries, vetores)
+            ])
+
+            ramos = []
+            for q, docs in zip(nivel_queries, resultados):
+                novos = []
+                for doc in docs or []:
+                    chunk_id = _chunk_id(doc)
+                    if chunk_id in vistos:
+                        stats.chunks_repetidos += 1
+                        continue
+                    vistos.add(chunk_id)
+                    novos.append(doc)
+                stats.chunks_novos += len(novos)
+                if contexto is not None:
+                    contexto.registrar(novos)
+                docs_finais.extend(novos)
+                if novos:
+                    ramos.append(_Ramo(query=q, docs=docs, novos=len(novos)))
+                else:
+                    stats.ramos_podados += 1
+
+            restantes = self.max_searches - buscas
+            if nivel == self.max_depth or restantes <= 0 or not ramos:
+                stats.duracao_s = time.monotonic() - inicio
+                estatisticas.append(stats)
+                break
+
+            # Só os ramos mais produtivos geram sub-queries para o próximo nível
+            if inicio_recursao is None:
+                inicio_recursao = time.monotonic()
+            feixe = sorted(ramos, key=lambda r: r.novos, reverse=True)[:self.beam_width]
+            stats.chamadas_llm = len(feixe)
+            sub_listas = await fanout.gather([
+                fanout.run(gerar_sub_queries(r.query, r.docs, self.sub_queries_por_ramo))
+                for r in feixe
+            ])
+            proximas = [sq for subs in sub_listas for sq in (subs or []) if fanout.reservar_query(sq)]
+            nivel_queries = proximas[:restantes]
+            k = self.k_sub
+
+            stats.duracao_s = time.monotonic() - inicio
+            estatisticas.append(stats)
+
+        if inicio_recursao is not None:
+            # Custo dos níveis além do primeiro (sub-queries e buscas), para o orçamento de latência
+            registrar_tempo("recursao", time.monotonic() - inicio_recursao)
+        for s in estatisticas:
+            print(
+                f"Busca recursiva nível {s.nivel}: {s.buscas} buscas, {s.chamadas_llm} chamadas LLM, "
+                f"{s.chunks_novos} chunks novos, {s.chunks_repetidos} repetidos, "
+                f"{s.ramos_podados} ramos podados, {s.duracao_s:.2f}s"
+            )
+        return docs_finais, estatisticas
@@ -0,0 +1,137 @@
+# utils/rerank.py
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import RERANKER_BACKEND, RERANKER_MODEL, RERANKER_CACHE_DIR, RERANKER_TOP_N, RERANKER_BATCH_SIZE, RERANKER_THREADS
+from utils.latency_budget import LatencyBudget
+from utils.metrics import medir, registrar_tempo
+from utils.openai_client import openai_client
+from utils.openai_scheduler import OpenAISaturado
+
+
+class LLMReranker:
+    """Rerank com gpt-4o-mini: o modelo devolve os números dos trechos mais relevantes."""
+    nome = "llm"
+
+    async def rerank(self, query: str, docs: list, top_n: int) -> list:
+        formatted_chunks = [f"[{i+1}] {doc.page_content[:300]}..." for i, doc in enumerate(docs)]
+        rerank_instruction = f"Analise os trechos a seguir e escolha os 5-10 mais relevantes para a pergunta: '{query}'. Retorne apenas os números dos trechos, separados por vírgula.\n\n" + "\n".join(formatted_chunks)
+        rerank_payload = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": rerank_instruction}], "max_tokens": 50}
+
+        resp_json = await openai_client.chat_completion(rerank_payload, cache=True)
+        selected_indexes = [int(x.strip()) - 1 for x in resp_json["choices"][0]["message"]["content"].split(',') if x.strip().isdigit()]
+        return [docs[i] for i in selected_indexes if 0 <= i < len(docs)]
+
+
+class CrossEncoderReranker:
+    """
+    Rerank local em CPU com um cross-encoder ONNX (FlashRank). Os pares (pergunta, trecho)
+    são pontuados em lotes num pool de threads próprio, sem bloquear o event loop.
+    O modelo é carregado na primeira chamada; se o carregamento falhar, só é tentado de
+    novo após `espera_recarga` segundos.
+    """
+    nome = "local"
+    espera_recarga = 300
+
+    def __init__(self, model_name: str, cache_dir: str, batch_size: int = 16, threads: int = 2):
+        self.model_name = model_name
+        self.cache_dir = cache_dir
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="rerank")
+        self._ranker = None
+        self._falha_carga_em = None
+        self._lock = threading.Lock()
+
+    def _get_ranker(self):
+        with self._lock:
+            if self._ranker is None:
+                if self._falha_carga_em and time.monotonic() - self._falha_carga_em < self.espera_recarga:
+                    raise RuntimeError(f"Modelo {self.model_name} indisponível (falha recente ao carregar)")
+                try:
+                    from flashrank import Ranker
+                    # O Ranker chama logging.basicConfig; WARNING evita ligar logs INFO no processo todo
+                    self._ranker = Ranker(model_name=self.model_name, cache_dir=self.cache_dir, log_level="WARNING")
+                except Exception:
+                    self._falha_carga_em = time.monotonic()
+                    raise
+            return self._ranker
+
+    def _pontuar(self, query: str, textos: list[str]) -> list[float]:
+        from flashrank import RerankRequest
+        ranker = self._get_ranker()
+        scores = [0.0] * len(textos)
+        for inicio in range(0, len(textos), self.batch_size):
+            passages = [{"id": inicio + i, "text": texto} for i, texto in enumerate(textos[inicio:inicio + self.batch_size])]
+            for passage in ranker.rerank(RerankRequest(query=query, passages=passages)):
+                scores[passage["id"]] = float(passage["score"])
+        return scores
+
+    async def aquecer(self):
+        """Carrega o modelo antes da primeira requisição (aquecimento do lifespan)."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._get_ranker)
+
+    async def rerank(self, query: str, docs: list, top_n: int) -> list:
+        loop = asyncio.get_running_loop()
+        scores = await loop.run_in_executor(self._executor, self._pontuar, query, [doc.page_content for doc in docs])
+        ordem = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+        return [docs[i] for i in ordem[:top_n]]
+
+
+class RerankStage:
+    """
+    Etapa de rerank das rotas. Usa o backend configurado e, se ele falhar, o próximo
+    (local -> llm -> os primeiros candidatos). A latência de cada backend vai para o
+    histograma `rerank_<backend>` (/metrics), que também alimenta o orçamento de latência.
+    """
+
+    def __init__(self, backends: list, top_n: int = 8):
+        self.backends = backends
+        self.top_n = top_n
+
+    async def rerank(self, query: str, docs: list, orcamento: LatencyBudget | None = None) -> list:
+        """Com `orcamento`, backends cujo p95 não cabe no tempo restante são pulados."""
+        if not docs:
+            return []
+        with medir("rerank"):
+            return await self._rerank(query, docs, orcamento)
+
+    async def _rerank(self, query: str, docs: list, orcamento: LatencyBudget | None = None) -> list:
+        for backend in self.backends:
+            if orcamento is not None and not orcamento.cabe(f"rerank_{backend.nome}"):
+                continue
+            inicio = time.perf_counter()
+            try:
+                selecionados = await backend.rerank(query, docs, self.top_n)
+            except OpenAISaturado as e:
+                # Sem orçamento da OpenAI: a etapa aparece como pulada no stream
+                if orcamento is not None:
+                    orcamento.saturado(f"rerank_{backend.nome}", e)
+                continue
+            except Exception as e:
+                print(f"Erro no rerank ({backend.nome}), tentando o próximo. Erro: {e}")
+                continue
+            duracao = time.perf_counter() - inicio
+            registrar_tempo(f"rerank_{backend.nome}", duracao)
+            print(f"⏱️ Rerank {backend.nome}: {len(docs)} candidatos -> {len(selecionados)} em {duracao * 1000:.0f} ms")
+            if selecionados:
+                return selecionados
+        return docs[:5]
+
+    async def aquecer(self):
+        for backend in self.backends:
+            if hasattr(backend, "aquecer"):
+                await backend.aquecer()
+
+
+def _criar_rerank_stage() -> RerankStage:
+    llm = LLMReranker()
+    if RERANKER_BACKEND == "llm":
+        return RerankStage([llm], top_n=RERANKER_TOP_N)
+    local = CrossEncoderReranker(RERANKER_MODEL, RERANKER_CACHE_DIR, batch_size=RERANKER_BATCH_SIZE, threads=RERANKER_THREADS)
+    return RerankStage([local, llm], top_n=RERANKER_TOP_N)
+
+
+# Instância compartilhada por todas as rotas
+rerank_stage = _criar_rerank_stage()
@@ -0,0 +1,41 @@
+# utils/retrieval_context.py
+from dataclasses import dataclass, field
+from utils.query_embeddings import query_embeddings
+
+
+@dataclass
+class RetrievalContext:
+    """
+    O que a recuperação de uma requisição já calculou: embeddings das queries, a busca
+    semântica da query principal e todos os documentos encontrados, por id. Guarda também
+    os filtros de metadados que restringem todas as buscas da requisição.
+
+    A rota cria um contexto por requisição e o repassa às etapas seguintes (anotações,
+    montagem do contexto e do prompt, enriquecimento), que reaproveitam o que já existe
+    em vez de embedar ou buscar de novo.
+    """
+    query: str
+    vetores: dict[str, list[float]] = field(default_factory=dict)
+    documentos: list = field(default_factory=list)
+    por_id: dict = field(default_factory=dict)
+    filtros: dict = field(default_factory=dict)
+
+    async def aembed(self, queries: list[str]) -> list[list[float]]:
+        """Embeddings das queries; as que ainda não têm vetor vão num único lote."""
+        faltantes = [q for q in dict.fromkeys(queries) if q not in self.vetores]
+        if faltantes:
+            for q, vetor in zip(faltantes, await query_embeddings.aembed_queries(faltantes)):
+                self.vetores[q] = vetor
+        return [self.vetores[q] for q in queries]
+
+    async def embedding(self) -> list[float]:
+        """Embedding da query principal."""
+        return (await self.aembed([self.query]))[0]
+
+    def registrar(self, docs: list | None) -> list | None:
+        """Guarda os documentos trazidos por qualquer etapa, para as seguintes não buscarem de novo."""
+        for doc in docs or []:
+            doc_id = doc.metadata.get("id")
+            if doc_id is not None:
+                self.por_id.setdefault(doc_id, doc)
+        return docs
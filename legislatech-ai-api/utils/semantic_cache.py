@@ -0,0 +1,139 @@
+# utils/semantic_cache.py
+import time
+import uuid
+from dataclasses import dataclass, field
+import numpy as np
+from utils.cache import LRUCache
+
+
+@dataclass
+class EntradaSemantica:
+    """Uma pergunta já respondida: o conjunto final de chunks e a resposta."""
+    query: str
+    chunk_ids: list[str]
+    resposta: object
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+
+
+class SemanticCache:
+    """
+    Cache de perguntas quase iguais. Guarda o embedding normalizado de cada pergunta numa
+    matriz em memória; uma nova pergunta com similaridade de cosseno >= `threshold` com uma
+    pergunta cacheada da mesma rota reaproveita o resultado dela. Entradas vencidas (ttl)
+    liberam a vaga antes de qualquer entrada válida ser descartada.
+    """
+
+    def __init__(self, threshold: float = 0.95, maxsize: int = 2048, ttl: float | None = 3600, margem_quase_hit: float = 0.03):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.margem_quase_hit = margem_quase_hit
+        self._matriz: np.ndarray | None = None
+        self._rotas = np.full(maxsize, -1, dtype=np.int16)
+        self._criado_em = np.zeros(maxsize, dtype=np.float64)
+        self._usado_em = np.zeros(maxsize, dtype=np.float64)
+        self._entradas: list[EntradaSemantica | None] = [None] * maxsize
+        self._codigos_rota: dict[str, int] = {}
+        # response_id servido a partir do cache -> id da entrada (para registrar falsos hits)
+        self._servidos = LRUCache(maxsize=maxsize * 4, ttl=ttl)
+        self.consultas = 0
+        self.hits = 0
+        self.quase_hits = 0
+        self.falsos_hits = 0
+        self._soma_similaridade_hits = 0.0
+
+    def _codigo(self, route: str) -> int:
+        return self._codigos_rota.setdefault(route, len(self._codigos_rota))
+
+    @staticmethod
+    def _normalizar(embedding) -> np.ndarray:
+        vetor = np.asarray(embedding, dtype=np.float32)
+        norma = np.linalg.norm(vetor)
+        return vetor / norma if norma else vetor
+
+    def _liberar(self, slots: np.ndarray):
+        for slot in slots:
+            self._entradas[slot] = None
+        self._rotas[slots] = -1
+        self._usado_em[slots] = 0.0
+
+    def _podar(self):
+        """Libera as vagas das entradas vencidas."""
+        if self.ttl:
+            self._liberar(np.flatnonzero((self._rotas >= 0) & (self._criado_em < time.monotonic() - self.ttl)))
+
+    def _validos(self, route: str) -> np.ndarray:
+        validos = self._rotas == self._codigo(route)
+        if self.ttl:
+            validos &= self._criado_em >= time.monotonic() - self.ttl
+        return validos
+
+    def buscar(self, route: str, embedding) -> tuple[EntradaSemantica, float] | None:
+        """Retorna a entrada mais parecida (e a similaridade) se passar do limiar."""
+        self.consultas += 1
+        if self._matriz is None:
+            return None
+        validos = self._validos(route)
+        if not validos.any():
+            return None
+
+        similaridades = self._matriz @ self._normalizar(embedding)
+        similaridades[~validos] = -1.0
+        slot = int(np.argmax(similaridades))
+        melhor = float(similaridades[slot])
+        if melhor < self.threshold:
+            if melhor >= self.threshold - self.margem_quase_hit:
+                self.quase_hits += 1
+            return None
+
+        self.hits += 1
+        self._soma_similaridade_hits += melhor
+        self._usado_em[slot] = time.monotonic()
+        return self._entradas[slot], melhor
+
+    def adicionar(self, route: str, query: str, embedding, chunk_ids: list[str], resposta) -> EntradaSemantica:
+        vetor = self._normalizar(embedding)
+        if self._matriz is None:
+            self._matriz = np.zeros((self.maxsize, vetor.shape[0]), dtype=np.float32)
+
+        self._podar()
+        livres = np.flatnonzero(self._rotas < 0)
+        # Sem vaga livre, descarta a entrada usada há mais tempo
+        slot = int(livres[0]) if livres.size else int(np.argmin(self._usado_em))
+        agora = time.monotonic()
+        entrada = EntradaSemantica(query=query, chunk_ids=chunk_ids, resposta=resposta)
+        self._matriz[slot] = vetor
+        self._rotas[slot] = self._codigo(route)
+        self._criado_em[slot] = agora
+        self._usado_em[slot] = agora
+        self._entradas[slot] = entrada
+        return entrada
+
+    def registrar_servido(self, response_id: str, entrada: EntradaSemantica):
+        self._servidos.set(response_id, entrada.id)
+
+    def registrar_falso_hit(self, response_id: str) -> bool:
+        """
+        Marca como incorreta uma resposta servida pelo cache semântico:
+        conta o falso hit e remove a entrada para que não seja servida de novo.
+        """
+        entrada_id = self._servidos.pop(response_id)
+        if entrada_id is None:
+            return False
+        self.falsos_hits += 1
+        self._liberar(np.array([slot for slot, entrada in enumerate(self._entradas) if entrada is not None and entrada.id == entrada_id], dtype=np.int64))
+        return True
+
+    def stats(self) -> dict:
+        self._podar()
+        return {
+            "threshold": self.threshold,
+            "entradas": int((self._rotas >= 0).sum()),
+            "consultas": self.consultas,
+            "hits": self.hits,
+            "quase_hits": self.quase_hits,
+            "falsos_hits": self.falsos_hits,
+            "taxa_hit": self.hits / self.consultas if self.consultas else 0.0,
+            "taxa_falso_hit": self.falsos_hits / self.hits if self.hits else 0.0,
+            "similaridade_media_hits": self._soma_similaridade_hits / self.hits if self.hits else 0.0,
+        }
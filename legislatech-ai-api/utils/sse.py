@@ -7,4 +7,9 @@ def make_sse_event(event_name: str, data_payload: dict | str) -> str:
         data_str = json.dumps(data_payload, ensure_ascii=False)
     else:
         data_str = data_payload
-    return f"event: {event_name}\ndata: {data_str}\n\n"
\ No newline at end of file
+    return f"event: {event_name}\ndata: {data_str}\n\n"
+
+
+def make_error_event(code: str, message: str, **campos) -> str:
+    """Evento `error` para falhas depois que o stream abriu (o status HTTP já foi enviado)."""
+    return make_sse_event("error", {"type": "error", "code": code, "message": message, **campos})
@@ -0,0 +1,226 @@
+# utils/stream_buffer.py
+import asyncio
+from collections import deque
+from typing import AsyncGenerator
+from fastapi import Request
+from config import STREAM_BUFFER_TTL, STREAM_BUFFER_MAX_EVENTS, STREAM_BUFFER_MAX_RESPONSES, STREAM_RESUME_GRACE
+from utils.cache import LRUCache, normalizar_query
+from utils.disconnect import esperar_desconexao
+from utils.latency_budget import LatencyBudget
+from utils.metrics import Timings, respostas_compartilhadas, streams_cancelados
+from utils.sse import make_sse_event
+
+
+class StreamBuffer:
+    """
+    Eventos SSE de uma resposta, numerados em sequência (`id: <response_id>:<seq>`) e
+    guardados num buffer circular. A geração roda numa task própria; os leitores
+    (a conexão original e as reconexões) acompanham o buffer.
+    """
+
+    def __init__(self, response_id: str, rota: str, max_eventos: int):
+        self.response_id = response_id
+        self.rota = rota
+        self._eventos: deque[str] = deque(maxlen=max_eventos)
+        self._proximo_seq = 0
+        self._aviso = asyncio.Event()
+        self.concluido = False
+        self.erro: BaseException | None = None
+        self.tarefa: asyncio.Task | None = None
+        self.leitores = 0
+        self.timer_cancelamento: asyncio.TimerHandle | None = None
+
+    @property
+    def proximo_seq(self) -> int:
+        return self._proximo_seq
+
+    @property
+    def primeiro_seq(self) -> int:
+        return self._proximo_seq - len(self._eventos)
+
+    def pode_retomar(self, seq: int) -> bool:
+        """Se os eventos a partir de `seq` ainda estão no buffer."""
+        return self.primeiro_seq <= seq <= self._proximo_seq
+
+    def acordar(self):
+        self._aviso.set()
+        self._aviso = asyncio.Event()
+
+    def publicar(self, evento: str):
+        self._eventos.append(f"id: {self.response_id}:{self._proximo_seq}\n{evento}")
+        self._proximo_seq += 1
+        self.acordar()
+
+    def encerrar(self, erro: BaseException | None = None):
+        self.concluido = True
+        self.erro = erro
+        self.acordar()
+
+    async def esperar(self):
+        await self._aviso.wait()
+
+    def eventos_desde(self, seq: int) -> list[str]:
+        inicio = max(seq, self.primeiro_seq) - self.primeiro_seq
+        return [self._eventos[i] for i in range(inicio, len(self._eventos))]
+
+
+class StreamStore:
+    """
+    Respostas em andamento ou recém-terminadas, por response_id, com TTL.
+
+    Quando o último leitor sai antes do fim (cliente desconectou), a geração continua por
+    `grace` segundos à espera de uma reconexão com `Last-Event-ID`; se ninguém voltar,
+    a task é cancelada (buscas, rerank, enriquecimento e o stream da OpenAI) e o
+    cancelamento é contado em `streams_cancelados`. O `grace` fica curto (padrão 2 s):
+    cobre a queda e reconexão imediata do EventSource, sem deixar a maioria das respostas
+    terminar (e gastar os tokens) depois que o cliente foi embora. Uma reconexão mais
+    tardia não retoma a resposta cancelada e refaz a pergunta.
+
+    Perguntas iguais (mesma rota e pergunta normalizada) que chegam enquanto uma resposta
+    está sendo gerada acompanham o mesmo buffer desde o primeiro evento: N requisições
+    simultâneas custam uma execução do pipeline. Só se juntam requisições da mesma
+    `variante` (ver `variante_requisicao`): com outro orçamento de latência ou outro modo de
+    depuração, a resposta em andamento não serve.
+    """
+
+    def __init__(self, ttl: float = 120, max_eventos: int = 2048, max_respostas: int = 1024, grace: float = 2):
+        self._buffers = LRUCache(maxsize=max_respostas, ttl=ttl)
+        self.max_eventos = max_eventos
+        self.grace = grace
+        self._em_andamento: dict[str, StreamBuffer] = {}
+
+    @staticmethod
+    def chave(rota: str, query: str, variante: str = "") -> str:
+        return f"{rota}:{variante}:{normalizar_query(query)}"
+
+    def iniciar(self, request: Request, response_id: str, eventos: AsyncGenerator[str, None], rota: str, query: str | None = None, variante: str = "") -> AsyncGenerator[str, None]:
+        """
+        Começa a gerar a resposta em segundo plano e retorna o leitor da conexão atual.
+        Com `query`, a resposta fica disponível para `acompanhar` (na mesma variante) até terminar.
+        """
+        buffer = StreamBuffer(response_id, rota, self.max_eventos)
+        chave = self.chave(rota, query, variante) if query else None
+
+        async def produzir():
+            try:
+                async for evento in eventos:
+                    buffer.publicar(evento)
+            except asyncio.CancelledError:
+                buffer.encerrar(asyncio.CancelledError())
+                raise
+            except Exception as e:
+                buffer.encerrar(e)
+            else:
+                buffer.encerrar()
+            finally:
+                if chave and self._em_andamento.get(chave) is buffer:
+                    del self._em_andamento[chave]
+                # Renova o TTL a partir do fim da geração
+                self._buffers.set(response_id, buffer)
+
+        buffer.tarefa = asyncio.create_task(produzir())
+        self._buffers.set(response_id, buffer)
+        if chave:
+            self._em_andamento[chave] = buffer
+        return self.seguir(request, buffer, 0)
+
+    def retomar(self, request: Request, rota: str) -> AsyncGenerator[str, None] | None:
+        """
+        Reconexão com `Last-Event-ID: <response_id>:<seq>`: retorna o leitor a partir do
+        evento seguinte, ou None se a resposta não está mais no buffer.
+        """
+        last_event_id = request.headers.get("last-event-id", "")
+        response_id, _, seq = last_event_id.rpartition(":")
+        if not response_id or not seq.isdigit():
+            return None
+        buffer = self._buffers.get(response_id)
+        if buffer is None or buffer.rota != rota or not buffer.pode_retomar(int(seq) + 1):
+            return None
+        if isinstance(buffer.erro, asyncio.CancelledError):
+            return None
+        print(f"↩️ Retomando {response_id} a partir do evento {int(seq) + 1}.")
+        return self.seguir(request, buffer, int(seq) + 1)
+
+    def acompanhar(self, request: Request, rota: str, query: str, variante: str = "") -> AsyncGenerator[str, None] | None:
+        """
+        Se a mesma pergunta já está sendo respondida nesta rota e variante, retorna um leitor
+        desse stream a partir do primeiro evento; senão None.
+        """
+        buffer = self._em_andamento.get(self.chave(rota, query, variante))
+        if buffer is None or buffer.concluido or not buffer.pode_retomar(0):
+            return None
+        respostas_compartilhadas.labels(rota=rota).inc()
+        print(f"🔗 Pergunta igual em andamento, acompanhando {buffer.response_id}.")
+        return self.seguir(request, buffer, 0)
+
+    def _cancelar(self, buffer: StreamBuffer):
+        buffer.timer_cancelamento = None
+        if buffer.leitores == 0 and not buffer.concluido and buffer.tarefa is not None:
+            buffer.tarefa.cancel()
+            streams_cancelados.labels(rota=buffer.rota).inc()
+            print(f"🔌 Cliente desconectou, resposta {buffer.rota} cancelada.")
+
+    async def seguir(self, request: Request, buffer: StreamBuffer, seq: int) -> AsyncGenerator[str, None]:
+        buffer.leitores += 1
+        if buffer.timer_cancelamento is not None:
+            buffer.timer_cancelamento.cancel()
+            buffer.timer_cancelamento = None
+
+        desconectou = False
+
+        async def vigiar():
+            nonlocal desconectou
+            await esperar_desconexao(request)
+            desconectou = True
+            buffer.acordar()
+
+        vigia = asyncio.create_task(vigiar())
+        try:
+            while not desconectou:
+                if seq < buffer.primeiro_seq:
+                    # O leitor ficou para trás além do tamanho do buffer: avisa que a resposta
+                    # está incompleta em vez de encerrar o stream como se tivesse terminado
+                    print(f"⚠️ Leitor de {buffer.response_id} ficou para trás do buffer (evento {seq}, primeiro {buffer.primeiro_seq}).")
+                    yield make_sse_event("error", {
+                        "type": "error",
+                        "code": "stream_truncated",
+                        "message": "A resposta foi truncada: eventos já descartados do buffer. Refaça a pergunta.",
+                        "response_id": buffer.response_id,
+                    })
+                    break
+                for evento in buffer.eventos_desde(seq):
+                    seq += 1
+                    yield evento
+                if seq < buffer.proximo_seq:
+                    continue
+                if buffer.concluido:
+                    if buffer.erro is not None and not isinstance(buffer.erro, asyncio.CancelledError):
+                        raise buffer.erro
+                    break
+                await buffer.esperar()
+        finally:
+            vigia.cancel()
+            buffer.leitores -= 1
+            if buffer.leitores == 0 and not buffer.concluido:
+                loop = asyncio.get_running_loop()
+                buffer.timer_cancelamento = loop.call_later(self.grace, self._cancelar, buffer)
+
+
+def variante_requisicao(timings: Timings, orcamento: LatencyBudget | None = None) -> str:
+    """
+    O que muda a resposta além da pergunta: o orçamento de latência (uma resposta com
+    etapas puladas não serve a quem tem orçamento maior, e a completa estoura um orçamento
+    menor) e o evento de tempos do modo de depuração.
+    """
+    segundos = orcamento.segundos if orcamento is not None else None
+    ms = "sem" if segundos is None else str(round(segundos * 1000))
+    return f"orcamento={ms};debug={int(timings.debug)}"
+
+
+# Instância compartilhada por todas as rotas
+stream_store = StreamStore(
+    ttl=STREAM_BUFFER_TTL,
+    max_eventos=STREAM_BUFFER_MAX_EVENTS,
+    max_respostas=STREAM_BUFFER_MAX_RESPONSES,
+    grace=STREAM_RESUME_GRACE,
+)
@@ -0,0 +1,112 @@
+# utils/stream_writer.py
+import asyncio
+import time
+from typing import AsyncGenerator, AsyncIterator
+from config import STREAM_FLUSH_INTERVAL, STREAM_FLUSH_BYTES
+from utils.metrics import registrar_tempo, tempo_desde_inicio
+from utils.sse import make_sse_event
+
+
+class DeltaStreamWriter:
+    """
+    Converte os deltas do LLM em eventos `response.output_text.delta`, agrupando vários
+    deltas num mesmo evento: o que chegou é enviado quando acumula `flush_bytes` ou quando
+    passa `flush_interval` segundos desde o último envio. Com `flush_interval=0` cada delta
+    vira um evento. O texto completo fica em `texto` ao final.
+    """
+
+    def __init__(self, item_id: str, flush_interval: float = STREAM_FLUSH_INTERVAL, flush_bytes: int = STREAM_FLUSH_BYTES):
+        self.item_id = item_id
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self._partes: list[str] = []
+
+    @property
+    def texto(self) -> str:
+        return "".join(self._partes)
+
+    def _evento(self, delta: str) -> str:
+        return make_sse_event("response.output_text.delta", {
+            "type": "response.output_text.delta",
+            "item_id": self.item_id,
+            "output_index": 1,
+            "content_index": 0,
+            "delta": delta
+        })
+
+    @staticmethod
+    async def _medir_geracao(deltas: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+        """
+        Registra o tempo até o primeiro token (desde o início da requisição e desde a
+        chamada à OpenAI) e a duração da geração.
+        """
+        inicio = time.perf_counter()
+        primeiro = True
+        async for delta in deltas:
+            if primeiro:
+                primeiro = False
+                registrar_tempo("primeiro_token", time.perf_counter() - inicio)
+                ttft = tempo_desde_inicio()
+                if ttft is not None:
+                    registrar_tempo("ttft", ttft)
+            yield delta
+        registrar_tempo("geracao", time.perf_counter() - inicio)
+
+    async def stream(self, deltas: AsyncIterator[str]) -> AsyncGenerator[str, None]:
+        deltas = self._medir_geracao(deltas)
+        if self.flush_interval <= 0:
+            async for delta in deltas:
+                self._partes.append(delta)
+                yield self._evento(delta)
+            return
+
+        # Um produtor consome o upstream e acorda o consumidor só quando o primeiro delta
+        # de um lote chega (para armar o timer), quando o lote atinge o tamanho ou no fim
+        loop = asyncio.get_running_loop()
+        sinal = asyncio.Event()
+        pendentes: list[str] = []
+        estado = {"tamanho": 0, "fim": False, "erro": None}
+
+        async def produzir():
+            try:
+                async for delta in deltas:
+                    self._partes.append(delta)
+                    pendentes.append(delta)
+                    estado["tamanho"] += len(delta.encode())
+                    if len(pendentes) == 1 or estado["tamanho"] >= self.flush_bytes:
+                        sinal.set()
+            except Exception as e:
+                estado["erro"] = e
+            finally:
+                estado["fim"] = True
+                sinal.set()
+
+        produtor = asyncio.create_task(produzir())
+        timer = None
+        ultimo_envio = time.monotonic()
+        try:
+            while True:
+                await sinal.wait()
+                sinal.clear()
+                agora = time.monotonic()
+                if pendentes and not estado["fim"] and estado["tamanho"] < self.flush_bytes and agora - ultimo_envio < self.flush_interval:
+                    if timer is None:
+                        timer = loop.call_later(ultimo_envio + self.flush_interval - agora, sinal.set)
+                    continue
+                if timer is not None:
+                    timer.cancel()
+                    timer = None
+                if pendentes:
+                    lote = "".join(pendentes)
+                    pendentes.clear()
+                    estado["tamanho"] = 0
+                    ultimo_envio = agora
+                    yield self._evento(lote)
+                if estado["fim"]:
+                    break
+            if estado["erro"] is not None:
+                raise estado["erro"]
+        finally:
+            if timer is not None:
+                timer.cancel()
+            produtor.cancel()
@@ -0,0 +1,107 @@
+# utils/warmup.py
+"""
+Aquecimento da API, disparado no lifespan (ver main.py) sem bloquear o servidor.
+
+Etapas obrigatórias: tokenizer (lido de TIKTOKEN_CACHE_DIR), pools do Postgres (síncrono
+e assíncrono, abrindo `pool_size` conexões) e o vector store. Opcionais: páginas do índice
+BM25 e o modelo do rerank local. `/ready` responde 200 quando todas as obrigatórias
+terminaram; as que falham são tentadas de novo a cada `intervalo_retentativa` segundos.
+"""
+import asyncio
+import time
+from sqlalchemy import text
+from config import async_engine, engine, tiktoken_encoder, vector_store
+from utils.bm25_index import get_bm25_index
+from utils.metrics import import_ate_pronto
+from utils.rerank import rerank_stage
+
+
+async def _tokenizer():
+    await asyncio.to_thread(tiktoken_encoder.obter)
+
+
+async def _pool_async():
+    motor = async_engine.obter()
+
+    async def conectar():
+        async with motor.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    await asyncio.gather(*(conectar() for _ in range(motor.pool.size())))
+
+
+def _pool_sync():
+    motor = engine.obter()
+    conexoes = []
+    try:
+        for _ in range(motor.pool.size()):
+            conexoes.append(motor.connect())
+            conexoes[-1].execute(text("SELECT 1"))
+    finally:
+        for conn in conexoes:
+            conn.close()
+
+
+async def _vector_store():
+    # Importa o langchain e cria o PGVector fora do event loop; a consulta inicializa a coleção
+    await asyncio.to_thread(vector_store.obter)
+    await vector_store.aget_by_ids([])
+
+
+async def _bm25():
+    indice = await asyncio.to_thread(get_bm25_index)
+    if indice is not None:
+        await asyncio.to_thread(indice.tocar)
+
+
+class Warmup:
+    def __init__(self, intervalo_retentativa: float = 5):
+        self.intervalo_retentativa = intervalo_retentativa
+        self.pronto = False
+        self.import_ate_pronto_s: float | None = None
+        self.etapas: dict[str, dict] = {}
+        self._etapas = [
+            ("tokenizer", _tokenizer, True),
+            ("postgres_async", _pool_async, True),
+            ("postgres_sync", lambda: asyncio.to_thread(_pool_sync), True),
+            ("vector_store", _vector_store, True),
+            ("bm25", _bm25, False),
+            ("rerank", rerank_stage.aquecer, False),
+        ]
+
+    async def _executar_etapa(self, nome: str, etapa, obrigatoria: bool) -> bool:
+        inicio = time.perf_counter()
+        try:
+            await etapa()
+        except Exception as e:
+            self.etapas[nome] = {"ok": False, "obrigatoria": obrigatoria, "ms": round((time.perf_counter() - inicio) * 1000, 1), "erro": str(e)}
+            print(f"⚠️ Aquecimento: {nome} falhou: {e}")
+            return False
+        self.etapas[nome] = {"ok": True, "obrigatoria": obrigatoria, "ms": round((time.perf_counter() - inicio) * 1000, 1)}
+        return True
+
+    async def executar(self, inicio_import: float):
+        """Roda as etapas em paralelo; repete as obrigatórias que falharam até todas passarem."""
+        pendentes = self._etapas
+        while True:
+            resultados = await asyncio.gather(*(self._executar_etapa(*etapa) for etapa in pendentes))
+            pendentes = [etapa for etapa, ok in zip(pendentes, resultados) if not ok and etapa[2]]
+            if not pendentes:
+                break
+            await asyncio.sleep(self.intervalo_retentativa)
+
+        self.import_ate_pronto_s = time.perf_counter() - inicio_import
+        self.pronto = True
+        import_ate_pronto.set(self.import_ate_pronto_s)
+        print(f"✅ API pronta: {self.import_ate_pronto_s:.2f}s da importação ao fim do aquecimento.")
+
+    def resumo(self) -> dict:
+        return {
+            "ready": self.pronto,
+            "import_to_ready_s": round(self.import_ate_pronto_s, 3) if self.import_ate_pronto_s is not None else None,
+            "etapas": self.etapas,
+        }
+
+
+# Instância compartilhada (lifespan e /ready)
+warmup = Warmup()